@@ -0,0 +1,156 @@
+"""What the load balancing apps share: reading the load, timing the balance passes, queueing the circuit dynamic
+limit commands, and storing and publishing what they do."""
+from __future__ import annotations
+
+from math import ceil
+import time
+from typing import Callable
+
+import appdaemon.plugins.hass.hassapi as hass
+
+from common import Currents
+from limit_commands import LimitCommandQueue
+from metrics import Metrics, serve_metrics
+from profiling import Profiler
+from state_store import StateStore
+
+
+class BalancingApp(hass.Hass):
+    """Base of the load balancing apps.
+
+    Subclasses implement balance_pass, and limit_queues, which names the command queue of each circuit in the state
+    file.
+    """
+    circuit_dynamic_limit_target_timeout = 120  # seconds
+    circuit_dynamic_limit_min_interval = 10  # seconds, between raising commands
+    limit_queue_timers: dict[LimitCommandQueue, str] = {}
+    current_l1_entity = None
+    current_l2_entity = None
+    current_l3_entity = None
+    balance_passes = 0
+    balance_time = 0.0  # seconds, in total
+    state_store: StateStore | None = None
+    metrics: Metrics = None
+    metrics_entity_id: str | None = None
+    metrics_interval = 60  # seconds, between updates of the metrics sensor
+    profiler: Profiler | None = None
+
+    def configure_metrics(self):
+        """Metrics are always collected. Optionally, they are published as the attributes of a sensor, at a limited
+        rate, and/or served to Prometheus."""
+        self.metrics = Metrics(self.name)
+        self.metrics_entity_id = self.args.get('metrics_entity_id')
+        self.metrics_interval = float(self.args.get('metrics_interval_seconds', self.metrics_interval))
+        if 'metrics_port' in self.args:
+            serve_metrics(int(self.args['metrics_port']))
+
+    def configure_load_sensors(self) -> tuple[str, str, str]:
+        """Read the instantaneous current sensors. Returns their entity ids, L1 to L3."""
+        entity_ids = (str(self.args['current_l1_entity_id']),
+                      str(self.args['current_l2_entity_id']),
+                      str(self.args['current_l3_entity_id']))
+        self.current_l1_entity, self.current_l2_entity, self.current_l3_entity = map(self.get_entity, entity_ids)
+        return entity_ids
+
+    def new_limit_queue(self, send: Callable[[Currents], None]) -> LimitCommandQueue:
+        """A circuit dynamic limit command queue, so that lowering is never stuck behind raising, and rate limited."""
+        self.circuit_dynamic_limit_min_interval = float(self.args.get('circuit_dynamic_limit_min_interval_seconds',
+                                                                      self.circuit_dynamic_limit_min_interval))
+        return LimitCommandQueue(send, self.circuit_dynamic_limit_min_interval, self.circuit_dynamic_limit_target_timeout)
+
+    def load_state(self):
+        """Optionally, keep the commands in flight over restarts, so that they are not sent again."""
+        self.limit_queue_timers = {}
+        if 'state_file' in self.args:
+            self.state_store = StateStore(str(self.args['state_file']))
+            for key, limit_queue in self.limit_queues().items():
+                limit_queue.load(self.state_store.get(key, {}), self.monotonic())
+
+    def limit_queues(self) -> dict[str, LimitCommandQueue]:
+        """The circuit dynamic limit command queues, by their keys in the state file."""
+        raise NotImplementedError
+
+    def limit_queue_state(self) -> dict[str, dict]:
+        """The commands in flight, to store."""
+        return {key: limit_queue.dump() for key, limit_queue in self.limit_queues().items()}
+
+    def save_state(self):
+        """Store the commands in flight, if a state file is configured."""
+        if self.state_store is not None:
+            self.state_store.update(self.limit_queue_state())
+
+    def monotonic(self) -> float:
+        """Seconds from a monotonic clock, for timing samples and commands."""
+        return time.monotonic()
+
+    def read_load(self) -> Currents | None:
+        """The current load on each phase, read from the sensors, or None if any of them is unavailable."""
+        self.metrics.increment('entity_reads', 3)
+        try:
+            return Currents(float(self.current_l1_entity.state),
+                            float(self.current_l2_entity.state),
+                            float(self.current_l3_entity.state))
+        except (TypeError, ValueError):
+            return None
+
+    def balance(self, *args, **kwargs):
+        """Make sure that the currents are not higher than the main fuse."""
+        started = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                self.profiler.call(self.balance_pass)
+            else:
+                self.balance_pass()
+            self.save_state()
+        finally:
+            duration = time.perf_counter() - started
+            self.balance_passes += 1
+            self.balance_time += duration
+            self.metrics.increment('balance_passes')
+            self.metrics.observe('balance_pass_seconds', duration)
+            self.log(f"Balance pass {self.balance_passes} took {duration * 1000:.1f} ms "
+                     f"(average {self.balance_time / self.balance_passes * 1000:.1f} ms)", level="DEBUG")
+
+    def balance_pass(self):
+        """One pass of balancing the load."""
+        raise NotImplementedError
+
+    def publish_metrics_cb(self, _):
+        """Timer callback for updating the metrics sensor."""
+        return self.set_state(self.metrics_entity_id, state=self.balance_passes,
+                              attributes=self.metrics.sensor_attributes())
+
+    def confirm_limit(self, limit_queue: LimitCommandQueue, circuit_dynamic_limit: Currents) -> bool:
+        """Tell a command queue the circuit dynamic limit read from the charger. Returns True if that is the target
+        of the command in flight, and then sends the next command, if one is waiting."""
+        latency = limit_queue.confirmation_latency
+        if not limit_queue.confirm(circuit_dynamic_limit, self.monotonic()):
+            return False
+        self.metrics.observe('limit_confirmation_seconds', limit_queue.confirmation_latency - latency)
+        self.schedule_limit_queue_poll(limit_queue, limit_queue.poll(self.monotonic()))
+        return True
+
+    def schedule_limit_queue_poll(self, limit_queue: LimitCommandQueue, wait: float | None):
+        """Poll a command queue again after *wait* seconds, if a command is waiting."""
+        if wait is None or limit_queue in self.limit_queue_timers:
+            return
+        self.log(f"Circuit dynamic limit command waiting {wait:.0f} s (queue depth {limit_queue.depth}).",
+                 level="DEBUG")
+        self.limit_queue_timers[limit_queue] = self.run_in(self.limit_queue_cb, max(1, ceil(wait)),
+                                                           limit_queue=limit_queue)
+
+    def limit_queue_cb(self, kwargs):
+        """Timer callback for sending a waiting circuit dynamic limit command."""
+        limit_queue = kwargs['limit_queue']
+        self.limit_queue_timers.pop(limit_queue, None)
+        self.poll_limit_queue(limit_queue)
+
+    def poll_limit_queue(self, limit_queue: LimitCommandQueue):
+        """Send the waiting command of a queue, if allowed, and poll it again when needed."""
+        timeouts = limit_queue.timeouts
+        wait = limit_queue.poll(self.monotonic())
+        if limit_queue.timeouts > timeouts:
+            self.log(f"Circuit dynamic limit target was not reached within {self.circuit_dynamic_limit_target_timeout} seconds.",
+                     level="INFO")
+        self.save_state()
+        self.schedule_limit_queue_poll(limit_queue, wait)
@@ -0,0 +1,57 @@
+"""Compare create_schedules with calling create_schedule for one vehicle at a time, both with the prices as a list
+of dicts and as a PriceSeries.
+
+Run from the repository root:
+
+    python -m benchmarks.create_schedules
+"""
+from datetime import datetime, timedelta, timezone
+import random
+import timeit
+
+from price_series import PriceSeries
+from scheduling import create_schedule, create_schedules, get_prices, get_price_series, NotEnoughTimeException
+
+
+def build_requests(start: datetime, count: int) -> list[tuple[datetime, datetime, timedelta]]:
+    """Vehicles arriving during the first day, departing within two days, needing up to 8 hours of charging."""
+    requests = []
+    for _ in range(count):
+        arrival = start + timedelta(minutes=random.randrange(0, 24 * 60))
+        departure = arrival + timedelta(minutes=random.randrange(4 * 60, 24 * 60))
+        requests.append((arrival, departure, timedelta(minutes=random.randrange(15, 8 * 60))))
+    return requests
+
+
+def create_schedules_one_at_a_time(prices: list[dict] | PriceSeries,
+                                   requests: list[tuple[datetime, datetime, timedelta]]):
+    get = get_price_series if isinstance(prices, PriceSeries) else get_prices
+    schedules = []
+    for start, departure, needed_time in requests:
+        try:
+            schedules.append(create_schedule(get(prices, start, departure), needed_time))
+        except NotEnoughTimeException:
+            schedules.append(None)
+    return schedules
+
+
+def main():
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    period = timedelta(minutes=15)
+    prices = PriceSeries([start + i * period for i in range(2 * 96)],
+                         [start + (i + 1) * period for i in range(2 * 96)],
+                         [random.uniform(0, 1) for _ in range(2 * 96)])
+    periods = prices.to_periods()
+    print(f"{'vehicles':>8} {'dicts':>12} {'series':>12} {'batch':>12}")
+    for count in (10, 100, 1000):
+        requests = build_requests(start, count)
+        number = max(1, 1000 // count)
+        timings = [min(timeit.repeat(run, number=number, repeat=3)) / number for run in (
+            lambda: create_schedules_one_at_a_time(periods, requests),
+            lambda: create_schedules_one_at_a_time(prices, requests),
+            lambda: create_schedules(prices, requests),
+        )]
+        print(f"{count:>8} " + " ".join(f"{t * 1000:>9.2f} ms" for t in timings))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Measure how create_site_schedules scales with the number of chargers and the horizon length.
+
+Run from the repository root:
+
+    python -m benchmarks.create_site_schedules
+"""
+from datetime import datetime, timedelta, timezone
+import random
+import timeit
+
+from price_series import PriceSeries
+from scheduling import create_site_schedules
+
+
+def build_requests(start: datetime, count: int, days: int) -> list[tuple[datetime, datetime, timedelta, float]]:
+    """Chargers connected during the first day, departing within the horizon, needing up to 8 hours of charging."""
+    requests = []
+    for _ in range(count):
+        arrival = start + timedelta(minutes=random.randrange(0, 24 * 60))
+        departure = arrival + timedelta(minutes=random.randrange(4 * 60, days * 24 * 60))
+        requests.append((arrival, departure, timedelta(minutes=random.randrange(15, 8 * 60)), 16))
+    return requests
+
+
+def main():
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    period = timedelta(minutes=15)
+    print(f"{'chargers':>8} {'1 d':>12} {'7 d':>12}")
+    for count in (1, 5, 10, 25, 50):
+        timings = []
+        for days in (1, 7):
+            periods = days * 96 + 96
+            prices = PriceSeries([start + i * period for i in range(periods)],
+                                 [start + (i + 1) * period for i in range(periods)],
+                                 [random.uniform(0, 1) for _ in range(periods)])
+            requests = build_requests(start, count, days)
+            # Room for about a third of the chargers at a time.
+            site_capacity = 16 * max(1, count // 3)
+            number = max(1, 100 // count)
+            timings.append(min(timeit.repeat(lambda: create_site_schedules(prices, requests, site_capacity),
+                                              number=number, repeat=3)) / number)
+        print(f"{count:>8} " + " ".join(f"{t * 1000:>9.2f} ms" for t in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Compare the per-operation cost of Currents with the previous, dict-based, implementation.
+
+Run from the repository root:
+
+    python -m benchmarks.currents
+"""
+import timeit
+
+from common import Currents, Phase
+
+
+class DictCurrents:
+    """The previous implementation, storing the currents in a dict keyed by phase."""
+
+    def __init__(self, p1: float, p2: float, p3: float):
+        self._currents = {Phase.P1: p1, Phase.P2: p2, Phase.P3: p3}
+
+    @property
+    def p1(self):
+        return self._currents[Phase.P1]
+
+    @property
+    def p2(self):
+        return self._currents[Phase.P2]
+
+    @property
+    def p3(self):
+        return self._currents[Phase.P3]
+
+    def min(self):
+        return min(self._currents.values())
+
+    def max_phase(self) -> Phase:
+        return max(self._currents, key=self._currents.get)
+
+    def __getitem__(self, item: Phase):
+        return self._currents[item]
+
+    def __setitem__(self, key: Phase, value: float):
+        self._currents[key] = value
+
+    def __eq__(self, other):
+        return self.p1 == other.p1 and self.p2 == other.p2 and self.p3 == other.p3
+
+
+def main():
+    number = 200_000
+    print(f"{'operation':>24} {'dict':>10} {'slots':>10}")
+    for name, statement in [
+        ("create", "cls(10.0, 20.0, 30.0)"),
+        ("p1", "a.p1"),
+        ("min()", "a.min()"),
+        ("max_phase()", "a.max_phase()"),
+        ("[Phase.P2]", "a[Phase.P2]"),
+        ("==", "a == b"),
+        ("copy, subtract phase", "c = cls(a.p1, a.p2, a.p3); c[Phase.P2] -= 16"),
+    ]:
+        timings = []
+        for cls in (DictCurrents, Currents):
+            setup = {'cls': cls, 'Phase': Phase, 'a': cls(10.0, 20.0, 30.0), 'b': cls(10.0, 20.0, 31.0)}
+            timings.append(min(timeit.repeat(statement, globals=setup, number=number, repeat=3)) / number)
+        print(f"{name:>24} " + " ".join(f"{t * 1e9:>7.0f} ns" for t in timings))
+
+
+if __name__ == '__main__':
+    main()
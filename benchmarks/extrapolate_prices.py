@@ -0,0 +1,51 @@
+"""Compare extrapolate_prices with the previous, quadratic, implementation.
+
+Run from the repository root:
+
+    python -m benchmarks.extrapolate_prices
+"""
+from datetime import datetime, timedelta, timezone
+import random
+import timeit
+
+from scheduling import extrapolate_prices
+
+
+def extrapolate_prices_quadratic(prices: list[dict], end: datetime) -> list[dict]:
+    """The previous implementation, which scans from the first period for every added period."""
+    filled = [p for p in prices]
+    filled_end = lambda: filled[-1]['end']
+    get_previous_day_period = lambda start: next((p for p in filled if p['start'] >= start - timedelta(days=1)))
+    while filled_end() < end:
+        previous_day_period = get_previous_day_period(filled_end())
+        filled.append({
+            'start': previous_day_period['start'] + timedelta(days=1),
+            'end': previous_day_period['end'] + timedelta(days=1),
+            'value': previous_day_period['value']
+        })
+    if filled[-1]['start'] < end < filled[-1]['end']:
+        filled[-1] = {**filled[-1], 'end': end}
+    return filled
+
+
+def build_prices(start: datetime, days: int, period: timedelta) -> list[dict]:
+    return [{'start': start + i * period, 'end': start + (i + 1) * period, 'value': random.uniform(0, 1)}
+            for i in range(int(timedelta(days=days) / period))]
+
+
+def main():
+    period = timedelta(minutes=15)
+    known_prices = build_prices(datetime(2025, 1, 1, tzinfo=timezone.utc), 2, period)
+    print(f"{'horizon':>8} {'quadratic':>12} {'linear':>12} {'speedup':>8}")
+    for days in (1, 7, 30):
+        end = known_prices[-1]['end'] + timedelta(days=days)
+        assert extrapolate_prices(known_prices, end) == extrapolate_prices_quadratic(known_prices, end)
+        number = max(1, 30 // days)
+        quadratic = min(timeit.repeat(lambda: extrapolate_prices_quadratic(known_prices, end),
+                                      number=number, repeat=3)) / number
+        linear = min(timeit.repeat(lambda: extrapolate_prices(known_prices, end), number=number, repeat=3)) / number
+        print(f"{days:>6} d {quadratic * 1000:>9.2f} ms {linear * 1000:>9.2f} ms {quadratic / linear:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
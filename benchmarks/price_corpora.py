@@ -0,0 +1,53 @@
+"""Synthetic price data, shaped like the raw prices of the Nordpool integration, for benchmarks."""
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta, timezone
+import math
+import random
+
+from dateutil import tz
+
+
+STOCKHOLM = tz.gettz('Europe/Stockholm')
+
+# Start dates, in local time, of corpora with and without DST changes.
+CORPORA = {
+    'normal': date(2025, 1, 13),
+    'dst-spring': date(2025, 3, 29),  # 30 March has 23 hours.
+    'dst-autumn': date(2025, 10, 25),  # 26 October has 25 hours.
+    'negative': date(2025, 6, 14),  # Midsummer, with sunny, windy middays.
+}
+
+
+def generate_raw_prices(first_day: date, days: int, resolution: timedelta, negative_share: float = 0.0,
+                        seed: int = 1) -> list[dict]:
+    """Prices for *days* local days starting on *first_day*, as rows with ISO-formatted 'start' and 'end'.
+
+    Prices follow a daily curve with morning and evening peaks, plus noise. A share *negative_share* of the days have
+    negative prices in the middle of the day. Periods are generated in absolute time, so days with DST changes have
+    23 or 25 hours worth of periods.
+    """
+    rng = random.Random(seed)
+    start = datetime.combine(first_day, time(), STOCKHOLM).astimezone(timezone.utc)
+    end = datetime.combine(first_day + timedelta(days=days), time(), STOCKHOLM).astimezone(timezone.utc)
+    negative_days = {first_day + timedelta(days=d) for d in range(days) if rng.random() < negative_share}
+    rows = []
+    period_start = start
+    while period_start < end:
+        local = period_start.astimezone(STOCKHOLM)
+        hour = local.hour + local.minute / 60
+        value = 0.8 + 0.5 * math.exp(-(hour - 8) ** 2 / 4) + 0.7 * math.exp(-(hour - 18) ** 2 / 6)
+        value += rng.gauss(0, 0.1)
+        if local.date() in negative_days and 10 <= hour < 16:
+            value = -abs(rng.gauss(0.2, 0.1))
+        period_end = period_start + resolution
+        rows.append({'start': local.isoformat(),
+                     'end': period_end.astimezone(STOCKHOLM).isoformat(),
+                     'value': round(value, 3)})
+        period_start = period_end
+    return rows
+
+
+def generate_corpus(name: str, days: int, resolution: timedelta) -> list[dict]:
+    """The named corpus (see CORPORA), over *days* days."""
+    return generate_raw_prices(CORPORA[name], days, resolution, negative_share=0.5 if name == 'negative' else 0.0)
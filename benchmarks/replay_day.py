@@ -0,0 +1,85 @@
+"""Replay a generated day of phase currents, sampled every 10 seconds, through the load balancer, and measure how
+much faster than real time the simulation runs.
+
+Run from the repository root:
+
+    python -m benchmarks.replay_day
+"""
+from datetime import datetime, timedelta
+import random
+import time
+
+from load_balancing import LoadBalancer
+from simulation import Event, Simulation
+
+
+def build_events(start: datetime, sample_interval: timedelta) -> list[Event]:
+    """A random walk of the load on each phase."""
+    events = []
+    load = {'sensor.current_l1': 5.0, 'sensor.current_l2': 5.0, 'sensor.current_l3': 5.0}
+    time = start
+    while time < start + timedelta(days=1):
+        time += sample_interval
+        for entity_id in load:
+            load[entity_id] = min(25.0, max(0.0, load[entity_id] + random.uniform(-2, 2)))
+            events.append(Event(time, entity_id, f"{load[entity_id]:.1f}"))
+    return events
+
+
+def set_limit(simulation: Simulation, p1: float, p2: float, p3: float):
+    simulation.set_state('sensor.charger_dynamic_circuit_limit', p1, {'state_dynamicCircuitCurrentP1': p1,
+                                                                      'state_dynamicCircuitCurrentP2': p2,
+                                                                      'state_dynamicCircuitCurrentP3': p3})
+
+
+def replay(events: list[Event], start: datetime, args: dict) -> tuple[float, LoadBalancer, Simulation]:
+    simulation = Simulation(start)
+    for entity_id, state in (('input_boolean.car_load_balance', 'on'),
+                             ('input_boolean.car_smart_charging', 'on'),
+                             ('input_boolean.car_one_phase_charging', 'on'),
+                             ('input_boolean.car_charge_now', 'on'),
+                             ('sensor.current_l1', 5), ('sensor.current_l2', 5), ('sensor.current_l3', 5),
+                             ('sensor.charger_current', 10)):
+        simulation.set_state(entity_id, state)
+    simulation.set_state('sensor.charger_status', 'charging',
+                         {'circuit_ratedCurrent': 16, 'site_ratedCurrent': 25, 'circuit_id': 'C1'})
+    set_limit(simulation, 16, 0, 0)
+    # The charger confirms a new limit after 5 seconds.
+    simulation.register_service('easee/set_circuit_dynamic_limit',
+                                lambda circuit_id, currentP1, currentP2, currentP3: simulation.loop.call_later(
+                                    5, set_limit, simulation, currentP1, currentP2, currentP3))
+    app = simulation.add_app(LoadBalancer, 'load_balancing', {
+        'load_balancing_entity_id': 'input_boolean.car_load_balance',
+        'smart_charging_entity_id': 'input_boolean.car_smart_charging',
+        'one_phase_charging_entity_id': 'input_boolean.car_one_phase_charging',
+        'charge_now_entity_id': 'input_boolean.car_charge_now',
+        'current_l1_entity_id': 'sensor.current_l1',
+        'current_l2_entity_id': 'sensor.current_l2',
+        'current_l3_entity_id': 'sensor.current_l3',
+        'charger_status_entity_id': 'sensor.charger_status',
+        'charger_current_entity_id': 'sensor.charger_current',
+        'circuit_dynamic_limit_entity_id': 'sensor.charger_dynamic_circuit_limit',
+        **args})
+    started = time.perf_counter()
+    simulation.replay(events)
+    duration = time.perf_counter() - started
+    simulation.close()
+    return duration, app, simulation
+
+
+def main():
+    random.seed(1)
+    start = datetime(2025, 1, 1)
+    events = build_events(start, timedelta(seconds=10))
+    print(f"{len(events)} samples")
+    print(f"{'mode':>14} {'duration':>9} {'speed':>10} {'passes':>7} {'commands':>9}")
+    for mode, args in (('event-driven', {}),
+                       ('control loop', {'balance_interval_seconds': 10}),
+                       ('forecast', {'load_forecast_window_seconds': 60})):
+        duration, app, simulation = replay(events, start, args)
+        print(f"{mode:>14} {duration:>7.2f} s {86400 / duration:>9.0f}x {app.balance_passes:>7} "
+              f"{len(simulation.service_calls):>9}")
+
+
+if __name__ == '__main__':
+    main()
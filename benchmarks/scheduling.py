@@ -0,0 +1,121 @@
+"""Measure time and peak memory of the scheduling functions, at hourly and 15-minute resolution, over 1-30 days.
+
+Run from the repository root:
+
+    python -m benchmarks.scheduling
+    python -m benchmarks.scheduling --corpus dst-autumn --save baseline.json
+    python -m benchmarks.scheduling --compare baseline.json
+
+With --compare, the exit status is 1 if any case is more than --tolerance times slower than in the saved results.
+"""
+from __future__ import annotations
+
+import argparse
+from datetime import timedelta
+import json
+import sys
+import timeit
+import tracemalloc
+from typing import Callable
+
+from benchmarks.price_corpora import CORPORA, generate_corpus
+from price_forecasting import PriceForecaster
+from price_series import PriceSeries
+from scheduling import (calculate_eta, create_schedule, extrapolate_prices, get_contiguous_slots, get_prices,
+                        parse_prices)
+
+
+RESOLUTIONS = {'60 min': timedelta(hours=1), '15 min': timedelta(minutes=15)}
+HORIZONS = (1, 7, 30)  # days
+NEEDED_TIME = timedelta(hours=8)
+
+
+def build_cases(corpus: str, resolution: timedelta, days: int) -> dict[str, Callable[[], object]]:
+    """The functions to measure, with their inputs, as the scheduler uses them: prices are known for two days, and
+    the departure is *days* days after the start."""
+    raw = generate_corpus(corpus, max(days, 2), resolution)
+    known_raw = raw[:int(timedelta(days=2) / resolution)]
+    known = parse_prices(known_raw)
+    now = known[0]['start'] + timedelta(minutes=7)
+    departure = known[0]['start'] + timedelta(days=days)
+    available = get_prices(known, now, departure)
+    schedule = create_schedule(available, NEEDED_TIME)
+    # The cheapest half of the periods, as separate slots. get_contiguous_slots merges them in place, but takes as
+    # long on repeated calls.
+    # A forecaster that has learnt four weeks of prices.
+    forecaster = PriceForecaster()
+    forecaster.update(PriceSeries.from_periods(parse_prices(generate_corpus(corpus, 28, resolution))))
+    known_series = PriceSeries.from_periods(known)
+    cheap_slots = [{'start': p['start'], 'end': p['end']}
+                   for p in sorted(available, key=lambda p: p['value'])[:len(available) // 2]]
+    return {
+        'parse_prices': lambda: parse_prices(known_raw),
+        'get_prices': lambda: get_prices(known, now, departure),
+        'extrapolate_prices': lambda: extrapolate_prices(known, departure),
+        'forecast_prices': lambda: forecaster.extrapolate(known_series, departure),
+        'create_schedule': lambda: create_schedule(available, NEEDED_TIME),
+        'get_contiguous_slots': lambda: get_contiguous_slots(cheap_slots),
+        'calculate_eta': lambda: calculate_eta(now, NEEDED_TIME, schedule),
+    }
+
+
+def measure(func: Callable[[], object]) -> tuple[float, int]:
+    """Returns the best time (seconds) of a call, and the peak memory (bytes) allocated during a call."""
+    number, _ = timeit.Timer(func).autorange()
+    number = max(1, number // 4)
+    duration = min(timeit.repeat(func, number=number, repeat=5)) / number
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--corpus', choices=list(CORPORA), action='append',
+                                 help="Price corpus to use (repeatable). All, if not given.")
+    argument_parser.add_argument('--save', help="Save the results to this JSON file.")
+    argument_parser.add_argument('--compare', help="Compare with results saved in this JSON file.")
+    argument_parser.add_argument('--tolerance', type=float, default=1.5,
+                                 help="Slowdown, compared with the saved results, that counts as a regression.")
+    args = argument_parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    results = {}
+    regressions = []
+    for corpus in args.corpus or list(CORPORA):
+        print(f"\n{corpus}")
+        print(f"{'function':>20} {'resolution':>10} {'horizon':>8} {'time':>12} {'peak memory':>12}"
+              + (f" {'vs saved':>9}" if baseline else ""))
+        for resolution_name, resolution in RESOLUTIONS.items():
+            for days in HORIZONS:
+                for name, func in build_cases(corpus, resolution, days).items():
+                    duration, peak = measure(func)
+                    key = f"{corpus}/{name}/{resolution_name}/{days}d"
+                    results[key] = {'time': duration, 'peak_memory': peak}
+                    line = (f"{name:>20} {resolution_name:>10} {days:>6} d {duration * 1e6:>9.1f} us "
+                            f"{peak / 1024:>9.1f} kB")
+                    if key in baseline:
+                        ratio = duration / baseline[key]['time']
+                        line += f" {ratio:>8.2f}x"
+                        if ratio > args.tolerance:
+                            regressions.append(key)
+                    print(line)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if regressions:
+        print(f"\n{len(regressions)} regressions (more than {args.tolerance}x slower):")
+        for key in regressions:
+            print(f"  {key}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
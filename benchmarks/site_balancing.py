@@ -0,0 +1,123 @@
+"""Replay a generated day of other load, sampled every 10 seconds, through the site load balancer with 1-50 chargers
+behind one main fuse, and measure how much faster than real time the simulation runs.
+
+Run from the repository root:
+
+    python -m benchmarks.site_balancing
+"""
+from datetime import datetime, timedelta
+import random
+import time
+
+from common import Currents
+from simulation import Event, Simulation
+from site_balancing import SiteLoadBalancer
+
+
+MAIN_FUSE = 250  # A
+
+
+class MeterApp:
+    """Meters measuring the other load, plus what each charger charges with on the phases its limit allows. Keeps
+    the highest current measured on any phase."""
+
+    def initialize(self):
+        self.chargers = range(self.args['chargers'])
+        self.peak = 0.0
+        for phase in (1, 2, 3):
+            self.listen_state(self.measure, f'sensor.other_load_l{phase}')
+        for number in self.chargers:
+            self.listen_state(self.measure, f'sensor.charger_{number}_current')
+        self.measure()
+
+    def measure(self, *args):
+        for phase in (1, 2, 3):
+            current = float(self.get_state(f'sensor.other_load_l{phase}'))
+            for number in self.chargers:
+                limit = self.get_state(f'sensor.charger_{number}_dynamic_circuit_limit',
+                                       f'state_dynamicCircuitCurrentP{phase}')
+                if limit >= 6:
+                    current += float(self.get_state(f'sensor.charger_{number}_current'))
+            self.peak = max(self.peak, current)
+            self.set_state(f'sensor.current_l{phase}', current)
+
+
+def build_events(start: datetime, sample_interval: timedelta) -> list[Event]:
+    """A random walk of the other load on each phase."""
+    events = []
+    load = {'sensor.other_load_l1': 50.0, 'sensor.other_load_l2': 50.0, 'sensor.other_load_l3': 50.0}
+    time = start
+    while time < start + timedelta(days=1):
+        time += sample_interval
+        for entity_id in load:
+            load[entity_id] = min(200.0, max(0.0, load[entity_id] + random.uniform(-10, 10)))
+            events.append(Event(time, entity_id, f"{load[entity_id]:.1f}"))
+    return events
+
+
+def charge_with(simulation: Simulation, number: int, limit: Currents):
+    """Set the limit of a charger, and charge with as much as it allows."""
+    simulation.set_state(f'sensor.charger_{number}_dynamic_circuit_limit', limit.p1,
+                         {'state_dynamicCircuitCurrentP1': limit.p1,
+                          'state_dynamicCircuitCurrentP2': limit.p2,
+                          'state_dynamicCircuitCurrentP3': limit.p3})
+    simulation.set_state(f'sensor.charger_{number}_current', min(limit.max(), 16) if limit.max() >= 6 else 0)
+
+
+def replay(events: list[Event], start: datetime, count: int,
+           policy: str) -> tuple[float, SiteLoadBalancer, MeterApp, Simulation]:
+    """A mix of one- and three-phase chargers, most of them with a departure time."""
+    simulation = Simulation(start)
+    for phase in (1, 2, 3):
+        simulation.set_state(f'sensor.other_load_l{phase}', 50)
+    chargers = []
+    for number in range(count):
+        charger = {'charger_status_entity_id': f'sensor.charger_{number}_status',
+                   'charger_current_entity_id': f'sensor.charger_{number}_current',
+                   'circuit_dynamic_limit_entity_id': f'sensor.charger_{number}_dynamic_circuit_limit',
+                   'charge_now_entity_id': f'input_boolean.charger_{number}_charge_now',
+                   'one_phase_charging_entity_id': f'input_boolean.charger_{number}_one_phase_charging'}
+        simulation.set_state(f'sensor.charger_{number}_status', 'charging',
+                             {'circuit_ratedCurrent': 16, 'site_ratedCurrent': MAIN_FUSE, 'circuit_id': f'C{number}'})
+        simulation.set_state(f'input_boolean.charger_{number}_charge_now', 'on')
+        simulation.set_state(f'input_boolean.charger_{number}_one_phase_charging', random.choice(('on', 'off')))
+        if random.random() < 0.8:
+            charger['departure_time_entity_id'] = f'input_datetime.charger_{number}_departure'
+            simulation.set_state(f'input_datetime.charger_{number}_departure',
+                                 (start + timedelta(minutes=random.randrange(24 * 60))).isoformat())
+        charge_with(simulation, number, Currents(0, 0, 0))
+        chargers.append(charger)
+    # A charger confirms a new limit after 5 seconds.
+    simulation.register_service('easee/set_circuit_dynamic_limit',
+                                lambda circuit_id, currentP1, currentP2, currentP3: simulation.loop.call_later(
+                                    5, charge_with, simulation, int(circuit_id[1:]),
+                                    Currents(currentP1, currentP2, currentP3)))
+    meter = simulation.add_app(MeterApp, 'meter', {'chargers': count})
+    app = simulation.add_app(SiteLoadBalancer, 'site_load_balancing', {
+        'current_l1_entity_id': 'sensor.current_l1',
+        'current_l2_entity_id': 'sensor.current_l2',
+        'current_l3_entity_id': 'sensor.current_l3',
+        'allocation_policy': policy,
+        'chargers': chargers})
+    started = time.perf_counter()
+    simulation.replay(events)
+    duration = time.perf_counter() - started
+    simulation.close()
+    return duration, app, meter, simulation
+
+
+def main():
+    random.seed(1)
+    start = datetime(2025, 1, 1)
+    events = build_events(start, timedelta(seconds=10))
+    print(f"{len(events)} samples, main fuse {MAIN_FUSE} A")
+    print(f"{'chargers':>8} {'policy':>8} {'duration':>9} {'speed':>10} {'passes':>7} {'commands':>9} {'peak':>7}")
+    for count in (1, 5, 12, 25, 50):
+        for policy in ('fair', 'priority'):
+            duration, app, meter, simulation = replay(events, start, count, policy)
+            print(f"{count:>8} {policy:>8} {duration:>7.2f} s {86400 / duration:>9.0f}x {app.balance_passes:>7} "
+                  f"{len(simulation.service_calls):>9} {meter.peak:>5.0f} A")
+
+
+if __name__ == '__main__':
+    main()
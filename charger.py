@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
+
 from appdaemon.entity import Entity
 
 from common import Currents
@@ -41,3 +43,33 @@ class Charger:
         return Currents(current_state['state_dynamicCircuitCurrentP1'],
                         current_state['state_dynamicCircuitCurrentP2'],
                         current_state['state_dynamicCircuitCurrentP3'])
+
+    def snapshot(self) -> ChargerSnapshot:
+        """Reads all the charger entities once."""
+        try:
+            current = self.current if self._current else None
+        except ValueError:
+            current = None  # E.g. unavailable, which it may be when not charging.
+        attributes = self._status.attributes
+        return ChargerSnapshot(
+            status=self._status.state,
+            max_charging_current=float(attributes["circuit_ratedCurrent"]),
+            main_fuse=float(attributes["site_ratedCurrent"]),
+            circuit_id=attributes['circuit_id'],
+            current=current,
+            circuit_dynamic_limit=self.circuit_dynamic_limit if self._circuit_dynamic_limit else None)
+
+
+@dataclass(frozen=True, slots=True)
+class ChargerSnapshot:
+    """The state of a charger at one point in time.
+
+    Reading the charger once, and passing the snapshot around, gives consistent decisions and a fixed number of
+    entity reads per balance pass.
+    """
+    status: str
+    max_charging_current: float
+    main_fuse: float
+    circuit_id: str
+    current: float | None
+    circuit_dynamic_limit: Currents | None
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 from enum import Enum
 
 
@@ -9,54 +11,81 @@ class Phase(Enum):
     P3 = 3
 
 
+# Looking up enum members through the class is comparatively slow, and Currents is used in every balance pass.
+_P1, _P2, _P3 = Phase.P1, Phase.P2, Phase.P3
+
+
 class Currents:
     """Represents the currents on each phase"""
+    __slots__ = ('p1', 'p2', 'p3')
 
     def __init__(self, p1: float, p2: float, p3: float):
-        self._currents = {
-            Phase.P1: p1,
-            Phase.P2: p2,
-            Phase.P3: p3
-        }
-
-    @property
-    def p1(self):
-        """Phase 1 current"""
-        return self._currents[Phase.P1]
-
-    @property
-    def p2(self):
-        """Phase 2 current"""
-        return self._currents[Phase.P2]
-
-    @property
-    def p3(self):
-        """Phase 3 current"""
-        return self._currents[Phase.P3]
+        self.p1 = p1
+        self.p2 = p2
+        self.p3 = p3
 
     def min(self):
         """Returns the minimum current"""
-        return min(self._currents.values())
+        return min(self.p1, self.p2, self.p3)
 
     def max(self):
         """Returns the maximum current"""
-        return max(self._currents.values())
+        return max(self.p1, self.p2, self.p3)
 
     def min_phase(self) -> Phase:
-        """Returns the phase with the minimum current"""
-        return min(self._currents, key=self._currents.get)
+        """Returns the phase with the minimum current (the first one, if several have the same)"""
+        if self.p1 <= self.p2 and self.p1 <= self.p3:
+            return _P1
+        return _P2 if self.p2 <= self.p3 else _P3
 
     def max_phase(self) -> Phase:
-        """Returns the phase with the maximum current"""
-        return max(self._currents, key=self._currents.get)
+        """Returns the phase with the maximum current (the first one, if several have the same)"""
+        if self.p1 >= self.p2 and self.p1 >= self.p3:
+            return _P1
+        return _P2 if self.p2 >= self.p3 else _P3
+
+    def is_below(self, other: Currents) -> bool:
+        """Returns whether the current on any phase is lower than in *other*"""
+        return self.p1 < other.p1 or self.p2 < other.p2 or self.p3 < other.p3
+
+    def copy(self) -> Currents:
+        """Returns a copy"""
+        return Currents(self.p1, self.p2, self.p3)
+
+    def replace(self, phase: Phase, value: float) -> Currents:
+        """Returns a copy, with the current on *phase* replaced by *value*"""
+        currents = Currents(self.p1, self.p2, self.p3)
+        currents[phase] = value
+        return currents
 
     def __getitem__(self, item: Phase):
-        return self._currents[item]
+        if item is _P1:
+            return self.p1
+        if item is _P2:
+            return self.p2
+        if item is _P3:
+            return self.p3
+        raise KeyError(item)
 
     def __setitem__(self, key: Phase, value: float):
-        self._currents[key] = value
+        if key is _P1:
+            self.p1 = value
+        elif key is _P2:
+            self.p2 = value
+        elif key is _P3:
+            self.p3 = value
+        else:
+            raise KeyError(key)
+
+    def __add__(self, other: Currents) -> Currents:
+        return Currents(self.p1 + other.p1, self.p2 + other.p2, self.p3 + other.p3)
+
+    def __sub__(self, other: Currents) -> Currents:
+        return Currents(self.p1 - other.p1, self.p2 - other.p2, self.p3 - other.p3)
 
     def __eq__(self, other):
+        if not isinstance(other, Currents):
+            return NotImplemented
         return self.p1 == other.p1 and self.p2 == other.p2 and self.p3 == other.p3
 
     def __str__(self):
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable
+
+
+class CoalescingDispatcher:
+    """Runs a coroutine function on request, collapsing bursts of requests into one run.
+
+    A run starts when no new request has arrived for *debounce_seconds*, or, if requests keep arriving, when the first
+    of them has waited for *max_wait_seconds*. At most one run is in flight at a time; requests arriving during a run
+    cause one more run after it.
+    """
+
+    def __init__(self,
+                 func: Callable[[], Awaitable[None]],
+                 debounce_seconds: float,
+                 on_error: Callable[[Exception], None] | None = None,
+                 max_wait_seconds: float = float('inf')):
+        self._func = func
+        self._debounce_seconds = debounce_seconds
+        self._max_wait_seconds = max_wait_seconds
+        self._on_error = on_error
+        self._task: asyncio.Task | None = None
+        self._first_request = 0.0  # Of the pending requests.
+        self._last_request = 0.0
+        self._pending = False
+        self.requests = 0
+        self.runs = 0
+
+    def request(self):
+        """Request a run. Must be called from within the event loop."""
+        loop = asyncio.get_running_loop()
+        self.requests += 1
+        self._last_request = loop.time()
+        if not self._pending:
+            self._first_request = self._last_request
+        self._pending = True
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            # Wait until there has been no new request for the debounce window, but not for longer than the max wait.
+            while (remaining := min(self._last_request + self._debounce_seconds,
+                                    self._first_request + self._max_wait_seconds) - loop.time()) > 0:
+                await asyncio.sleep(remaining)
+            self._pending = False
+            self.runs += 1
+            try:
+                await self._func()
+            except Exception as e:
+                if self._on_error is None:
+                    raise
+                self._on_error(e)
+
+    def cancel(self):
+        """Cancel any pending or in-flight run."""
+        if self._task is not None:
+            self._task.cancel()
+        self._pending = False
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from typing import Callable
+
+from common import Currents
+
+
+class LimitCommandQueue:
+    """Coalescing, rate-limited queue of circuit dynamic limit commands for one charger.
+
+    Only the latest requested limit is kept (latest wins). A command is sent once the previous one has been confirmed
+    (or has timed out), and at least *min_interval_seconds* after the previous command, to respect the API quota.
+    A limit that is lower, on any phase, than the last one sent is sent immediately, since it protects the fuse.
+
+    Times are in seconds, from a monotonic clock.
+    """
+
+    def __init__(self, send: Callable[[Currents], None], min_interval_seconds: float, timeout_seconds: float):
+        self._send = send
+        self.min_interval_seconds = min_interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.pending: Currents | None = None
+        self.target: Currents | None = None  # Sent, but not yet confirmed.
+        self.target_sent_at: float | None = None
+        self.last_sent: Currents | None = None
+        self.last_sent_at: float | None = None
+        self.commands = 0
+        self.confirmations = 0
+        self.confirmation_latency = 0.0  # seconds, in total
+        self.timeouts = 0
+
+    @property
+    def depth(self) -> int:
+        """The number of commands waiting to be sent or confirmed."""
+        return (self.pending is not None) + (self.target is not None)
+
+    def submit(self, currents: Currents, actual: Currents, now: float) -> float | None:
+        """Request the circuit dynamic limit *currents*, when the limit is currently *actual*.
+
+        Returns the number of seconds until the command can be sent, if it has to wait (see poll).
+        """
+        if currents == (self.target if self.target is not None else actual):
+            self.pending = None  # Already set, or being set.
+        else:
+            self.pending = currents
+        return self.poll(now)
+
+    def confirm(self, actual: Currents, now: float) -> bool:
+        """Report the actual circuit dynamic limit. Returns True if it confirms the limit being set."""
+        if self.target is None or actual != self.target:
+            return False
+        self.confirmations += 1
+        self.confirmation_latency += now - self.target_sent_at
+        self.target = None
+        return True
+
+    def poll(self, now: float) -> float | None:
+        """Send the pending command, if allowed.
+
+        Returns the number of seconds until it can be sent, if it has to wait.
+        """
+        if self.target is not None and now - self.target_sent_at >= self.timeout_seconds:
+            self.timeouts += 1
+            self.target = None
+        if self.pending is None:
+            return None
+
+        if self.last_sent is None or not self.pending.is_below(self.last_sent):
+            if self.target is not None:
+                return self.target_sent_at + self.timeout_seconds - now  # Wait for confirmation (or timeout).
+            if self.last_sent_at is not None and now - self.last_sent_at < self.min_interval_seconds:
+                return self.last_sent_at + self.min_interval_seconds - now
+
+        currents, self.pending = self.pending, None
+        self._send(currents)
+        self.commands += 1
+        self.target, self.target_sent_at = currents, now
+        self.last_sent, self.last_sent_at = currents, now
+        return None
+
+    def dump(self) -> dict:
+        """The last command sent, and whether it is yet to be confirmed, for storing."""
+        return {'last_sent': None if self.last_sent is None else [self.last_sent.p1, self.last_sent.p2,
+                                                                  self.last_sent.p3],
+                'unconfirmed': self.target is not None}
+
+    def load(self, state: dict, now: float):
+        """Restores the state from before a restart. Commands are treated as just sent, so that they are neither sent
+        again nor followed by a raise too soon."""
+        if state.get('last_sent') is None:
+            return
+        self.last_sent, self.last_sent_at = Currents(*state['last_sent']), now
+        if state.get('unconfirmed'):
+            self.target, self.target_sent_at = self.last_sent, now
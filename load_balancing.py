@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import asyncio
 from math import floor
+import tempfile
+from typing import Callable
 
-import appdaemon.plugins.hass.hassapi as hass
-
-from charger import Charger
+from balancing import BalancingApp
+from charger import Charger, ChargerSnapshot
 from common import Phase, Currents
+from limit_commands import LimitCommandQueue
+from load_forecasting import LoadForecaster
+from profiling import Profiler
+from state_store import StateWriter
 
 
-class LoadBalancer(hass.Hass):
+class LoadBalancer(BalancingApp):
     """App for making sure that the charger is not overloaded."""
     load_balancing_enabled = False
     one_phase_charging = False
@@ -17,34 +23,45 @@ class LoadBalancer(hass.Hass):
     charger = None
     load_balance_threshold = 0
     min_charging_current = 6  # A
-    current_l1_entity = None
-    current_l2_entity = None
-    current_l3_entity = None
-    circuit_dynamic_limit_target: Currents | None = None
-    circuit_dynamic_limit_target_timeout = 120  # seconds
-    reset_circuit_dynamic_limit_target_timer: str | None = None
+    limit_queue: LimitCommandQueue = None
+    balance_interval: float | None = None  # seconds, in control-loop mode
+    latest_load: Currents | None = None
+    unbalanced_sample_time: float | None = None
+    balanced_samples = 0  # control-loop mode
+    balance_latency = 0.0  # seconds, in total, from a sample arriving to it being balanced (control-loop mode)
+    load_forecaster: LoadForecaster | None = None
+    time_above_threshold = 0.0  # seconds, in total
+    last_load_sample: tuple[float, Currents] | None = None
 
     def initialize(self):
+        self.configure()
+        for callback, entity_id, kwargs in self.state_listeners():
+            self.listen_state(callback, entity_id, **kwargs)
+        for callback, interval in self.timers():
+            self.run_every(callback, "now", interval)
+
+        self.balance()
+
+    def configure(self):
+        """Read the configuration and the initial state. Entities are read from AppDaemon's state cache, so this
+        doesn't wait for I/O."""
+        self.configure_metrics()
+
         # Should we do load balancing?
         do_load_balancing_entity_id = str(self.args['load_balancing_entity_id'])
-        self.load_balancing_enabled = self.get_state(do_load_balancing_entity_id) == 'on'
-        self.listen_state(self.load_balancing_cb, do_load_balancing_entity_id)
+        self.load_balancing_enabled = self.get_entity(do_load_balancing_entity_id).state == 'on'
 
         # Shall we do smart charging?
         smart_charging_entity_id = str(self.args['smart_charging_entity_id'])
-        self.smart_charge = self.get_state(smart_charging_entity_id) == 'on'
-        self.listen_state(self.smart_charging_cb, smart_charging_entity_id)
+        self.smart_charge = self.get_entity(smart_charging_entity_id).state == 'on'
 
         # Should we do one-phase charging (and load balancing)?
         do_one_phase_charging_entity_id = str(self.args['one_phase_charging_entity_id'])
-        self.one_phase_charging = self.get_state(do_one_phase_charging_entity_id) == 'on'
-        assert self.one_phase_charging, "Three-phase charging is not supported yet"
-        self.listen_state(self.one_phase_charging_cb, do_one_phase_charging_entity_id)
+        self.one_phase_charging = self.get_entity(do_one_phase_charging_entity_id).state == 'on'
 
         # Shall charging be on now?
         charge_now_entity_id = str(self.args['charge_now_entity_id'])
-        self.charge_now_switch = self.get_state(charge_now_entity_id) == 'on'
-        self.listen_state(self.charge_now_cb, charge_now_entity_id)
+        self.charge_now_switch = self.get_entity(charge_now_entity_id).state == 'on'
 
         # Charger
         charger_status_entity_id = str(self.args['charger_status_entity_id'])
@@ -54,21 +71,84 @@ class LoadBalancer(hass.Hass):
                                self.get_entity(charger_current_entity_id),
                                self.get_entity(circuit_dynamic_limit_entity_id))
 
+        self.limit_queue = self.new_limit_queue(self.send_circuit_dynamic_limit)
+        self.load_state()
+
         # Balance load when current is higher than 90% of main fuse.
         self.load_balance_threshold = self.charger.main_fuse * 0.9
 
+        # Optionally, balance a forecast of the load instead of the latest reading, to avoid changing the limit up
+        # and down as household loads cycle.
+        if 'load_forecast_window_seconds' in self.args:
+            self.load_forecaster = LoadForecaster(float(self.args['load_forecast_window_seconds']),
+                                                  float(self.args.get('load_forecast_percentile', 90)))
+
         # Instantaneous current readings
-        current_l1_entity_id = str(self.args['current_l1_entity_id'])
-        current_l2_entity_id = str(self.args['current_l2_entity_id'])
-        current_l3_entity_id = str(self.args['current_l3_entity_id'])
-        self.current_l1_entity = self.get_entity(current_l1_entity_id)
-        self.current_l2_entity = self.get_entity(current_l2_entity_id)
-        self.current_l3_entity = self.get_entity(current_l3_entity_id)
-        self.listen_state(self.balance, current_l1_entity_id)
-        self.listen_state(self.balance, current_l2_entity_id)
-        self.listen_state(self.balance, current_l3_entity_id)
+        self.configure_load_sensors()
+        if 'balance_interval_seconds' in self.args:
+            # Control-loop mode: samples are collected, and balanced at a fixed rate. One meter update changing all
+            # three phases results in one balance pass, instead of three.
+            self.balance_interval = float(self.args['balance_interval_seconds'])
+            # None if a sensor is unavailable (as after a Home Assistant restart), until it has a valid sample.
+            self.latest_load = self.read_load()
+
+        # Optionally, profile a sample of the balance passes while a switch is on.
+        self.profiler = Profiler(self.name, str(self.args.get('profiling_directory', tempfile.gettempdir())),
+                                 float(self.args.get('profiling_sample_rate', 0.1)),
+                                 float(self.args.get('profiling_window_seconds', 600)),
+                                 self.monotonic)
+        if 'profiling_entity_id' in self.args and \
+                self.get_entity(str(self.args['profiling_entity_id'])).state == 'on':
+            self.start_profiling()
+
+    def state_listeners(self) -> list[tuple[Callable, str, dict]]:
+        """The state callbacks, with the entities they listen to and their extra arguments."""
+        listeners = [(self.load_balancing_cb, str(self.args['load_balancing_entity_id']), {}),
+                     (self.smart_charging_cb, str(self.args['smart_charging_entity_id']), {}),
+                     (self.one_phase_charging_cb, str(self.args['one_phase_charging_entity_id']), {}),
+                     (self.charge_now_cb, str(self.args['charge_now_entity_id']), {})]
+        for phase, key in ((Phase.P1, 'current_l1_entity_id'),
+                           (Phase.P2, 'current_l2_entity_id'),
+                           (Phase.P3, 'current_l3_entity_id')):
+            if self.balance_interval is not None:
+                listeners.append((self.current_sample_cb, str(self.args[key]), {'phase': phase}))
+            else:
+                listeners.append((self.current_cb, str(self.args[key]), {}))
+        if 'profiling_entity_id' in self.args:
+            listeners.append((self.profiling_cb, str(self.args['profiling_entity_id']), {}))
+        return listeners
+
+    def timers(self) -> list[tuple[Callable, float]]:
+        """The periodic callbacks, with their intervals in seconds."""
+        timers = []
+        if self.balance_interval is not None:
+            timers.append((self.balance_tick, self.balance_interval))
+        if self.metrics_entity_id is not None:
+            timers.append((self.publish_metrics_cb, self.metrics_interval))
+        return timers
+
+    def profiling_cb(self, entity, attribute, old, new, kwargs):
+        """Callback for the profiling switch."""
+        if new == 'on':
+            self.start_profiling()
+            self.log(f"Profiling {self.profiler.sample_rate:.0%} of the balance passes for "
+                     f"{self.profiler.window:.0f} seconds.")
+            return
+        self.stop_profiling()
 
-        self.balance()
+    def profiling_window_cb(self, kwargs):
+        """Timer callback for the end of the profiling window, if profiling was not stopped or restarted since."""
+        if self.profiler.active and self.profiler.until == kwargs['until']:
+            self.stop_profiling()
+
+    def start_profiling(self):
+        """Start profiling, until the window has passed, even if no more balance passes are sampled."""
+        self.profiler.start()
+        self.run_in(self.profiling_window_cb, self.profiler.window, until=self.profiler.until)
+
+    def stop_profiling(self):
+        self.profiler.stop()
+        self.log(f"Profiling stopped. Profile of {self.profiler.samples} balance passes: {self.profiler.path}")
 
     def load_balancing_cb(self, entity, attribute, old, new, kwargs):
         """Callback for the load balancing switch."""
@@ -87,7 +167,6 @@ class LoadBalancer(hass.Hass):
         """Callback for the one phase charging switch."""
         self.one_phase_charging = new == 'on'
         self.log(f"One phase charging: {new}")
-        assert self.one_phase_charging, "Three-phase charging or load balancing is not supported yet"
         self.balance()
 
     def charge_now_cb(self, entity, attribute, old, new, kwargs):
@@ -97,51 +176,104 @@ class LoadBalancer(hass.Hass):
         self.log(f"Charge now: {self.charge_now} (Smart charge={self.smart_charge})")
         self.balance()
 
+    def current_cb(self, entity, attribute, old, new, kwargs):
+        """Callback for the current sensors."""
+        self.balance()
+
+    def current_sample_cb(self, entity, attribute, old, new, kwargs):
+        """Callback for the current sensors, in control-loop mode. The sample is balanced on the next tick."""
+        try:
+            sample = float(new)
+        except (TypeError, ValueError):
+            self.log(f"Could not convert {entity} current {new} to float", level="WARNING")
+            return
+        if self.latest_load is None:
+            # Not all sensors were available at startup. Start sampling when they are.
+            self.latest_load = self.read_load()
+            if self.latest_load is None:
+                return
+        self.latest_load[kwargs['phase']] = sample
+        if self.unbalanced_sample_time is None:
+            self.unbalanced_sample_time = self.monotonic()
+
+    def balance_tick(self, kwargs):
+        """Timer callback in control-loop mode. Balances the latest sample, if any new has arrived."""
+        if self.unbalanced_sample_time is None:
+            return
+        latency = self.monotonic() - self.unbalanced_sample_time
+        self.unbalanced_sample_time = None
+        self.balanced_samples += 1
+        self.balance_latency += latency
+        self.log(f"Balancing sample {latency * 1000:.0f} ms after it arrived "
+                 f"(average {self.balance_latency / self.balanced_samples * 1000:.0f} ms)", level="DEBUG")
+        self.balance()
+
     @property
     def charge_now(self):
         return self.charge_now_switch or not self.smart_charge
 
-    def balance(self, *args, **kwargs):
-        """Make sure that the currents are not higher than the main fuse."""
-        if not self.circuit_dynamic_limit_target_reached():
-            # Circuit dynamic limit is being set. Wait for it to be reached.
-            return
+    def get_load(self) -> Currents | None:
+        """The current load on each phase, or None if it is unknown."""
+        if self.latest_load is not None:
+            return self.latest_load.copy()
+        return self.read_load()
+
+    def balance_pass(self):
+        """One pass of balancing the load."""
+        # Read the charger once, so that all decisions in this pass are based on the same state.
+        charger = self.charger.snapshot()
+        self.metrics.increment('entity_reads', 3)  # Status, current and circuit dynamic limit.
+
+        self.circuit_dynamic_limit_target_reached(charger)
 
         if not self.load_balancing_enabled:
-            self.handle_non_balanced_charging()
+            self.handle_non_balanced_charging(charger)
 
-        if self.charger.status == 'disconnected':
+        if charger.status == 'disconnected':
             # Set the circuit dynamic limit to 10 A. If the smart charging / load balancing is not working,
             # for whatever reason, the next time the charger is connected, charging will be enabled, but
             # limited to 10 A (to reduce the risk of overloading the circuit).
             target_currents = Currents(10, 10, 10)
-            if self.charger.circuit_dynamic_limit == target_currents:
+            if charger.circuit_dynamic_limit == target_currents:
                 return  # Nothing to do.
             self.log("Charger was disconnected. Setting circuit dynamic limit to 10.")
-            self.set_circuit_dynamic_limit(target_currents)
+            self.set_circuit_dynamic_limit(target_currents, charger)
             return
 
-        l1 = float(self.current_l1_entity.state)
-        l2 = float(self.current_l2_entity.state)
-        l3 = float(self.current_l3_entity.state)
-        load = Currents(l1, l2, l3)
-        above_threshold = load.max() > self.load_balance_threshold
+        load = self.get_load()
+        if load is None:
+            self.log("The current sensors are unavailable. Nothing to balance.", level="WARNING")
+            return
+        self.track_time_above_threshold(load)
+        l1, l2, l3 = load.p1, load.p2, load.p3
 
-        if l1 > self.charger.main_fuse:
+        if l1 > charger.main_fuse:
             self.log(f"L1 current is higher than main fuse: {l1}", level="WARNING")
 
-        if l2 > self.charger.main_fuse:
+        if l2 > charger.main_fuse:
             self.log(f"L2 current is higher than main fuse: {l2}", level="WARNING")
 
-        if l3 > self.charger.main_fuse:
+        if l3 > charger.main_fuse:
             self.log(f"L3 current is higher than main fuse: {l3}", level="WARNING")
 
         if not self.load_balancing_enabled:
             self.log(f"Load balancing is disabled.", level="DEBUG")
             return  # Nothing more to do when load balancing is disabled.
 
+        # The charger current is unavailable when the charger is not charging.
+        charger_current = charger.current or 0
+        charger_load = self.get_charger_load(charger, charger_current)
+        other_load = load - charger_load
+        if self.load_forecaster is not None:
+            # Forecast the other load only. The charger follows the limit, so its current in past samples says nothing
+            # about the next limit, and including it would make each lowered limit lower the next one.
+            self.load_forecaster.add(self.monotonic(), other_load)
+            other_load = self.load_forecaster.forecast()
+            self.log(f"Forecast other load: {other_load}", level="DEBUG")
+        above_threshold = (other_load + charger_load).max() > self.load_balance_threshold
+
         # Get the circuit dynamic limit for each phase.
-        circuit_dynamic_limit = self.charger.circuit_dynamic_limit
+        circuit_dynamic_limit = charger.circuit_dynamic_limit
         self.log(f"Circuit dynamic limit: {circuit_dynamic_limit}", level="DEBUG")
 
         min_circuit_dynamic_limit = circuit_dynamic_limit.min()
@@ -151,32 +283,39 @@ class LoadBalancer(hass.Hass):
             if circuit_dynamic_limit.max() >= self.min_charging_current:
                 self.log("Should not charge now but circuit dynamic limit currently allows it"
                          f" ({circuit_dynamic_limit}) - setting limit to 0 A", level="INFO")
-                self.set_circuit_dynamic_limit(Currents(0, 0, 0))
+                self.set_circuit_dynamic_limit(Currents(0, 0, 0), charger)
             return
 
-        if not above_threshold and min_circuit_dynamic_limit >= self.charger.max_charging_current:
-            # The charging is not limited, and we're still not over the main fuse. Nothing to do.
+        if (not above_threshold and min_circuit_dynamic_limit >= charger.max_charging_current and
+                not self.one_phase_charging):
+            # The three-phase charging is not limited, and we're still not over the main fuse. Nothing to do. (When
+            # charging on one phase, all three phases being enabled means that it should switch to one phase.)
             self.log("Charging is enabled without limitation, "
                      f"and no phase is loaded above the threshold for load balancing ({self.load_balance_threshold} A). "
                      "Nothing to do.", level="DEBUG")
             return
 
         if self.one_phase_charging:
-            self.balance_one_phase(load, self.charger.current)
+            self.balance_one_phase(other_load, charger, charger_current)
         else:
-            # TODO: Not sure what self.charger_current is when doing three-phase charging.
-            self.balance_three_phase(l1, l2, l3, self.charger.current)
-
-    def balance_one_phase(self, load, charger_current):
-        """Balance the load when the charger is set to only charge on one phase."""
-        charging_phase = self.get_charging_phase()
+            self.balance_three_phase(other_load, charger, charger_current)
+
+    def track_time_above_threshold(self, load: Currents):
+        """Keep track of how long the load has been above the load balancing threshold."""
+        now = self.monotonic()
+        if self.last_load_sample is not None:
+            last_time, last_load = self.last_load_sample
+            if last_load.max() > self.load_balance_threshold:
+                self.time_above_threshold += now - last_time
+                self.log(f"Time above threshold: {self.time_above_threshold:.0f} s", level="DEBUG")
+        self.last_load_sample = (now, load)
+
+    def balance_one_phase(self, other_load: Currents, charger: ChargerSnapshot, charger_current: float):
+        """Balance the load when the charger is set to only charge on one phase. *other_load* is the load without
+        the charger."""
+        charging_phase = self.get_charging_phase(charger)
         if charger_current >= self.min_charging_current:
             self.log(f"Charging with {charger_current} A on phase {charging_phase.name}", level="DEBUG")
-
-        # Figure out the load on each phase, without the charger.
-        other_load = Currents(load.p1, load.p2, load.p3)
-        if charging_phase != Phase.Unknown:
-            other_load[charging_phase] -= charger_current
         self.log(f"Other load: {other_load}", level="DEBUG")
 
         # Which phase has the lowest other load?
@@ -189,29 +328,75 @@ class LoadBalancer(hass.Hass):
                      level="INFO")
         else:
             self.log(f"Charging is already enabled on phase {charging_phase.name}", level="DEBUG")
-        available_current = self.load_balance_threshold - other_load[charging_phase]
-        new_circuit_dynamic_limit = Currents(0, 0, 0)
-        new_circuit_dynamic_limit[charging_phase] = min(floor(available_current), self.charger.max_charging_current)
-        current_circuit_dynamic_limit = self.charger.circuit_dynamic_limit
+        available_current = min(floor(self.load_balance_threshold - other_load[charging_phase]),
+                                charger.max_charging_current)
+        if available_current < self.min_charging_current:
+            self.log(f"Not enough current available for charging on phase {charging_phase.name} "
+                     f"(other load: {other_load})", level="INFO")
+            available_current = 0
+        new_circuit_dynamic_limit = Currents(0, 0, 0).replace(charging_phase, available_current)
+        current_circuit_dynamic_limit = charger.circuit_dynamic_limit
         if new_circuit_dynamic_limit.max() < current_circuit_dynamic_limit.max():
             self.log(f"Lowering circuit dynamic limit: {new_circuit_dynamic_limit}", level="INFO")
+        elif self.enabled_phases(current_circuit_dynamic_limit) > 1:
+            self.log(f"Switching to one-phase charging: {new_circuit_dynamic_limit}", level="INFO")
         elif new_circuit_dynamic_limit.max() >= current_circuit_dynamic_limit.max() + 2:  # Hysteresis 2 A
             self.log(f"Raising circuit dynamic limit: {new_circuit_dynamic_limit}", level="INFO")
         else:
             return
-        self.set_circuit_dynamic_limit(new_circuit_dynamic_limit)
+        self.set_circuit_dynamic_limit(new_circuit_dynamic_limit, charger)
 
         # Is the charger charging on the same phase?
         # If not, should we switch charging phase? Maybe look at the past 15 or so minutes?
 
-    def balance_three_phase(self, l1, l2, l3, charger_current):
-        """Balance the load when the charger is set to charge on all three phases."""
-        raise NotImplementedError("Three-phase load balancing not yet implemented.")
+    def balance_three_phase(self, other_load: Currents, charger: ChargerSnapshot, charger_current: float):
+        """Balance the load when the charger is set to charge on all three phases. *other_load* is the load without
+        the charger."""
+        current_circuit_dynamic_limit = charger.circuit_dynamic_limit
+        if charger_current >= self.min_charging_current:
+            self.log(f"Charging with {charger_current} A on {self.enabled_phases(current_circuit_dynamic_limit)} "
+                     "phases", level="DEBUG")
+        self.log(f"Other load: {other_load}", level="DEBUG")
+
+        # The car draws the same current on all phases, so the phase with the least headroom decides.
+        threshold = self.load_balance_threshold
+        headroom = Currents(threshold, threshold, threshold) - other_load
+        available_current = min(floor(headroom.min()), charger.max_charging_current)
+        if available_current < self.min_charging_current:
+            self.log(f"Not enough current available for three-phase charging (headroom: {headroom})", level="INFO")
+            available_current = 0
+        new_circuit_dynamic_limit = Currents(available_current, available_current, available_current)
+
+        # Compare each phase: when switching from one-phase charging, the lowest phase of the current limit is 0.
+        if new_circuit_dynamic_limit.is_below(current_circuit_dynamic_limit):
+            self.log(f"Lowering circuit dynamic limit: {new_circuit_dynamic_limit}", level="INFO")
+        elif new_circuit_dynamic_limit.min() > 0 and self.enabled_phases(current_circuit_dynamic_limit) < 3:
+            self.log(f"Switching to three-phase charging: {new_circuit_dynamic_limit}", level="INFO")
+        elif new_circuit_dynamic_limit.min() >= current_circuit_dynamic_limit.min() + 2:  # Hysteresis 2 A
+            self.log(f"Raising circuit dynamic limit: {new_circuit_dynamic_limit}", level="INFO")
+        else:
+            return
+        self.set_circuit_dynamic_limit(new_circuit_dynamic_limit, charger)
+
+    def get_charger_load(self, charger: ChargerSnapshot, charger_current: float) -> Currents:
+        """The current that the charger is using on each phase: all three, if the circuit dynamic limit allows it,
+        otherwise the phase that charging is enabled on, if known."""
+        if self.enabled_phases(charger.circuit_dynamic_limit) == 3:
+            return Currents(charger_current, charger_current, charger_current)
+        charging_phase = self.get_charging_phase(charger)
+        if charging_phase == Phase.Unknown:
+            return Currents(0, 0, 0)
+        return Currents(0, 0, 0).replace(charging_phase, charger_current)
+
+    def enabled_phases(self, circuit_dynamic_limit: Currents) -> int:
+        """The number of phases that the circuit dynamic limit allows charging on."""
+        return sum(1 for current in (circuit_dynamic_limit.p1, circuit_dynamic_limit.p2, circuit_dynamic_limit.p3)
+                   if current >= self.min_charging_current)
 
-    def get_charging_phase(self):
+    def get_charging_phase(self, charger: ChargerSnapshot):
         """Get the phase that charging is enabled on."""
         # Do we have a specific phase enabled by circuit dynamic limit?
-        current_limit = self.charger.circuit_dynamic_limit
+        current_limit = charger.circuit_dynamic_limit
         if self.min_charging_current <= current_limit.max() == current_limit.p1 + current_limit.p2 + current_limit.p3:
             # Charging is enabled on one specific phase.
             return current_limit.max_phase()
@@ -224,60 +409,148 @@ class LoadBalancer(hass.Hass):
 
         return Phase.Unknown
 
-    def set_circuit_dynamic_limit(self, currents: Currents):
-        """Set the circuit dynamic limit."""
-        if currents == self.charger.circuit_dynamic_limit or not self.circuit_dynamic_limit_target_reached():
-            return
-        self.log(f"Setting circuit dynamic limit to {currents}.", level="INFO")
-        self.call_service('easee/set_circuit_dynamic_limit',
-                          circuit_id=self.charger.circuit_id,
-                          currentP1=currents.p1,
-                          currentP2=currents.p2,
-                          currentP3=currents.p3)
-        self.circuit_dynamic_limit_target = currents
-
-        # Set a timer to reset the circuit dynamic limit target if we don't reach within reasonable time.
-        self.reset_circuit_dynamic_limit_target_timer = self.run_in(self.reset_circuit_dynamic_limit_target_cb,
-                                                                    self.circuit_dynamic_limit_target_timeout)
-
-    def reset_circuit_dynamic_limit_target_cb(self, _):
-        """Reset the circuit dynamic limit target."""
-        if self.circuit_dynamic_limit_target_reached():
-            return
-        self.log(f"Circuit dynamic limit target was not reached within {self.circuit_dynamic_limit_target_timeout} seconds.",
-                 level="INFO")
-        self.circuit_dynamic_limit_target = None
-
-    def circuit_dynamic_limit_target_reached(self) -> bool:
+    def set_circuit_dynamic_limit(self, currents: Currents, charger: ChargerSnapshot):
+        """Set the circuit dynamic limit (as soon as the command queue allows)."""
+        wait = self.limit_queue.submit(currents, charger.circuit_dynamic_limit, self.monotonic())
+        self.schedule_limit_queue_poll(self.limit_queue, wait)
+
+    def send_circuit_dynamic_limit(self, currents: Currents):
+        """Send a circuit dynamic limit command to the charger."""
+        self.log(f"Setting circuit dynamic limit to {currents} "
+                 f"({self.limit_queue.commands + 1} commands since start).", level="INFO")
+        with self.metrics.timer('call_service_seconds'):
+            self.call_circuit_dynamic_limit_service(currents)
+
+    def call_circuit_dynamic_limit_service(self, currents: Currents):
+        return self.call_service('easee/set_circuit_dynamic_limit',
+                                 circuit_id=self.charger.circuit_id,
+                                 currentP1=currents.p1,
+                                 currentP2=currents.p2,
+                                 currentP3=currents.p3)
+
+    def limit_queue_cb(self, kwargs):
+        """Timer callback for sending a waiting circuit dynamic limit command. The charger is read first, as the
+        command may be waiting for the previous one to be confirmed."""
+        self.limit_queue_timers.pop(self.limit_queue, None)
+        self.circuit_dynamic_limit_target_reached(self.charger.snapshot())
+        self.poll_limit_queue(self.limit_queue)
+
+    def limit_queues(self) -> dict[str, LimitCommandQueue]:
+        return {'limit_queue': self.limit_queue}
+
+    def circuit_dynamic_limit_target_reached(self, charger: ChargerSnapshot) -> bool:
         """Check if the circuit dynamic limit target is reached."""
-        if self.circuit_dynamic_limit_target is None:
+        target = self.limit_queue.target
+        if target is None:
             return True
-
-        current_limit = self.charger.circuit_dynamic_limit
-        if (current_limit.p1 == self.circuit_dynamic_limit_target.p1 and
-                current_limit.p2 == self.circuit_dynamic_limit_target.p2 and
-                current_limit.p3 == self.circuit_dynamic_limit_target.p3):
-            self.log(f"Circuit dynamic limit is now set to {self.circuit_dynamic_limit_target}.",
+        if self.confirm_limit(self.limit_queue, charger.circuit_dynamic_limit):
+            self.log(f"Circuit dynamic limit is now set to {target} (on average "
+                     f"{self.limit_queue.confirmation_latency / self.limit_queue.confirmations:.1f} s after the command).",
                      level="INFO")
-            self.circuit_dynamic_limit_target = None
-            self.cancel_timer(self.reset_circuit_dynamic_limit_target_timer)
             return True
-        self.log(f"Circuit dynamic limit is being set to {self.circuit_dynamic_limit_target}.",
-                 level="DEBUG")
+        self.log(f"Circuit dynamic limit is being set to {target}.", level="DEBUG")
         return False
 
-    def handle_non_balanced_charging(self):
+    def handle_non_balanced_charging(self, charger: ChargerSnapshot):
         if self.charge_now:
             target_limit = Currents(40, 40, 40)
-            if self.charger.circuit_dynamic_limit != target_limit:
+            if charger.circuit_dynamic_limit != target_limit:
                 self.log(
                     f"Load balancing is disabled. Enabling charging by resetting circuit dynamic limit: {target_limit}",
                     level="INFO")
-                self.set_circuit_dynamic_limit(target_limit)
+                self.set_circuit_dynamic_limit(target_limit, charger)
         else:
             target_limit = Currents(0, 0, 0)
-            if self.charger.circuit_dynamic_limit != target_limit:
+            if charger.circuit_dynamic_limit != target_limit:
                 self.log(
                     f"Load balancing is disabled. Disabling charging by setting circuit dynamic limit: {target_limit}",
                     level="INFO")
-                self.set_circuit_dynamic_limit(target_limit)
+                self.set_circuit_dynamic_limit(target_limit, charger)
+
+
+class AsyncLoadBalancer(LoadBalancer):
+    """LoadBalancer running in AppDaemon's event loop, instead of in its worker threads.
+
+    Balance passes only read AppDaemon's state cache, and circuit dynamic limit commands are sent as tasks, so a pass
+    never waits for the Easee round trip, and no worker thread is tied up.
+    """
+    command_tasks: set[asyncio.Task] = set()
+    commands_completed = 0
+    command_latency = 0.0  # seconds, in total, from sending a command until the service call returned
+    state_writer: StateWriter | None = None
+
+    async def initialize(self):
+        self.command_tasks = set()
+        self.configure()
+        if self.state_store is not None:
+            self.state_writer = StateWriter(self.state_store, self.state_write_failed)
+        for callback, entity_id, kwargs in self.state_listeners():
+            await self.listen_state(callback, entity_id, **kwargs)
+        for callback, interval in self.timers():
+            await self.run_every(callback, "now", interval)
+
+        self.balance()
+
+    # The callbacks are coroutines, so that AppDaemon runs them in its event loop.
+
+    async def load_balancing_cb(self, entity, attribute, old, new, kwargs):
+        super().load_balancing_cb(entity, attribute, old, new, kwargs)
+
+    async def smart_charging_cb(self, entity, attribute, old, new, kwargs):
+        super().smart_charging_cb(entity, attribute, old, new, kwargs)
+
+    async def one_phase_charging_cb(self, entity, attribute, old, new, kwargs):
+        super().one_phase_charging_cb(entity, attribute, old, new, kwargs)
+
+    async def charge_now_cb(self, entity, attribute, old, new, kwargs):
+        super().charge_now_cb(entity, attribute, old, new, kwargs)
+
+    async def current_cb(self, entity, attribute, old, new, kwargs):
+        super().current_cb(entity, attribute, old, new, kwargs)
+
+    async def current_sample_cb(self, entity, attribute, old, new, kwargs):
+        super().current_sample_cb(entity, attribute, old, new, kwargs)
+
+    async def balance_tick(self, kwargs):
+        super().balance_tick(kwargs)
+
+    async def limit_queue_cb(self, kwargs):
+        super().limit_queue_cb(kwargs)
+
+    async def profiling_cb(self, entity, attribute, old, new, kwargs):
+        super().profiling_cb(entity, attribute, old, new, kwargs)
+
+    async def profiling_window_cb(self, kwargs):
+        super().profiling_window_cb(kwargs)
+
+    async def publish_metrics_cb(self, kwargs):
+        await super().publish_metrics_cb(kwargs)
+
+    def save_state(self):
+        """Store the commands in flight, if a state file is configured, without waiting for the disk."""
+        if self.state_writer is not None:
+            self.state_writer.update(self.limit_queue_state())
+
+    def state_write_failed(self, exception: Exception):
+        self.log(f"Storing the state failed: {exception!r}", level="WARNING")
+
+    def send_circuit_dynamic_limit(self, currents: Currents):
+        """Send a circuit dynamic limit command to the charger, without waiting for it."""
+        self.log(f"Setting circuit dynamic limit to {currents} ({self.limit_queue.commands + 1} commands since start, "
+                 f"{len(self.command_tasks)} in flight).", level="INFO")
+        task = asyncio.get_running_loop().create_task(self.timed_circuit_dynamic_limit_command(currents))
+        self.command_tasks.add(task)
+        task.add_done_callback(self.command_tasks.discard)
+
+    async def timed_circuit_dynamic_limit_command(self, currents: Currents):
+        started = self.monotonic()
+        try:
+            await self.call_circuit_dynamic_limit_service(currents)
+        except Exception as e:
+            self.log(f"Setting circuit dynamic limit to {currents} failed: {e!r}", level="WARNING")
+            return
+        self.commands_completed += 1
+        self.command_latency += self.monotonic() - started
+        self.metrics.observe('call_service_seconds', self.monotonic() - started)
+        self.log(f"Circuit dynamic limit command took {(self.monotonic() - started) * 1000:.0f} ms "
+                 f"(average {self.command_latency / self.commands_completed * 1000:.0f} ms)", level="DEBUG")
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from collections import deque
+from math import ceil
+
+from common import Currents
+
+
+class LoadForecaster:
+    """Forecasts the load on each phase for the next few moments, from the samples of the last *window_seconds*.
+
+    The forecast is a high percentile of the recent samples, but never lower than the latest sample. A rising load is
+    followed immediately, while a falling load has to stay low for a while before the forecast follows. Limits based on
+    the forecast will hold for longer, so that a cycling household load doesn't make the charging limit go up and
+    down.
+    """
+
+    def __init__(self, window_seconds: float, percentile: float = 90):
+        self.window_seconds = window_seconds
+        self.percentile = percentile
+        self._samples: deque[tuple[float, Currents]] = deque()
+
+    def add(self, time: float, load: Currents):
+        """Add a sample, taken at *time* (seconds, monotonic)."""
+        self._samples.append((time, load))
+        while self._samples[0][0] < time - self.window_seconds:
+            self._samples.popleft()
+
+    def forecast(self) -> Currents:
+        """The forecast load on each phase."""
+        latest = self._samples[-1][1]
+        return Currents(max(latest.p1, self._percentile([load.p1 for _, load in self._samples])),
+                        max(latest.p2, self._percentile([load.p2 for _, load in self._samples])),
+                        max(latest.p3, self._percentile([load.p3 for _, load in self._samples])))
+
+    def _percentile(self, values: list[float]) -> float:
+        """The nearest-rank percentile of *values*."""
+        values.sort()
+        return values[max(0, ceil(self.percentile / 100 * len(values)) - 1)]
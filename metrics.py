@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import threading
+import time
+
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets, like a Prometheus histogram."""
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket containing the *q* quantile (or the max, if that is lower)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Counters and latency histograms of one app.
+
+    Updates are cheap, so the hot paths are always instrumented; publishing is optional (see sensor_attributes and
+    serve_metrics).
+    """
+
+    def __init__(self, app: str):
+        self.app = app
+        self.counters: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()  # Apps may update metrics from several threads.
+        REGISTRY[app] = self
+
+    def increment(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Observe the time spent in a with block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def sensor_attributes(self) -> dict[str, float]:
+        """The metrics as attributes of a Home Assistant sensor. Latencies are in milliseconds."""
+        with self._lock:
+            attributes = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                attributes[f"{name}_count"] = histogram.count
+                attributes[f"{name}_mean_ms"] = round(histogram.sum / histogram.count * 1000, 2) \
+                    if histogram.count else 0
+                attributes[f"{name}_p95_ms"] = round(histogram.quantile(0.95) * 1000, 2)
+                attributes[f"{name}_max_ms"] = round(histogram.max * 1000, 2)
+        return attributes
+
+
+# The metrics of all apps in this AppDaemon instance, by app name.
+REGISTRY: dict[str, Metrics] = {}
+
+
+def prometheus_text(registry: dict[str, Metrics] = REGISTRY, prefix: str = 'charging') -> str:
+    """The metrics of all apps, in the Prometheus text exposition format."""
+    counters: dict[str, list[tuple[str, float]]] = {}
+    histograms: dict[str, list[tuple[str, Histogram]]] = {}
+    for app, metrics in list(registry.items()):
+        with metrics._lock:
+            for name, value in metrics.counters.items():
+                counters.setdefault(name, []).append((app, value))
+            for name, histogram in metrics.histograms.items():
+                copy = Histogram(histogram.bounds)
+                copy.counts, copy.count, copy.sum = list(histogram.counts), histogram.count, histogram.sum
+                histograms.setdefault(name, []).append((app, copy))
+
+    lines = []
+    for name, values in sorted(counters.items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.extend(f'{prefix}_{name}_total{{app="{app}"}} {value}' for app, value in values)
+    for name, values in sorted(histograms.items()):
+        lines.append(f"# TYPE {prefix}_{name} histogram")
+        for app, histogram in values:
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else repr(bound)
+                lines.append(f'{prefix}_{name}_bucket{{app="{app}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_{name}_sum{{app="{app}"}} {histogram.sum}')
+            lines.append(f'{prefix}_{name}_count{{app="{app}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Don't log every scrape.
+
+
+_servers: dict[tuple[str, int], ThreadingHTTPServer] = {}
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve the metrics of all apps on http://host:port/metrics, from a background thread. Apps sharing an
+    AppDaemon instance can all ask for the same port; the server is only started once."""
+    server = _servers.get((host, port))
+    if server is None:
+        server = _servers[(host, port)] = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
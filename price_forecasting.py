@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from price_series import PriceSeries
+
+
+class PriceForecaster:
+    """Forecasts unknown prices from a profile of the price of each period of each weekday.
+
+    The profile is an exponentially weighted average of the known prices, learnt incrementally as new prices arrive.
+    A forecast is the profile, shifted by how much the last day of known prices differed from it, so that a profile
+    learnt in a cheap week also fits an expensive one. Periods that are not in the profile yet (e.g. in the first
+    week, or after a change of resolution) are repeated from the day before, like PriceSeries.extrapolate.
+
+    Periods are identified by the weekday and time of day of their start, in the UTC offset of the known prices.
+    """
+
+    def __init__(self, alpha: float = 0.25):
+        self.alpha = alpha  # Weight of the latest week.
+        self.profile: dict[tuple[int, int], float] = {}
+        # The profile before the last update, of the periods it changed (None for new periods). The known prices are
+        # compared with this, as the updated profile already includes them.
+        self.previous: dict[tuple[int, int], float | None] = {}
+        self.learnt_until: datetime | None = None
+
+    @staticmethod
+    def key(start: datetime) -> tuple[int, int]:
+        return start.weekday(), start.hour * 60 + start.minute
+
+    def update(self, prices: PriceSeries) -> int:
+        """Learn from the periods of *prices* that start after those already learnt. Returns their number."""
+        first = 0 if self.learnt_until is None else bisect_left(prices.starts, self.learnt_until)
+        if first < len(prices):
+            self.previous = {}
+        for start, value in zip(prices.starts[first:], prices.values[first:]):
+            key = self.key(start)
+            expected = self.profile.get(key)
+            self.previous[key] = expected
+            self.profile[key] = value if expected is None else expected + self.alpha * (value - expected)
+        if first < len(prices):
+            self.learnt_until = prices.ends[-1]
+        return len(prices) - first
+
+    def extrapolate(self, prices: PriceSeries, end: datetime) -> PriceSeries:
+        """Fill missing periods up to *end* with forecast prices. Like PriceSeries.extrapolate, which decides the
+        periods, and the prices of periods not in the profile."""
+        extrapolated = prices.extrapolate(end)
+        known = len(prices)
+        if len(extrapolated) <= known or not self.profile:
+            return extrapolated
+
+        # How much the last day of known prices differed from the profile, before the profile learnt them.
+        last_day = bisect_left(prices.starts, prices.ends[-1] - timedelta(days=1))
+        deviations = [value - expected
+                      for start, value in zip(prices.starts[last_day:], prices.values[last_day:])
+                      if (expected := self.expected(self.key(start))) is not None]
+        offset = sum(deviations) / len(deviations) if deviations else 0.0
+
+        values = list(extrapolated.values)
+        for i in range(known, len(extrapolated)):
+            expected = self.profile.get(self.key(extrapolated.starts[i]))
+            if expected is not None:
+                values[i] = expected + offset
+        return PriceSeries(extrapolated.starts, extrapolated.ends, values)
+
+    def expected(self, key: tuple[int, int]) -> float | None:
+        """The price of a period, according to the profile before the last update."""
+        return self.previous[key] if key in self.previous else self.profile.get(key)
+
+    def dump(self) -> dict:
+        """The profile, for storing."""
+        return {'learnt_until': self.learnt_until.isoformat() if self.learnt_until else None,
+                'profile': [[weekday, minute, value] for (weekday, minute), value in self.profile.items()],
+                'previous': [[weekday, minute, value] for (weekday, minute), value in self.previous.items()]}
+
+    def load(self, state: dict):
+        """Restores a stored profile."""
+        learnt_until = state.get('learnt_until')
+        self.learnt_until = datetime.fromisoformat(learnt_until) if learnt_until else None
+        self.profile = {(weekday, minute): value for weekday, minute, value in state.get('profile', [])}
+        self.previous = {(weekday, minute): value for weekday, minute, value in state.get('previous', [])}
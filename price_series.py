@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+
+class PriceSeries:
+    """Price periods, stored as columns of start times, end times and values, sorted by start time.
+
+    Series are treated as immutable; operations return new series (or the same series, if nothing changes), so a
+    series can be shared, for example between all vehicles planned against the same prices.
+    """
+    __slots__ = ('starts', 'ends', 'values')
+
+    def __init__(self, starts: list[datetime], ends: list[datetime], values: list[float]):
+        self.starts = starts
+        self.ends = ends
+        self.values = values
+
+    @classmethod
+    def from_periods(cls, periods: list[dict]) -> PriceSeries:
+        """Creates a series from a list of periods (dicts with 'start', 'end' and 'value')."""
+        return cls([p['start'] for p in periods], [p['end'] for p in periods], [p['value'] for p in periods])
+
+    def to_periods(self) -> list[dict]:
+        """Returns the series as a list of periods (dicts with 'start', 'end' and 'value')."""
+        return [{'start': start, 'end': end, 'value': value}
+                for start, end, value in zip(self.starts, self.ends, self.values)]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def extrapolate(self, end: datetime) -> PriceSeries:
+        """
+        Fill missing periods up to *end*, assuming that prices will be the same as the same period the preceding
+        day.
+
+        The "same period the preceding day" is the first period starting at least 24 hours before the period to
+        fill. Since periods are only ever appended, that index only moves forward, so filling is linear in the number
+        of periods. 24 hours are counted in absolute time, and each added period starts where the previous one ends,
+        so days with 92 or 100 periods (DST changes) are repeated without gaps or overlaps.
+        """
+        if self.ends[-1] >= end and not self.starts[-1] < end < self.ends[-1]:
+            return self  # Nothing to fill or cut.
+        starts, ends, values = list(self.starts), list(self.ends), list(self.values)
+
+        # Fill missing periods.
+        previous_day_index = 0
+        while ends[-1] < end:
+            filled_end = ends[-1]
+            day_before = filled_end - timedelta(days=1)
+            while starts[previous_day_index] < day_before:
+                previous_day_index += 1
+            starts.append(filled_end)
+            ends.append(filled_end + (ends[previous_day_index] - starts[previous_day_index]))
+            values.append(values[previous_day_index])
+
+        # Make sure the last period ends at the requested end time.
+        if starts[-1] < end < ends[-1]:
+            ends[-1] = end
+
+        return PriceSeries(starts, ends, values)
+
+    def window(self, start: datetime, end: datetime) -> PriceSeries:
+        """Returns the periods between *start* and *end*, with the first and last periods cut to fit."""
+        first, last = self.index_range(start, end)
+        starts, ends, values = self.starts[first:last], self.ends[first:last], self.values[first:last]
+        if starts:
+            starts[0] = max(starts[0], start)
+            ends[-1] = min(ends[-1], end)
+        return PriceSeries(starts, ends, values)
+
+    def index_range(self, start: datetime, end: datetime) -> tuple[int, int]:
+        """Returns the range of indices of the periods between *start* and *end*."""
+        return bisect_right(self.ends, start), bisect_left(self.starts, end)
+
+    def order_by_value(self) -> list[int]:
+        """Returns the indices of the periods, from the cheapest to the most expensive."""
+        return sorted(range(len(self.values)), key=self.values.__getitem__)
+
+    def contiguous_slots(self, indices: list[int]) -> list[dict[str, datetime]]:
+        """Merges the periods at *indices* into contiguous slots (dicts with 'start' and 'end')."""
+        slots = []
+        for i in sorted(indices):
+            if slots and slots[-1]['end'] == self.starts[i]:
+                slots[-1]['end'] = self.ends[i]
+            else:
+                slots.append({'start': self.starts[i], 'end': self.ends[i]})
+        return slots
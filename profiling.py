@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import cProfile
+from datetime import datetime
+import os
+import random
+import time
+from typing import Any, Callable
+
+
+class Profiler:
+    """Profiles a sample of calls with cProfile, while switched on, and writes the aggregated profile to a file when
+    switched off or when the window has passed.
+
+    When not switched on, a call costs one attribute check.
+    """
+
+    def __init__(self, name: str, directory: str, sample_rate: float = 0.1, window: float = 600,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.window = window  # seconds
+        self.clock = clock
+        self.active = False
+        self.profile: cProfile.Profile | None = None
+        self.until = 0.0
+        self.samples = 0
+        self.skipped = 0  # Another profiler was active.
+        self.path: str | None = None  # The last profile written.
+
+    def start(self):
+        """Start sampling, for at most the window."""
+        if not self.active:
+            self.profile = cProfile.Profile()
+            self.samples = 0
+            self.skipped = 0
+        self.until = self.clock() + self.window
+        self.active = True
+
+    def stop(self) -> str | None:
+        """Stop sampling. Returns the file the profile was written to, if any calls were sampled."""
+        if not self.active:
+            return None
+        self.active = False
+        profile, self.profile = self.profile, None
+        if self.samples == 0:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{self.name}-{datetime.now():%Y%m%d-%H%M%S}.prof")
+        profile.dump_stats(self.path)
+        return self.path
+
+    def sample(self) -> bool:
+        """Whether to profile the next call."""
+        if not self.active:
+            return False
+        if self.clock() >= self.until:
+            self.stop()
+            return False
+        return random.random() < self.sample_rate
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call *func*, profiling the call if it is sampled."""
+        if not self.active or not self.sample():
+            return func(*args, **kwargs)
+        profile = self.profile
+        try:
+            profile.enable()
+        except ValueError:
+            self.skipped += 1  # Another profiler is active (e.g. a sampled call of another app, in Python 3.12+).
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            self.samples += 1
@@ -1,18 +1,31 @@
 """App for scheduling charging."""
 from __future__ import annotations
 
+from collections import deque
 from datetime import datetime, timedelta
 from dateutil import parser
+import hashlib
+import json
+import tempfile
 from typing import Any
 
 from appdaemon.plugins.hass.hassapi import Hass
 
 from charger import Charger
+from dispatching import CoalescingDispatcher
+from metrics import Metrics, serve_metrics
+from profiling import Profiler
+from price_forecasting import PriceForecaster
+from price_series import PriceSeries
+from state_store import StateStore, StateWriter
 
 
 # The electrical grid voltage
 VOLTAGE = 230
 
+# Assume that charging averages at 80 % of the max charging power.
+AVERAGE_CHARGING_RATE = 0.8
+
 
 class Scheduler(Hass):
     charger: Charger = None
@@ -23,9 +36,52 @@ class Scheduler(Hass):
     price_entity = None
     car_battery_size_kwh = 64
     target_state_of_charge = 100
+    charging_phases = 1
     reschedule_on_next_state_of_charge_change = False
+    price_table: PriceTable = None
+    price_forecaster: PriceForecaster = None
+    known_prices: PriceSeries | None = None
+    schedule: list[dict] | None = None
+    schedule_prices: PriceSeries | None = None
+    full_replans = 0
+    incremental_replans = 0
+    reschedule_dispatcher: CoalescingDispatcher = None
+    reschedule_debounce = 2  # seconds
+    reschedule_max_wait = 30  # seconds, that a steady stream of events can hold off a reschedule
+    eta_granularity = timedelta(minutes=1)
+    published_charge_now_attributes: dict | None = None
+    suppressed_charge_now_writes = 0
+    state_store: StateStore | None = None
+    state_writer: StateWriter | None = None
+    prices_changed = False  # Since the parsed prices were last stored.
+    prices_digest: str | None = None  # Of the raw prices, for telling if a stored plan was made for them.
+    metrics: Metrics = None
+    metrics_entity_id: str | None = None
+    metrics_interval = 60  # seconds, between updates of the metrics sensor
+    profiler: Profiler = None
+    slot_timers: dict[datetime, str] = {}  # Timer handles, by the slot start or end they run at.
 
     async def initialize(self):
+        self.slot_timers = {}
+        self.metrics = Metrics(self.name)
+
+        # Optionally, profile a sample of the reschedules while a switch is on.
+        self.profiler = Profiler(self.name, str(self.args.get('profiling_directory', tempfile.gettempdir())),
+                                 float(self.args.get('profiling_sample_rate', 0.1)),
+                                 float(self.args.get('profiling_window_seconds', 600)))
+        if 'profiling_entity_id' in self.args:
+            profiling_entity_id = str(self.args['profiling_entity_id'])
+            if await self.get_state(profiling_entity_id) == 'on':
+                await self.start_profiling()
+            await self.listen_state(self.profiling_cb, profiling_entity_id)
+        # Bursts of events (e.g. last known state of charge, immediately followed by state of charge) are collapsed
+        # into one reschedule. A chatty entity must not hold off the reschedule at a slot boundary for long, though.
+        self.reschedule_debounce = float(self.args.get('reschedule_debounce_seconds', self.reschedule_debounce))
+        self.reschedule_max_wait = float(self.args.get('reschedule_max_wait_seconds', self.reschedule_max_wait))
+        self.reschedule_dispatcher = CoalescingDispatcher(self.reschedule, self.reschedule_debounce,
+                                                          on_error=self.reschedule_failed,
+                                                          max_wait_seconds=self.reschedule_max_wait)
+
         # Charger and home
         charger_status_entity_id = str(self.args['charger_status_entity_id'])
         self.charger = Charger(self.get_entity(charger_status_entity_id), None, None)
@@ -36,9 +92,17 @@ class Scheduler(Hass):
         self.smart_charge = await self.get_state(smart_charging_entity_id) == 'on'
         await self.listen_state(self.smart_charging_cb, smart_charging_entity_id)
 
+        # Are we charging on one or three phases? (One, unless configured.)
+        if 'one_phase_charging_entity_id' in self.args:
+            one_phase_charging_entity_id = str(self.args['one_phase_charging_entity_id'])
+            self.charging_phases = 1 if await self.get_state(one_phase_charging_entity_id) == 'on' else 3
+            await self.listen_state(self.one_phase_charging_cb, one_phase_charging_entity_id)
+
         # The charge-now entity is the one we will use to control charging.
         charge_now_entity_id = str(self.args['charge_now_entity_id'])
         self.charge_now_switch = self.get_entity(charge_now_entity_id)
+        self.eta_granularity = timedelta(seconds=float(self.args.get('eta_granularity_seconds',
+                                                                     self.eta_granularity.total_seconds())))
 
         # The current state of charge is used to decide how much the car needs to charge.
         state_of_charge_entity_id = str(self.args['state_of_charge_entity_id'])
@@ -59,43 +123,105 @@ class Scheduler(Hass):
         # Electricity price
         price_entity_id = str(self.args['price_entity_id'])
         self.price_entity = self.get_entity(price_entity_id)
-
-        # Run scheduling every half hour + 1 minute.
-        next_occurrence = round_datetime_up(await self.get_now(), timedelta(minutes=30), timedelta(minutes=1))
-        # next_occurrence = datetime.now() + timedelta(minutes=1)
-        self.log(f"Scheduling next at {next_occurrence}")
-        await self.run_every(self.scheduler_cb, next_occurrence, 30 * 60)
-
-        await self.handle_current_state()
+        self.price_table = PriceTable()
+        self.price_forecaster = PriceForecaster()
+        await self.listen_state(self.price_cb, price_entity_id, attribute='all')
+
+        # Optionally, resume with the parsed prices and the plan from before a restart.
+        if 'state_file' in self.args:
+            self.state_store = StateStore(str(self.args['state_file']))
+            self.state_writer = StateWriter(self.state_store, self.state_write_failed)
+            self.restore_state()
+
+        # Optionally, publish the metrics as the attributes of a sensor, at a limited rate, and/or serve them to
+        # Prometheus.
+        self.metrics_entity_id = self.args.get('metrics_entity_id')
+        self.metrics_interval = float(self.args.get('metrics_interval_seconds', self.metrics_interval))
+        if self.metrics_entity_id is not None:
+            await self.run_every(self.publish_metrics_cb, "now", self.metrics_interval)
+        if 'metrics_port' in self.args:
+            serve_metrics(int(self.args['metrics_port']))
+
+        self.reschedule_dispatcher.request()
 
     async def charger_status_cb(self, entity, attribute, old, new, kwargs):
         """Callback for the charger status sensor."""
-        await self.handle_current_state()
+        self.reschedule_dispatcher.request()
 
     async def departure_time_cb(self, entity, attribute, old, new, kwargs):
         """Callback for the departure time sensor."""
         await self.set_departure_time(await self.parse_datetime(new, aware=True))
-        await self.handle_current_state()
+        self.schedule = None
+        self.reschedule_dispatcher.request()
 
     async def smart_charging_cb(self, entity, attribute, old, new, kwargs):
         """Callback for the smart charging switch."""
         self.smart_charge = new == 'on'
         self.log(f"Smart charging: {new}")
-        await self.handle_current_state()
+        self.schedule = None
+        self.reschedule_dispatcher.request()
+
+    async def one_phase_charging_cb(self, entity, attribute, old, new, kwargs):
+        """Callback for the one phase charging switch."""
+        self.charging_phases = 1 if new == 'on' else 3
+        self.log(f"Charging phases: {self.charging_phases}")
+        self.schedule = None
+        self.reschedule_dispatcher.request()
 
     async def state_of_charge_cb(self, entity, attribute, old, new, kwargs):
         """Callback for the state of charge sensor."""
         self.log(f"State of charge: {new} %")
-        # TODO: Should we reschedule? Maybe if the state of charge has changed significantly?
-        #       Why do we even have both state_of_charge_entity and last_known_state_of_charge_entity?
+        # TODO: Why do we even have both state_of_charge_entity and last_known_state_of_charge_entity?
         if self.reschedule_on_next_state_of_charge_change:
             self.reschedule_on_next_state_of_charge_change = False
-            await self.handle_current_state()
+            self.schedule = None
+        # Unless the schedule was cleared, the reschedule just trims the current schedule to the remaining time to
+        # charge.
+        self.reschedule_dispatcher.request()
+
+    async def price_cb(self, entity, attribute, old, new, kwargs):
+        """Callback for the price sensor."""
+        # The state (the current price) changes every period, but only new prices change the plan.
+        if old is not None and raw_prices(old['attributes']) == raw_prices(new['attributes']):
+            return
+        # The prices are parsed again (reusing already parsed rows) the next time they are needed.
+        self.known_prices = None
+        self.prices_digest = None
+        self.schedule = None
+        self.reschedule_dispatcher.request()
+
+    async def slot_boundary_cb(self, kwargs):
+        """Timer callback for the start or end of a charging slot."""
+        self.slot_timers.pop(kwargs['boundary'], None)
+        self.reschedule_dispatcher.request()
+
+    async def profiling_cb(self, entity, attribute, old, new, kwargs):
+        """Callback for the profiling switch."""
+        if new == 'on':
+            await self.start_profiling()
+            self.log(f"Profiling {self.profiler.sample_rate:.0%} of the full replans for "
+                     f"{self.profiler.window:.0f} seconds.")
+            return
+        self.stop_profiling()
+
+    async def profiling_window_cb(self, kwargs):
+        """Timer callback for the end of the profiling window, if profiling was not stopped or restarted since."""
+        if self.profiler.active and self.profiler.until == kwargs['until']:
+            self.stop_profiling()
 
-    async def scheduler_cb(self, *args, **kwargs):
-        """Callback for the scheduler."""
-        self.log(f"Scheduler callback called.")
-        await self.handle_current_state()
+    async def start_profiling(self):
+        """Start profiling, until the window has passed, even if no more full replans are sampled."""
+        self.profiler.start()
+        await self.run_in(self.profiling_window_cb, self.profiler.window, until=self.profiler.until)
+
+    def stop_profiling(self):
+        self.profiler.stop()
+        self.log(f"Profiling stopped. Profile of {self.profiler.samples} full replans: {self.profiler.path}")
+
+    async def publish_metrics_cb(self, _):
+        """Timer callback for updating the metrics sensor."""
+        await self.set_state(self.metrics_entity_id, state=self.full_replans + self.incremental_replans,
+                             attributes=self.metrics.sensor_attributes())
 
     async def last_known_state_of_charge_cb(self, entity, attribute, old, new, kwargs):
         """Callback for the last known state of charge sensor."""
@@ -103,7 +229,11 @@ class Scheduler(Hass):
         # The state_of_charge_entity may not yet have been updated, if it is a calculated entity, based on
         # last_known_state_of_charge_entity.
         self.reschedule_on_next_state_of_charge_change = True
-        await self.handle_current_state()
+        self.reschedule_dispatcher.request()
+
+    def reschedule_failed(self, exception: Exception):
+        """Called when a requested reschedule fails."""
+        self.error(f"Rescheduling failed: {exception!r}")
 
     async def set_departure_time(self, time: datetime):
         """Set the departure time."""
@@ -118,9 +248,83 @@ class Scheduler(Hass):
             self.log(f"Departure time: {time} is in the past. Setting to 07:00.")
         self.departure_time = departure_time
 
+    async def reschedule(self):
+        """Schedule charging, and store the plan."""
+        with self.metrics.timer('reschedule_seconds'):
+            await self.handle_current_state()
+            await self.set_slot_timers(self.schedule if self.smart_charge else None)
+            self.save_state()
+        self.metrics.increment('reschedules')
+
+    async def set_slot_timers(self, schedule: list[dict] | None):
+        """Reschedule at each start and end of the charging slots, so that charging is switched on and off on
+        time. Only timers for starts and ends that were added or removed since the last plan are changed."""
+        now = await self.get_now()
+        boundaries = {time for slot in schedule or [] for time in (slot['start'], slot['end']) if time > now}
+        for time in set(self.slot_timers) - boundaries:
+            await self.cancel_timer(self.slot_timers.pop(time))
+        for time in sorted(boundaries - set(self.slot_timers)):
+            self.slot_timers[time] = await self.run_at(self.slot_boundary_cb, time, boundary=time)
+
+    def plan_inputs(self) -> dict:
+        """What the plan depends on, apart from the state of charge."""
+        return {'departure_time': self.departure_time.isoformat(),
+                'charging_phases': self.charging_phases,
+                'smart_charge': self.smart_charge,
+                'prices': self.get_prices_digest()}
+
+    def get_prices_digest(self) -> str:
+        """A digest of the raw prices, computed once for each new set of prices."""
+        if self.prices_digest is None:
+            self.prices_digest = hashlib.sha1(json.dumps(raw_prices(self.price_entity.attributes),
+                                                         default=str).encode()).hexdigest()
+        return self.prices_digest
+
+    def save_state(self):
+        """Store the plan, and the parsed prices if they have changed, if a state file is configured. The file is
+        written in an executor thread, so that the event loop doesn't wait for the disk."""
+        if self.state_writer is None:
+            return
+        values = {'reschedule_on_next_state_of_charge_change': self.reschedule_on_next_state_of_charge_change,
+                  'plan': None}
+        if self.prices_changed:
+            # Dumping the price table and the forecast profile is not free, and they only change with new prices.
+            values['price_table'] = self.price_table.dump()
+            values['price_forecast'] = self.price_forecaster.dump()
+            self.prices_changed = False
+        if self.schedule is not None and self.schedule_prices is not None:
+            values['plan'] = {
+                'inputs': self.plan_inputs(),
+                'schedule': [{'start': slot['start'].isoformat(), 'end': slot['end'].isoformat()}
+                             for slot in self.schedule],
+                'prices': {'starts': [start.isoformat() for start in self.schedule_prices.starts],
+                           'ends': [end.isoformat() for end in self.schedule_prices.ends],
+                           'values': self.schedule_prices.values}}
+        self.state_writer.update(values)
+
+    def state_write_failed(self, exception: Exception):
+        self.log(f"Storing the state failed: {exception!r}", level="WARNING")
+
+    def restore_state(self):
+        """Restore the parsed prices and, if it was made for the same prices and settings, the plan."""
+        self.price_table.load(self.state_store.get('price_table', []))
+        self.price_forecaster.load(self.state_store.get('price_forecast', {}))
+        self.reschedule_on_next_state_of_charge_change = self.state_store.get(
+            'reschedule_on_next_state_of_charge_change', False)
+        plan = self.state_store.get('plan')
+        if plan is None or plan['inputs'] != self.plan_inputs():
+            return
+        self.schedule = [{'start': datetime.fromisoformat(slot['start']), 'end': datetime.fromisoformat(slot['end'])}
+                         for slot in plan['schedule']]
+        self.schedule_prices = PriceSeries([datetime.fromisoformat(start) for start in plan['prices']['starts']],
+                                           [datetime.fromisoformat(end) for end in plan['prices']['ends']],
+                                           plan['prices']['values'])
+        self.log(f"Resuming the plan from before the restart: {self.schedule}")
+
     async def handle_current_state(self):
         """Schedule charging."""
         current_soc = float(self.state_of_charge_entity.state)
+        self.metrics.increment('entity_reads')
         time_to_charge = self.estimate_time_to_charge(current_soc, self.target_state_of_charge)
 
         if not self.smart_charge:
@@ -131,18 +335,44 @@ class Scheduler(Hass):
 
         if current_soc >= self.target_state_of_charge:
             await self.target_reached(current_soc)
+            return
 
         self.log(f"Estimated time to charge from {current_soc} to {self.target_state_of_charge} %: {time_to_charge}")
 
-        available_periods = self.get_prices(await self.get_now(), self.departure_time)
-        try:
-            charging_slots = create_schedule(available_periods, time_to_charge)
-        except NotEnoughTimeException:
-            await self.not_enough_time(time_to_charge)
-            return
+        # Keep the current schedule, trimmed to the remaining time to charge, unless it is too short. It is cleared
+        # when prices, departure time or smart charging change.
+        now = await self.get_now()
+        charging_slots = trim_schedule(self.schedule, now, time_to_charge) if self.schedule else None
+        if charging_slots is None:
+            try:
+                # Only this is profiled: a coroutine's profile would include whatever else ran while it waited.
+                available_periods, charging_slots, estimated_cost = self.profiler.call(self.create_schedule, now,
+                                                                                       current_soc)
+            except NotEnoughTimeException:
+                self.schedule = None
+                await self.not_enough_time(time_to_charge)
+                return
+            self.schedule_prices = available_periods
+            self.full_replans += 1
+        else:
+            estimated_cost = estimate_cost(self.schedule_prices, charging_slots, self.estimate_charging_power())
+            self.incremental_replans += 1
+        self.schedule = charging_slots
+        self.log(f"Replans: {self.full_replans} full, {self.incremental_replans} incremental", level="DEBUG")
+        self.log(f"Estimated cost: {estimated_cost:.2f} {self.price_entity.attributes.get('currency')}")
 
         # Charge when in time slot.
-        await self.charge_in_time_slot(charging_slots, time_to_charge)
+        await self.charge_in_time_slot(charging_slots, time_to_charge, estimated_cost)
+
+    def create_schedule(self, now: datetime, current_soc: float) -> tuple[PriceSeries, list[dict], float]:
+        """Plans charging from *current_soc* to the target before the departure time, in the cheapest periods.
+        Returns the periods it was planned from, the charging slots and the estimated cost."""
+        energy_to_charge_kwh = self.estimate_energy_to_charge(current_soc, self.target_state_of_charge)
+        available_periods = self.get_prices(now, self.departure_time)
+        with self.metrics.timer('create_schedule_seconds'):
+            charging_slots, estimated_cost = create_energy_schedule(available_periods, energy_to_charge_kwh,
+                                                                    self.estimate_charging_power())
+        return available_periods, charging_slots, estimated_cost
 
     async def target_reached(self, current_soc):
         if self.target_state_of_charge >= 100:
@@ -174,13 +404,14 @@ class Scheduler(Hass):
         if self.charge_now_switch.state == "off":
             self.log(f"Not enough time to charge to {self.target_state_of_charge} %, but charging is off. "
                      f"Enabling charging. ETA: {eta}")
-        # Always set the state, including reason.
+        # Always set the state, including reason (unless it has not changed).
         self.log(f"Not enough time to charge to {self.target_state_of_charge} %. ETA: {eta}")
         await self.set_charge_now_switch(state="on",
                                          reason="Not enough time to charge",
                                          eta=eta)
 
-    async def charge_in_time_slot(self, contiguous_slots: list[dict], needed_time: timedelta):
+    async def charge_in_time_slot(self, contiguous_slots: list[dict], needed_time: timedelta,
+                                  estimated_cost: float | None = None):
         """Starts charging when in a scheduled charging time slot."""
         now = await self.get_now()
         if in_time_slot(now, start=contiguous_slots[0]['start'], end=contiguous_slots[0]['end']):
@@ -197,78 +428,377 @@ class Scheduler(Hass):
                 self.log("Charging is already disabled.", level="DEBUG")
         eta = calculate_eta(now, needed_time, contiguous_slots)
         # Set state, including reason, eta, and schedule attributes (which may have changed even if charge-now didn't).
+        # Nothing is written if none of them have changed.
         await self.set_charge_now_switch(state=target_state,
                                          reason=f"scheduled {target_state}",
                                          eta=eta,
-                                         schedule=contiguous_slots)
+                                         schedule=contiguous_slots,
+                                         estimated_cost=estimated_cost)
 
     async def set_charge_now_switch(self,
                                     state: str,
                                     reason: str,
                                     eta: datetime | None = None,
-                                    schedule: list[dict] | None = None):
+                                    schedule: list[dict] | None = None,
+                                    estimated_cost: float | None = None):
         attributes = {"reason": reason}
         if eta:
-            attributes['eta'] = str(eta)
+            # Round the ETA, so that it doesn't cause a write every time it moves a few seconds.
+            attributes['eta'] = str(round_datetime_up(eta, self.eta_granularity))
         if schedule:
-            attributes['schedule'] = schedule
-        self.log(f"Setting charge now switch {state} {attributes}")
+            # Likewise the slots, whose trimmed end may be off by a microsecond from one schedule to the next.
+            attributes['schedule'] = [{**slot,
+                                       'start': round_datetime_up(slot['start'], timedelta(seconds=1)),
+                                       'end': round_datetime_up(slot['end'], timedelta(seconds=1))}
+                                      for slot in schedule]
+        if estimated_cost is not None:
+            attributes['estimated_cost'] = round(estimated_cost, 2)
+            attributes['currency'] = self.price_entity.attributes.get("currency")
+
+        # Every write goes through the recorder and out to every dashboard. Skip it if nothing has changed.
+        if state == self.charge_now_switch.state and attributes == self.published_charge_now_attributes:
+            self.suppressed_charge_now_writes += 1
+            self.metrics.increment('state_writes_suppressed')
+            self.log(f"Charge now switch is already {state} {attributes} "
+                     f"({self.suppressed_charge_now_writes} writes suppressed)", level="DEBUG")
+            return
 
+        self.log(f"Setting charge now switch {state} {attributes}")
         await self.charge_now_switch.set_state(state=state, attributes=attributes, replace=True)
+        self.published_charge_now_attributes = attributes
+        self.metrics.increment('state_writes')
 
     def estimate_time_to_charge(self, current_soc, target_soc=100):
         if current_soc >= target_soc:
             return timedelta(0)
-        energy_to_charge_kwh = (self.target_state_of_charge - current_soc) / 100 * self.car_battery_size_kwh
-        min_charge_time = charge_time(energy_to_charge_kwh, self.charger.max_charging_current)
-        return min_charge_time / 0.8  # Assume averaging charging rate at 80 % of max.
+        energy_to_charge_kwh = self.estimate_energy_to_charge(current_soc, target_soc)
+        min_charge_time = charge_time(energy_to_charge_kwh, self.charger.max_charging_current, self.charging_phases)
+        return min_charge_time / AVERAGE_CHARGING_RATE
+
+    def estimate_energy_to_charge(self, current_soc, target_soc=100) -> float:
+        """Returns the energy (kWh) needed to charge from *current_soc* to *target_soc*."""
+        if current_soc >= target_soc:
+            return 0
+        return (target_soc - current_soc) / 100 * self.car_battery_size_kwh
+
+    def estimate_charging_power(self) -> float:
+        """Returns the expected average charging power (kW)."""
+        return self.charger.max_charging_current * self.charging_phases * VOLTAGE / 1000 * AVERAGE_CHARGING_RATE
 
     def get_prices(self, start: datetime, end: datetime):
-        tomorrow = self.price_entity.attributes.get("raw_tomorrow", [])
-        today = self.price_entity.attributes.get("raw_today", [])
-        known_prices = parse_prices(today + tomorrow)
+        if self.known_prices is None:
+            tomorrow = self.price_entity.attributes.get("raw_tomorrow", [])
+            today = self.price_entity.attributes.get("raw_today", [])
+            self.known_prices = PriceSeries.from_periods(self.price_table.update(today + tomorrow))
+            # Learn the new prices, for forecasting prices beyond them.
+            self.price_forecaster.update(self.known_prices)
+            self.prices_changed = True
+        known_prices = self.known_prices
         try:
-            return get_prices(known_prices, start, end)
+            return get_price_series(known_prices, start, end, self.price_forecaster)
         except IndexError:
             # I have once seen this happen, but wasn't able to find the cause. Log input data in case it happens again.
-            self.error(f"Failed to get prices (known prices: {known_prices}, start: {start}, end: {end}")
+            self.error(f"Failed to get prices (known prices: {known_prices.to_periods()}, start: {start}, end: {end}")
             raise
 
 
-def create_schedule(available_periods: list[dict[str, datetime]], needed_time: timedelta) -> list[dict[str, datetime]]:
+def create_schedule(available_periods: list[dict[str, datetime]] | PriceSeries,
+                    needed_time: timedelta) -> list[dict[str, datetime]]:
+    if not isinstance(available_periods, PriceSeries):
+        available_periods = PriceSeries.from_periods(available_periods)
     if len(available_periods) == 0:
         raise NotEnoughTimeException(needed_time, timedelta(hours=0))
-    periods_by_price = sorted(available_periods, key=lambda x: x['value'])
 
-    periods_to_charge = []
-    used_time = timedelta(0)
-    for period in periods_by_price:
-        periods_to_charge.append(period)
-        used_time += period['end'] - period['start']
-        if used_time >= needed_time:
+    periods_to_charge = get_cheapest_periods(available_periods, available_periods.order_by_value(),
+                                             available_periods.starts[0], available_periods.ends[-1], needed_time)
+    contiguous_slots = available_periods.contiguous_slots(periods_to_charge)
+
+    return contiguous_slots
+
+
+def create_energy_schedule(available_periods: list[dict[str, datetime]] | PriceSeries,
+                           energy_kwh: float,
+                           max_power_kw: float | list[float]) -> tuple[list[dict[str, datetime]], float]:
+    """Create a schedule for charging *energy_kwh* at the lowest cost.
+
+    Energy is allocated to the cheapest periods first, at most *max_power_kw* in each (either the same for all
+    periods or one value per period). The last period is only used for as long as needed, placed next to another
+    scheduled period if possible, so that charging isn't interrupted.
+
+    Returns the contiguous slots and the estimated cost, in the currency of the prices (per kWh).
+    """
+    if not isinstance(available_periods, PriceSeries):
+        available_periods = PriceSeries.from_periods(available_periods)
+    if not isinstance(max_power_kw, list):
+        max_power_kw = [max_power_kw] * len(available_periods)
+
+    energy_per_period = {}
+    remaining_kwh = energy_kwh
+    estimated_cost = 0
+    for i in available_periods.order_by_value():
+        if remaining_kwh <= 0:
             break
+        hours = (available_periods.ends[i] - available_periods.starts[i]) / timedelta(hours=1)
+        energy = min(remaining_kwh, max_power_kw[i] * hours)
+        if energy <= 0:
+            continue
+        energy_per_period[i] = energy
+        remaining_kwh -= energy
+        estimated_cost += energy * available_periods.values[i]
+    if remaining_kwh > 0:
+        available_time = available_periods.ends[-1] - available_periods.starts[0] if len(available_periods) else \
+            timedelta(0)
+        available_kwh = energy_kwh - remaining_kwh
+        needed_time = available_time * (energy_kwh / available_kwh) if available_kwh else timedelta.max
+        raise NotEnoughTimeException(needed_time, available_time)
+
+    slots = []
+    for i, energy in energy_per_period.items():
+        start, end = available_periods.starts[i], available_periods.ends[i]
+        charging_time = timedelta(hours=energy / max_power_kw[i])
+        if charging_time < end - start:
+            # Only part of the period is needed.
+            if i - 1 not in energy_per_period and i + 1 in energy_per_period:
+                start = end - charging_time
+            else:
+                end = start + charging_time
+        slots.append({'start': start, 'end': end})
+
+    return get_contiguous_slots(slots), estimated_cost
+
+
+def create_schedules(available_periods: list[dict[str, datetime]] | PriceSeries,
+                     requests: list[tuple[datetime, datetime, timedelta]]
+                     ) -> list[tuple[list[dict[str, datetime]] | None, datetime]]:
+    """Create schedules for several vehicles charging against the same prices.
+
+    Each request is a (start, departure, needed time) tuple, and *available_periods* must cover all of them. The
+    prices are only ordered once, for all requests.
+
+    Returns a (schedule, ETA) tuple per request. If there is not enough time before departure, the schedule is None
+    and the ETA assumes that charging starts immediately.
+    """
+    if not isinstance(available_periods, PriceSeries):
+        available_periods = PriceSeries.from_periods(available_periods)
+    periods_by_price = available_periods.order_by_value()
+
+    schedules = []
+    for start, departure, needed_time in requests:
+        try:
+            periods_to_charge = get_cheapest_periods(available_periods, periods_by_price, start, departure,
+                                                     needed_time)
+        except NotEnoughTimeException:
+            schedules.append((None, calculate_eta(start, needed_time)))
+            continue
+        contiguous_slots = get_contiguous_slots_between(available_periods, periods_to_charge, start, departure)
+        schedules.append((contiguous_slots, calculate_eta(start, needed_time, contiguous_slots)))
+    return schedules
+
+
+def create_site_schedules(available_periods: list[dict[str, datetime]] | PriceSeries,
+                          requests: list[tuple[datetime, datetime, timedelta, float]],
+                          site_capacity: float | list[float]
+                          ) -> list[tuple[list[dict[str, datetime]] | None, datetime]]:
+    """Create schedules for several chargers sharing the same main fuse.
+
+    Each request is a (start, departure, needed time, charging current) tuple, and *available_periods* must cover all
+    of them. *site_capacity* is the current (A) available for charging in each period, either the same for all
+    periods or one value per period.
+
+    The chargers are planned jointly, as a min-cost flow from the chargers, through the periods in their time windows,
+    to the site capacity, by successive shortest paths: a charger gets one period at a time, in the cheapest way, which
+    may move other chargers to other periods to make room for it (see find_augmenting_path). With the same charging
+    current for all chargers, this is the cheapest plan (in whole periods) for the site. No period is planned above
+    the site capacity, so the load balancer doesn't have to throttle the chargers (and ruin the ETAs).
+
+    Returns a (schedule, ETA) tuple per request, as create_schedules. A charger that doesn't fit, next to those
+    departing before it, charges immediately, and is left to the load balancer.
+    """
+    if not isinstance(available_periods, PriceSeries):
+        available_periods = PriceSeries.from_periods(available_periods)
+    if isinstance(site_capacity, list):
+        remaining_capacity = list(site_capacity)
     else:
-        raise NotEnoughTimeException(needed_time, used_time)
+        remaining_capacity = [site_capacity] * len(available_periods)
+
+    # The time each charger can charge in each period in its time window.
+    usable_time = []
+    for start, departure, _, _ in requests:
+        first, last = available_periods.index_range(start, departure)
+        usable_time.append({i: min(available_periods.ends[i], departure) - max(available_periods.starts[i], start)
+                            for i in range(first, last)})
+    periods_by_price = available_periods.order_by_value()
+    currents = [request[3] for request in requests]
+    held = [set() for _ in requests]  # The periods planned for each charger.
+    holders = [set() for _ in range(len(available_periods))]  # The chargers planned in each period.
+
+    fits = [False] * len(requests)
+    for r in sorted(range(len(requests)), key=lambda r: requests[r][1]):
+        needed_time = requests[r][2]
+        while not held[r] or sum((usable_time[r][i] for i in held[r]), timedelta(0)) < needed_time:
+            path = find_augmenting_path(r, available_periods.values, periods_by_price, currents, usable_time, held,
+                                        holders, remaining_capacity)
+            if path is None:
+                break
+            for charger, period, giver in path:
+                held[charger].add(period)
+                holders[period].add(charger)
+                remaining_capacity[period] -= requests[charger][3]
+                if giver is not None:
+                    held[giver].remove(period)
+                    holders[period].remove(giver)
+                    remaining_capacity[period] += requests[giver][3]
+        else:
+            fits[r] = True
+            continue
+        for period in held[r]:
+            holders[period].remove(r)
+            remaining_capacity[period] += requests[r][3]
+        held[r].clear()
+
+    schedules = []
+    for (start, departure, needed_time, _), periods_to_charge, fit in zip(requests, held, fits):
+        if not fit:
+            schedules.append((None, calculate_eta(start, needed_time)))
+            continue
+        contiguous_slots = get_contiguous_slots_between(available_periods, list(periods_to_charge), start, departure)
+        schedules.append((contiguous_slots, calculate_eta(start, needed_time, contiguous_slots)))
+    return schedules
 
-    contiguous_slots = get_contiguous_slots([{'start': h['start'], 'end': h['end']} for h in periods_to_charge])
 
-    # TODO: The following is completely wrong.
-    #       1. We have to multiply with the expected power (80 % of full charging power, according to how we
-    #       calculate the number of hours to charge).
-    #       2. The first and last hours will not be full hours.
-    # estimated_cost = sum([h['value'] for h in hours_to_charge])
-    # currency = str(self.price_entity.attributes.get("currency"))
-    # self.log(f"Estimated cost: {estimated_cost:.2f} {currency}")
+def find_augmenting_path(r: int, prices: list[float], periods_by_price: list[int], currents: list[float],
+                         usable_time: list[dict[int, timedelta]], held: list[set[int]], holders: list[set[int]],
+                         remaining_capacity: list[float]) -> list[tuple[int, int, int | None]] | None:
+    """The cheapest way to plan one more period for charger *r*, as a list of (charger, period, charger giving the
+    period up) steps, or None if there is none.
 
+    Each charger in the chain takes a period from the next one, and the last takes a period with room for it. As the
+    other periods only change hands, the cost is the price of that last period. A charger only moves to a period in
+    which it can charge at least as long as in the period it gives up, so that it still gets its needed time.
+    """
+    # The cheapest period with room in the charger's own time window. A chain only pays off if it ends in a cheaper
+    # period, so it is only searched for if there is a cheaper period with room for any charger.
+    direct = min((period for period in usable_time[r]
+                  if period not in held[r] and remaining_capacity[period] >= currents[r]),
+                 key=lambda period: (prices[period], period), default=None)
+    bound = (prices[direct], direct) if direct is not None else (float('inf'), 0)
+    smallest_current = min(currents)
+    for period in periods_by_price:
+        if (prices[period], period) >= bound:
+            return None if direct is None else [(r, direct, None)]
+        if remaining_capacity[period] >= smallest_current:
+            break
+
+    # States are (charger, period it gives up), with the state and period taken that led to them.
+    previous: dict[tuple[int, int | None], tuple[tuple[int, int | None], int] | None] = {(r, None): None}
+    queue = deque([(r, None)])
+    entered = set()  # (period, current) already entered, whose holders are queued.
+    # The least time a charger was required to get, when it was expanded. It can go wherever it could with more.
+    expanded: dict[int, timedelta] = {}
+    candidates = [] if direct is None else [(bound, (r, None))]
+    while queue:
+        state = queue.popleft()
+        charger, given_up = state
+        minimum = timedelta(0) if given_up is None else usable_time[charger][given_up]
+        if charger in expanded and expanded[charger] <= minimum:
+            continue
+        expanded[charger] = minimum
+        current = currents[charger]
+        for period, time in usable_time[charger].items():
+            if period in held[charger] or time < minimum:
+                continue
+            if remaining_capacity[period] >= current and (prices[period], period) < bound:
+                candidates.append(((prices[period], period), state))
+            if (period, current) in entered:
+                continue
+            entered.add((period, current))
+            for holder in holders[period]:
+                if (holder, period) not in previous and remaining_capacity[period] + currents[holder] >= current:
+                    previous[(holder, period)] = (state, period)
+                    queue.append((holder, period))
+
+    for (_, period), state in sorted(candidates, key=lambda candidate: candidate[0]):
+        path = [(state[0], period, None)]
+        while previous[state] is not None:
+            state, taken = previous[state]
+            path.append((state[0], taken, path[-1][0]))
+        # With different charging currents, a period could be passed twice, with too little room for both.
+        if len({step[1] for step in path}) == len(path):
+            return path
+    return None
+
+
+def get_contiguous_slots_between(periods: PriceSeries, indices: list[int], start: datetime,
+                                 end: datetime) -> list[dict[str, datetime]]:
+    """Merges the periods at *indices* into contiguous slots, cut to fit between *start* and *end*."""
+    contiguous_slots = periods.contiguous_slots(indices)
+    contiguous_slots[0]['start'] = max(contiguous_slots[0]['start'], start)
+    contiguous_slots[-1]['end'] = min(contiguous_slots[-1]['end'], end)
     return contiguous_slots
 
 
+def get_cheapest_periods(periods: PriceSeries, periods_by_price: list[int], start: datetime, end: datetime,
+                         needed_time: timedelta) -> list[int]:
+    """Returns the indices of the cheapest periods between *start* and *end* that together cover *needed_time*.
+
+    *periods_by_price* is the indices of *periods* ordered by price (see PriceSeries.order_by_value).
+    """
+    first, last = periods.index_range(start, end)
+    periods_to_charge = []
+    used_time = timedelta(0)
+    for i in periods_by_price:
+        if not first <= i < last:
+            continue  # Outside the time window.
+        periods_to_charge.append(i)
+        if first < i < last - 1:
+            used_time += periods.ends[i] - periods.starts[i]
+        else:
+            used_time += min(periods.ends[i], end) - max(periods.starts[i], start)
+        if used_time >= needed_time:
+            return periods_to_charge
+    raise NotEnoughTimeException(needed_time, used_time)
+
+
+def trim_schedule(schedule: list[dict[str, datetime]], now: datetime,
+                  needed_time: timedelta) -> list[dict[str, datetime]] | None:
+    """Returns the slots of *schedule* from *now* that are needed for charging *needed_time*.
+
+    The last slot is cut short, if not all of it is needed. Returns None if the schedule is too short.
+    """
+    trimmed = []
+    for slot in schedule:
+        if needed_time <= timedelta(0):
+            break
+        if slot['end'] <= now:
+            continue
+        start = max(slot['start'], now)
+        end = min(slot['end'], start + needed_time)
+        trimmed.append({'start': start, 'end': end})
+        needed_time -= end - start
+    return trimmed if needed_time <= timedelta(0) else None
+
+
+def estimate_cost(prices: PriceSeries, schedule: list[dict[str, datetime]], power_kw: float) -> float:
+    """Returns the cost of charging with *power_kw* during the slots of *schedule*."""
+    cost = 0
+    for slot in schedule:
+        for i in range(*prices.index_range(slot['start'], slot['end'])):
+            overlap = min(prices.ends[i], slot['end']) - max(prices.starts[i], slot['start'])
+            cost += power_kw * (overlap / timedelta(hours=1)) * prices.values[i]
+    return cost
+
+
 class NotEnoughTimeException(Exception):
     def __init__(self, needed_time: timedelta, available_time: timedelta):
         self.needed_time = needed_time
         self.available_time = available_time
 
 
+def raw_prices(attributes: dict) -> list[dict]:
+    """The known prices in the attributes of a Nordpool sensor."""
+    return attributes.get("raw_today", []) + attributes.get("raw_tomorrow", [])
+
+
 def parse_prices(prices: list[dict]) -> list[dict]:
     return [{
             'start': parser.parse(p['start']),
@@ -277,20 +807,51 @@ def parse_prices(prices: list[dict]) -> list[dict]:
         } for p in prices]
 
 
+class PriceTable:
+    """Parsed prices, where each raw price row is only parsed once.
+
+    When *raw_tomorrow* arrives, only the new rows are parsed. When they move to *raw_today* at midnight, nothing
+    needs to be parsed. The parsed periods are shared between calls, and must not be modified.
+    """
+
+    def __init__(self):
+        self._parsed: dict[tuple, dict] = {}
+
+    def update(self, raw_prices: list[dict]) -> list[dict]:
+        """Returns the parsed *raw_prices*, parsing only rows that were not in the previous update."""
+        parsed = {}
+        for p in raw_prices:
+            key = (p['start'], p['end'], p['value'])
+            parsed[key] = self._parsed.get(key) or parse_prices([p])[0]
+        self._parsed = parsed  # Forget rows that are no longer present.
+        return list(parsed.values())
+
+    def dump(self) -> list[list]:
+        """The raw and parsed rows, for storing."""
+        return [[*key, p['start'].isoformat(), p['end'].isoformat(), p['value']] for key, p in self._parsed.items()]
+
+    def load(self, rows: list[list]):
+        """Restores stored rows, so that they are not parsed again."""
+        self._parsed = {tuple(row[:3]): {'start': datetime.fromisoformat(row[3]),
+                                         'end': datetime.fromisoformat(row[4]),
+                                         'value': row[5]}
+                        for row in rows}
+
+
 def get_prices(known_prices: list[dict], start: datetime, end: datetime) -> list[dict]:
-    if start < known_prices[0]['start']:
-        raise ValueError(f"Start time {start} is before the first known price {known_prices[0]['start']}. This is not supported.")
-    prices = extrapolate_prices(known_prices, end)
+    return get_price_series(PriceSeries.from_periods(known_prices), start, end).to_periods()
 
-    prices = [h for h in prices if
-              (start <= h['start'] < end) or
-              (start < h['end'] <= end)]
 
-    # Start the first slot at the start time. End the last slot at the end time.
-    assert prices[0]['start'] <= start < prices[0]['end'], f"Start time {start} should be within the first price slot {prices[0]}."
-    assert prices[-1]['start'] < end <= prices[-1]['end'], f"End time {end} should be within the last price slot {prices[-1]}."
-    prices[0]['start'] = start
-    prices[-1]['end'] = end
+def get_price_series(known_prices: PriceSeries, start: datetime, end: datetime,
+                     forecaster: PriceForecaster | None = None) -> PriceSeries:
+    if start < known_prices.starts[0]:
+        raise ValueError(f"Start time {start} is before the first known price {known_prices.starts[0]}. This is not supported.")
+    extrapolated = forecaster.extrapolate(known_prices, end) if forecaster is not None else known_prices.extrapolate(end)
+    prices = extrapolated.window(start, end)
+
+    # The first slot starts at the start time. The last slot ends at the end time.
+    assert prices.starts[0] == start, f"Start time {start} should be within the first price slot."
+    assert prices.ends[-1] == end, f"End time {end} should be within the last price slot."
 
     return prices
 
@@ -338,29 +899,10 @@ def extrapolate_prices(prices: list[dict[str, Any]], end: datetime) -> list[dict
     """
     Fill missing periods at the end of *prices*, assuming that prices
     will be the same as the same period the preceding day.
-    """
-    filled = [p for p in prices]
-    filled_end = lambda : filled[-1]['end']
-
-    # Find the corresponding period the day before.
-    # Assume that all periods have the same duration.
-    get_previous_day_period = lambda start: next((p for p in filled if p['start'] >= start - timedelta(days=1)))
 
-    # Fill missing periods.
-    while filled_end() < end:
-        previous_day_period = get_previous_day_period(filled_end())
-        period = {
-            'start': previous_day_period['start'] + timedelta(days=1),
-            'end': previous_day_period['end'] + timedelta(days=1),
-            'value': previous_day_period['value']
-        }
-        filled.append(period)
-
-    # Make sure the last period ends at the requested end time.
-    if filled[-1]['start'] < end < filled[-1]['end']:
-        filled[-1]['end'] = end
-
-    return filled
+    See PriceSeries.extrapolate.
+    """
+    return PriceSeries.from_periods(prices).extrapolate(end).to_periods()
 
 
 def calculate_eta(now: datetime, expected_charge_time: timedelta, schedule: list[dict] = None) -> datetime:
@@ -386,7 +928,7 @@ def calculate_eta(now: datetime, expected_charge_time: timedelta, schedule: list
     return start + charge_time_left
 
 
-def charge_time(energy_kwh: float, current_a: float) -> timedelta:
-    max_power_kw = current_a * VOLTAGE / 1000
+def charge_time(energy_kwh: float, current_a: float, phases: int = 1) -> timedelta:
+    max_power_kw = current_a * phases * VOLTAGE / 1000
     hours_to_charge = energy_kwh / max_power_kw
     return timedelta(hours=hours_to_charge)
@@ -0,0 +1,16 @@
+"""Offline simulation of Home Assistant and AppDaemon, for running the apps against recorded or generated data.
+
+Example, replaying a recorded day through the load balancer:
+
+    simulation = Simulation(start=datetime(2025, 1, 1))
+    simulation.set_state('sensor.lowpass_current_l1', 10)
+    ...
+    simulation.add_app(LoadBalancer, 'load_balancing', args)
+    simulation.replay(load_history_csv('history.csv'))
+"""
+from simulation.clock import VirtualTimeLoop
+from simulation.hass import FakeEntity, FakeHass
+from simulation.recording import Event, load_history_csv
+from simulation.world import Simulation
+
+__all__ = ['Event', 'FakeEntity', 'FakeHass', 'Simulation', 'VirtualTimeLoop', 'load_history_csv']
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+import selectors
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    """Selector that, instead of blocking until the next timer is due, moves the virtual clock forward to it."""
+
+    def __init__(self, loop: VirtualTimeLoop):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout=None):
+        if self._loop.executor_jobs:
+            # Work in executor threads takes real time. Wait for it, instead of letting virtual time pass meanwhile.
+            return super().select(timeout if timeout == 0 else None)
+        ready = super().select(0)
+        if not ready and timeout:
+            self._loop.elapsed += timeout
+        return ready
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop running on a virtual clock, which jumps straight to the next timer when there is nothing to do.
+
+    Timers (call_later, asyncio.sleep, ...) are ordered as on a real loop, but a simulated day takes only as long as
+    the code it runs.
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0  # seconds, since the loop was created
+        self.executor_jobs = 0  # Calls running in executor threads, which take no virtual time.
+        super().__init__(selector=_VirtualTimeSelector(self))
+
+    def time(self) -> float:
+        return self.elapsed
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.executor_jobs += 1
+        future.add_done_callback(self._executor_job_done)
+        return future
+
+    def _executor_job_done(self, _):
+        self.executor_jobs -= 1
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+import inspect
+import logging
+from typing import TYPE_CHECKING, Any, Callable
+
+from dateutil import parser
+
+if TYPE_CHECKING:
+    from simulation.world import Simulation
+
+
+class FakeEntity:
+    """Stand-in for AppDaemon's Entity, reading and writing the state in the simulation."""
+
+    def __init__(self, app: FakeHass, entity_id: str):
+        self._app = app
+        self.entity_id = entity_id
+
+    @property
+    def _entry(self) -> dict:
+        return self._app.simulation.states.get(self.entity_id) or {'state': None, 'attributes': {},
+                                                                   'last_changed': None}
+
+    @property
+    def state(self) -> str | None:
+        return self._entry['state']
+
+    @property
+    def attributes(self) -> dict:
+        return self._entry['attributes']
+
+    @property
+    def last_changed(self) -> str | None:
+        return self._entry['last_changed']
+
+    def get_state(self, attribute: str | None = None, default: Any = None):
+        return self._app.result(self._app.simulation.get_state(self.entity_id, attribute, default))
+
+    def set_state(self, state: Any = None, attributes: dict | None = None, replace: bool = False, **kwargs):
+        return self._app.result(self._app.simulation.set_state(self.entity_id, state, attributes, replace))
+
+
+class FakeHass:
+    """Stand-in for the parts of AppDaemon's Hass API that the apps use.
+
+    Put before the app class in the bases (see Simulation.add_app). Like in AppDaemon, methods are awaitable for async
+    apps (those with an async initialize), except get_entity and log.
+    """
+
+    def __init__(self, simulation: Simulation, name: str, args: dict):
+        self.simulation = simulation
+        self.simulated_name = name
+        self.args = args
+        self.simulated_async = inspect.iscoroutinefunction(self.initialize)
+        self.logger = logging.getLogger(f"simulation.{name}")
+
+    @property
+    def name(self) -> str:
+        return self.simulated_name
+
+    def result(self, value: Any):
+        """Returns *value*, or a future with it, for async apps."""
+        if not self.simulated_async:
+            return value
+        future = self.simulation.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def log(self, msg: str, *args, level: str = 'INFO', **kwargs):
+        self.logger.log(logging.getLevelName(level), msg)
+
+    def error(self, msg: str, *args, **kwargs):
+        self.logger.error(msg)
+
+    def monotonic(self) -> float:
+        return self.simulation.loop.time()
+
+    def get_entity(self, entity_id: str) -> FakeEntity:
+        return FakeEntity(self, entity_id)
+
+    def get_state(self, entity_id: str, attribute: str | None = None, default: Any = None, **kwargs):
+        return self.result(self.simulation.get_state(entity_id, attribute, default))
+
+    def set_state(self, entity_id: str, state: Any = None, attributes: dict | None = None, replace: bool = False,
+                  **kwargs):
+        return self.result(self.simulation.set_state(entity_id, state, attributes, replace))
+
+    def listen_state(self, callback: Callable, entity_id: str, attribute: str | None = None, **kwargs):
+        return self.result(self.simulation.listen_state(self, callback, entity_id, attribute, **kwargs))
+
+    def cancel_listen_state(self, handle: str, **kwargs):
+        return self.result(self.simulation.cancel_listen_state(handle))
+
+    def run_in(self, callback: Callable, delay: float, **kwargs):
+        when = self.simulation.now + timedelta(seconds=delay)
+        return self.result(self.simulation.run_at(self, callback, when, **kwargs))
+
+    def run_at(self, callback: Callable, start: datetime, **kwargs):
+        return self.result(self.simulation.run_at(self, callback, start, **kwargs))
+
+    def run_every(self, callback: Callable, start: datetime | str, interval: float, **kwargs):
+        when = self.simulation.now if start == 'now' else start
+        return self.result(self.simulation.run_at(self, callback, when, interval, **kwargs))
+
+    def cancel_timer(self, handle: str, **kwargs):
+        return self.result(self.simulation.cancel_timer(handle))
+
+    def call_service(self, service: str, **data):
+        result = self.simulation.call_service(service, **data)
+        if inspect.isawaitable(result):
+            # A service handler taking time, like a round trip to a charger.
+            if self.simulated_async:
+                return result
+            asyncio.ensure_future(result, loop=self.simulation.loop)
+            result = None
+        return self.result(result)
+
+    def get_history(self, entity_id: str, start_time: datetime | None = None, end_time: datetime | None = None,
+                    **kwargs):
+        return self.result(self.simulation.get_history(entity_id, start_time, end_time))
+
+    def get_now(self):
+        return self.result(self.simulation.now)
+
+    def parse_datetime(self, time_str: str, aware: bool = False, **kwargs):
+        now = self.simulation.now
+        parsed = parser.parse(time_str, default=now.replace(hour=0, minute=0, second=0, microsecond=0,
+                                                            tzinfo=None))
+        if aware and parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=self.simulation.time_zone)
+        elif not aware and parsed.tzinfo is not None:
+            parsed = parsed.astimezone(self.simulation.time_zone).replace(tzinfo=None)
+        return self.result(parsed)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import csv
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from dateutil import parser
+
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    """A recorded state change of an entity."""
+    time: datetime
+    entity_id: str
+    state: str
+    attributes: dict | None = field(default=None, compare=False)
+
+
+def load_history_csv(path: str) -> list[Event]:
+    """Loads a history export from Home Assistant (a CSV file with entity_id, state and last_changed columns).
+
+    Unavailable and unknown states are skipped. Returns the events sorted by time.
+    """
+    with open(path, newline='') as file:
+        events = [Event(parser.isoparse(row['last_changed']), row['entity_id'], row['state'])
+                  for row in csv.DictReader(file)
+                  if row['state'] not in ('unavailable', 'unknown')]
+    events.sort(key=lambda event: event.time)
+    return events
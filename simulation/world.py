@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+import inspect
+import itertools
+import logging
+from typing import Any, Callable, Iterable
+
+from dateutil import tz
+
+from simulation.clock import VirtualTimeLoop
+from simulation.hass import FakeHass
+from simulation.recording import Event
+
+
+class Simulation:
+    """A stand-in for Home Assistant and AppDaemon: entity states, state listeners, timers and services, all driven
+    by a virtual clock.
+
+    Apps are the real app classes, with the Hass API replaced by FakeHass (see add_app). State changes and timers
+    are delivered to the apps in order, through an event loop running on virtual time.
+    """
+
+    def __init__(self, start: datetime, time_zone: str = 'Europe/Stockholm'):
+        self.time_zone = tz.gettz(time_zone)
+        self.start = start if start.tzinfo else start.replace(tzinfo=self.time_zone)
+        self.loop = VirtualTimeLoop()
+        self.states: dict[str, dict] = {}
+        self.history: dict[str, list[tuple[datetime, dict]]] = {}
+        self.apps: dict[str, FakeHass] = {}
+        self.services: dict[str, Callable[..., Any]] = {}
+        self.service_calls: list[tuple[datetime, str, dict]] = []
+        self.errors: list[Exception] = []
+        self.callbacks = 0
+        self._listeners: dict[str, list[tuple[str, FakeHass, Callable, str | None, dict]]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._handles = itertools.count(1)
+
+    @property
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.loop.time())
+
+    @property
+    def pending_timers(self) -> int:
+        """The number of timers that have not run yet (repeating timers count as one)."""
+        return len(self._timers)
+
+    def close(self):
+        self.loop.close()
+
+    # Entities
+
+    def set_state(self, entity_id: str, state: Any = None, attributes: dict | None = None, replace: bool = False):
+        """Sets the state and/or attributes of an entity, and notifies the listeners of what changed."""
+        old = self.states.get(entity_id)
+        time = self.now
+        now = time.isoformat()
+        new_state = str(state) if state is not None else (old['state'] if old else None)
+        if replace or old is None:
+            new_attributes = dict(attributes or {})
+        else:
+            new_attributes = {**old['attributes'], **(attributes or {})}
+        changed = old is None or new_state != old['state']
+        new = {'entity_id': entity_id,
+               'state': new_state,
+               'attributes': new_attributes,
+               'last_changed': now if changed else old['last_changed'],
+               'last_updated': now}
+        self.states[entity_id] = new
+        self.history.setdefault(entity_id, []).append((time, new))
+        self._notify(entity_id, old, new)
+
+    def get_state(self, entity_id: str, attribute: str | None = None, default: Any = None) -> Any:
+        entry = self.states.get(entity_id)
+        if entry is None:
+            return default
+        if attribute is None:
+            return entry['state']
+        if attribute == 'all':
+            return entry
+        return entry['attributes'].get(attribute, default)
+
+    def get_history(self, entity_id: str, start_time: datetime | None = None,
+                    end_time: datetime | None = None) -> list[list[dict]]:
+        """The states of an entity between two times, starting with the state at *start_time*, like Home
+        Assistant's history.
+
+        Naive times are in the time zone of the simulation.
+        """
+        start = self._aware(start_time) if start_time else None
+        end = self._aware(end_time) if end_time else None
+        result = []
+        for time, entry in self.history.get(entity_id, []):
+            if end is not None and time > end:
+                break
+            if start is not None and time < start:
+                result = [entry]  # The state at the start time.
+            else:
+                result.append(entry)
+        return [result]
+
+    def _notify(self, entity_id: str, old: dict | None, new: dict):
+        for _, app, callback, attribute, kwargs in self._listeners.get(entity_id, ()):
+            if attribute is None:
+                old_value, new_value = old and old['state'], new['state']
+            elif attribute == 'all':
+                old_value, new_value = old, new
+            else:
+                old_value, new_value = old and old['attributes'].get(attribute), new['attributes'].get(attribute)
+            if old_value != new_value:
+                self.loop.call_soon(self._run_callback, app, callback, entity_id, attribute, old_value, new_value,
+                                    kwargs)
+
+    # Listeners, timers and services
+
+    def listen_state(self, app: FakeHass, callback: Callable, entity_id: str, attribute: str | None = None,
+                     **kwargs) -> str:
+        handle = f"listener-{next(self._handles)}"
+        self._listeners.setdefault(entity_id, []).append((handle, app, callback, attribute, kwargs))
+        return handle
+
+    def cancel_listen_state(self, handle: str):
+        for listeners in self._listeners.values():
+            listeners[:] = [listener for listener in listeners if listener[0] != handle]
+
+    def run_at(self, app: FakeHass, callback: Callable, when: datetime, interval: float | None = None,
+               **kwargs) -> str:
+        """Calls *callback(kwargs)* at *when*, and then every *interval* seconds, if given."""
+        handle = f"timer-{next(self._handles)}"
+        at = self.loop.time() + max(0.0, (self._aware(when) - self.now).total_seconds())
+
+        def fire():
+            if interval:
+                self._timers[handle] = self.loop.call_at(self.loop.time() + interval, fire)
+            else:
+                del self._timers[handle]
+            self._run_callback(app, callback, kwargs)
+
+        self._timers[handle] = self.loop.call_at(at, fire)
+        return handle
+
+    def cancel_timer(self, handle: str):
+        timer = self._timers.pop(handle, None)
+        if timer is not None:
+            timer.cancel()
+
+    def register_service(self, service: str, handler: Callable[..., Any]):
+        """Handles calls to *service* (e.g. 'easee/set_circuit_dynamic_limit') with *handler(**data)*, which may be
+        a coroutine function, to simulate a service that takes time."""
+        self.services[service] = handler
+
+    def call_service(self, service: str, **data) -> Any:
+        self.service_calls.append((self.now, service, data))
+        handler = self.services.get(service)
+        return handler(**data) if handler else None
+
+    def _run_callback(self, app: FakeHass, callback: Callable, *args):
+        """Runs a callback the way AppDaemon does: coroutines as tasks, and errors logged, not raised."""
+        self.callbacks += 1
+        try:
+            result = callback(*args)
+            if inspect.isawaitable(result):
+                self.loop.create_task(result).add_done_callback(lambda task: self._task_done(app, task))
+        except Exception as e:
+            self._error(app, e)
+
+    def _task_done(self, app: FakeHass, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self._error(app, task.exception())
+
+    def _error(self, app: FakeHass, error: Exception):
+        self.errors.append(error)
+        logging.getLogger(f"simulation.{app.name}").error(f"Error in callback: {error!r}", exc_info=error)
+
+    # Apps
+
+    def add_app(self, app_class: type, name: str, args: dict) -> FakeHass:
+        """Creates and initializes an app, with the Hass API replaced by the simulation."""
+        simulated_class = type(app_class.__name__, (FakeHass, app_class), {})
+        app = simulated_class(self, name, args)
+        self.apps[name] = app
+        self.loop.run_until_complete(self._initialize(app))
+        return app
+
+    @staticmethod
+    async def _initialize(app: FakeHass):
+        result = app.initialize()
+        if inspect.isawaitable(result):
+            await result
+
+    # Running
+
+    def run_until(self, time: datetime):
+        """Runs the apps, with their timers, until *time*."""
+        self.loop.run_until_complete(self._sleep_until(time))
+
+    def run_for(self, seconds: float):
+        self.run_until(self.now + timedelta(seconds=seconds))
+
+    def replay(self, events: Iterable[Event], until: datetime | None = None):
+        """Sets each recorded state at its time, running the apps in between. Events must be in time order."""
+        self.loop.run_until_complete(self._replay(events, until))
+
+    async def _replay(self, events: Iterable[Event], until: datetime | None):
+        for event in events:
+            await self._sleep_until(event.time)
+            self.set_state(event.entity_id, event.state, event.attributes)
+        if until is not None:
+            await self._sleep_until(until)
+        await asyncio.sleep(0)  # Deliver the last state changes.
+
+    async def _sleep_until(self, time: datetime):
+        await asyncio.sleep(max(0.0, (self._aware(time) - self.now).total_seconds()))
+
+    def _aware(self, time: datetime) -> datetime:
+        return time if time.tzinfo else time.replace(tzinfo=self.time_zone)
@@ -0,0 +1,245 @@
+"""App for sharing the main fuse between several chargers."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from math import floor
+
+from appdaemon.entity import Entity
+
+from balancing import BalancingApp
+from charger import Charger, ChargerSnapshot
+from common import Phase, Currents
+from limit_commands import LimitCommandQueue
+
+
+PHASES = (Phase.P1, Phase.P2, Phase.P3)
+
+
+@dataclass(frozen=True, slots=True)
+class CircuitDemand:
+    """What a circuit wants to charge with."""
+    circuit_id: str
+    phases: int  # 1 or 3
+    max_current: float
+    min_current: float
+    departure: datetime | None = None
+    phase: Phase = Phase.Unknown  # The phase that a one-phase circuit is charging on, if known.
+
+
+def allocate_currents(headroom: Currents, demands: list[CircuitDemand], policy: str = 'fair') -> list[Currents]:
+    """Share the available current on each phase between several circuits.
+
+    Circuits are admitted in order of departure (those without a departure time last), each getting its minimum
+    current if there is room for it on its phases, and nothing otherwise. One-phase circuits that are not already
+    charging on a phase are put on the phase with the most room left, so that they are spread over the phases.
+
+    The remaining current is then shared, either equally between the admitted circuits (policy 'fair'), or to one
+    circuit at a time in order of departure (policy 'priority'), up to each circuit's max current.
+
+    Returns the circuit dynamic limit for each demand, in the order given.
+    """
+    remaining = {phase: headroom[phase] for phase in PHASES}
+    order = sorted(range(len(demands)), key=lambda d: (demands[d].departure is None, demands[d].departure or 0))
+    allocated = [0.0] * len(demands)
+    demand_phases: list[tuple[Phase, ...]] = [()] * len(demands)
+
+    # Admit circuits at their minimum current.
+    for d in order:
+        demand = demands[d]
+        if demand.phases == 3:
+            phases = PHASES
+        elif demand.phase != Phase.Unknown:
+            phases = (demand.phase,)
+        else:
+            phases = (max(PHASES, key=remaining.get),)
+        if min(remaining[phase] for phase in phases) < demand.min_current:
+            continue
+        allocated[d] = demand.min_current
+        demand_phases[d] = phases
+        for phase in phases:
+            remaining[phase] -= demand.min_current
+
+    # Share the rest.
+    active = [d for d in order if demand_phases[d] and allocated[d] < demands[d].max_current]
+    if policy == 'priority':
+        for d in active:
+            increase = min(demands[d].max_current - allocated[d], *(remaining[phase] for phase in demand_phases[d]))
+            allocated[d] += increase
+            for phase in demand_phases[d]:
+                remaining[phase] -= increase
+    elif policy == 'fair':
+        # Raise all active circuits equally, until they reach their max current or a phase runs out.
+        while active:
+            users = {phase: sum(1 for d in active if phase in demand_phases[d]) for phase in PHASES}
+            increase = min(min(demands[d].max_current - allocated[d] for d in active),
+                           min(remaining[phase] / users[phase] for phase in PHASES if users[phase]))
+            for d in active:
+                allocated[d] += increase
+                for phase in demand_phases[d]:
+                    remaining[phase] -= increase
+            active = [d for d in active if allocated[d] < demands[d].max_current - 1e-9 and
+                      all(remaining[phase] > 1e-9 for phase in demand_phases[d])]
+    else:
+        raise ValueError(f"Unknown allocation policy: {policy}")
+
+    limits = []
+    for d in range(len(demands)):
+        limit = Currents(0, 0, 0)
+        for phase in demand_phases[d]:
+            limit[phase] = floor(allocated[d] + 1e-9)
+        limits.append(limit)
+    return limits
+
+
+class SiteCharger:
+    """A charger managed by the site load balancer, with its own switches."""
+
+    def __init__(self, charger: Charger, charge_now: Entity, one_phase_charging: Entity | None,
+                 departure_time: Entity | None, limit_queue: LimitCommandQueue):
+        self.charger = charger
+        self.charge_now = charge_now
+        self.one_phase_charging = one_phase_charging
+        self.departure_time = departure_time
+        self.limit_queue = limit_queue
+
+
+class SiteLoadBalancer(BalancingApp):
+    """App for making sure that several chargers sharing a main fuse don't overload it.
+
+    Chargers on the same circuit share one circuit dynamic limit, so the current is allocated per circuit.
+    """
+    allocation_policy = 'fair'
+    min_charging_current = 6  # A
+    load_balance_threshold = 0
+    chargers: list[SiteCharger] = []
+
+    def initialize(self):
+        self.configure_metrics()
+        self.allocation_policy = str(self.args.get('allocation_policy', self.allocation_policy))
+
+        self.chargers = []
+        for config in self.args['chargers']:
+            charger = Charger(self.get_entity(str(config['charger_status_entity_id'])),
+                              self.get_entity(str(config['charger_current_entity_id'])),
+                              self.get_entity(str(config['circuit_dynamic_limit_entity_id'])))
+            one_phase_charging_entity_id = config.get('one_phase_charging_entity_id')
+            departure_time_entity_id = config.get('departure_time_entity_id')
+            self.chargers.append(SiteCharger(
+                charger,
+                self.get_entity(str(config['charge_now_entity_id'])),
+                self.get_entity(str(one_phase_charging_entity_id)) if one_phase_charging_entity_id else None,
+                self.get_entity(str(departure_time_entity_id)) if departure_time_entity_id else None,
+                self.new_limit_queue(lambda currents, c=charger: self.send_circuit_dynamic_limit(c, currents))))
+        self.load_state()
+
+        # Balance load when current is higher than 90% of main fuse.
+        self.load_balance_threshold = self.chargers[0].charger.main_fuse * 0.9
+
+        # Instantaneous current readings
+        for entity_id in self.configure_load_sensors():
+            self.listen_state(self.balance, entity_id)
+
+        if self.metrics_entity_id is not None:
+            self.run_every(self.publish_metrics_cb, "now", self.metrics_interval)
+
+        self.balance()
+
+    def balance_pass(self):
+        """One pass of sharing the current between the chargers."""
+        load = self.read_load()
+        if load is None:
+            self.log("The current sensors are unavailable. Nothing to balance.", level="WARNING")
+            return
+        snapshots = [site_charger.charger.snapshot() for site_charger in self.chargers]
+        self.metrics.increment('entity_reads', 3 * len(self.chargers))
+
+        # Chargers on the same circuit share the circuit dynamic limit.
+        circuits: dict[str, list[tuple[SiteCharger, ChargerSnapshot]]] = {}
+        for site_charger, snapshot in zip(self.chargers, snapshots):
+            circuits.setdefault(snapshot.circuit_id, []).append((site_charger, snapshot))
+
+        # The load on each phase, without the chargers.
+        charger_load = Currents(0, 0, 0)
+        for site_charger, snapshot in zip(self.chargers, snapshots):
+            charger_load = charger_load + self.get_charger_load(snapshot)
+        other_load = load - charger_load
+        threshold = self.load_balance_threshold
+        headroom = Currents(threshold, threshold, threshold) - other_load
+        self.log(f"Other load: {other_load}, headroom: {headroom}", level="DEBUG")
+
+        demands = []
+        for circuit_id, circuit_chargers in circuits.items():
+            demand = self.get_circuit_demand(circuit_id, circuit_chargers)
+            if demand is not None:
+                demands.append(demand)
+        limits = dict(zip((demand.circuit_id for demand in demands),
+                          allocate_currents(headroom, demands, self.allocation_policy)))
+
+        for circuit_id, circuit_chargers in circuits.items():
+            site_charger, snapshot = circuit_chargers[0]
+            self.set_circuit_dynamic_limit(site_charger, snapshot, limits.get(circuit_id, Currents(0, 0, 0)))
+
+    def limit_queues(self) -> dict[str, LimitCommandQueue]:
+        return {f"limit_queue.{index}": site_charger.limit_queue for index, site_charger in enumerate(self.chargers)}
+
+    def get_charger_load(self, snapshot: ChargerSnapshot) -> Currents:
+        """The current that a charger is using on each phase."""
+        current = snapshot.current or 0
+        limit = snapshot.circuit_dynamic_limit
+        enabled = [phase for phase in PHASES if limit[phase] >= self.min_charging_current]
+        if len(enabled) == 1:
+            return Currents(0, 0, 0).replace(enabled[0], current)
+        return Currents(current, current, current) if enabled else Currents(0, 0, 0)
+
+    def get_circuit_demand(self, circuit_id: str,
+                           circuit_chargers: list[tuple[SiteCharger, ChargerSnapshot]]) -> CircuitDemand | None:
+        """What the chargers on a circuit want to charge with, or None if none of them should charge now."""
+        charging = [(site_charger, snapshot) for site_charger, snapshot in circuit_chargers
+                    if snapshot.status != 'disconnected' and site_charger.charge_now.state == 'on']
+        if not charging:
+            return None
+        site_charger, snapshot = charging[0]
+        one_phase = site_charger.one_phase_charging is None or site_charger.one_phase_charging.state == 'on'
+        limit = snapshot.circuit_dynamic_limit
+        enabled = [phase for phase in PHASES if limit[phase] >= self.min_charging_current]
+        departures = []
+        for c, _ in charging:
+            if c.departure_time is None:
+                continue
+            try:
+                departures.append(self.parse_datetime(c.departure_time.state, aware=True))
+            except (TypeError, ValueError):
+                # Unavailable or empty. The charger is prioritized as if it had no departure time.
+                self.log(f"Could not parse departure time {c.departure_time.state!r} of {circuit_id}",
+                         level="WARNING")
+        return CircuitDemand(circuit_id=circuit_id,
+                             phases=1 if one_phase else 3,
+                             max_current=snapshot.max_charging_current,
+                             min_current=self.min_charging_current,
+                             departure=min(departures) if departures else None,
+                             phase=enabled[0] if one_phase and len(enabled) == 1 else Phase.Unknown)
+
+    def set_circuit_dynamic_limit(self, site_charger: SiteCharger, snapshot: ChargerSnapshot, limit: Currents):
+        """Set the circuit dynamic limit of a circuit, if it needs to change."""
+        current_limit = snapshot.circuit_dynamic_limit
+        self.confirm_limit(site_charger.limit_queue, current_limit)
+        if limit.is_below(current_limit):
+            self.log(f"Lowering circuit dynamic limit of {snapshot.circuit_id}: {limit}", level="INFO")
+        elif limit.max() >= current_limit.max() + 2 or (limit.max() > 0 and limit != current_limit and
+                                                        limit.max_phase() != current_limit.max_phase()):
+            self.log(f"Raising circuit dynamic limit of {snapshot.circuit_id}: {limit}", level="INFO")
+        else:
+            return  # Hysteresis 2 A
+        self.schedule_limit_queue_poll(site_charger.limit_queue,
+                                       site_charger.limit_queue.submit(limit, current_limit, self.monotonic()))
+
+    def send_circuit_dynamic_limit(self, charger: Charger, currents: Currents):
+        """Send a circuit dynamic limit command to a charger."""
+        self.log(f"Setting circuit dynamic limit of {charger.circuit_id} to {currents}.", level="INFO")
+        with self.metrics.timer('call_service_seconds'):
+            self.call_service('easee/set_circuit_dynamic_limit',
+                              circuit_id=charger.circuit_id,
+                              currentP1=currents.p1,
+                              currentP2=currents.p2,
+                              currentP3=currents.p3)
@@ -2,9 +2,21 @@ import appdaemon.plugins.hass.hassapi as hass
 from appdaemon.entity import Entity
 from datetime import datetime
 from dateutil import parser, tz
+import tempfile
+
+from profiling import Profiler
+from state_store import StateStore
 
 
 class StateOfChargeCalculator(hass.Hass):
+    charged_kwh = None  # Energy charged since charged_since.
+    charged_since = None
+    last_energy_reading = None
+    history_queries = 0
+    history_queries_avoided = 0
+    state_store = None
+    profiler = None
+
     def initialize(self):
         self.battery_size_kWh = int(self.args['battery_size_kWh'])
         self.charger_energy_entity_id = str(self.args['charger_energy_entity_id'])
@@ -22,36 +34,116 @@ class StateOfChargeCalculator(hass.Hass):
         self.listen_state(self.estimate, self.last_known_state_of_charge_entity_id)
         self.listen_state(self.update_last_known_state_of_charge, self.car_soc_d_entity_id)
 
-        # Do the calculation (mainly for development purposes)
-        self.estimate(None, None, None, None, None)
+        # Optionally, resume from the energy charged before a restart, instead of querying history.
+        if 'state_file' in self.args:
+            self.state_store = StateStore(str(self.args['state_file']))
+            charged_energy = self.state_store.get('charged_energy')
+            if charged_energy:
+                self.charged_kwh = charged_energy['kwh']
+                self.charged_since = datetime.fromisoformat(charged_energy['since'])
+                self.last_energy_reading = charged_energy['reading']
+
+        # Optionally, profile a sample of the estimates while a switch is on.
+        self.profiler = Profiler(self.name, str(self.args.get('profiling_directory', tempfile.gettempdir())),
+                                 float(self.args.get('profiling_sample_rate', 0.1)),
+                                 float(self.args.get('profiling_window_seconds', 600)))
+        if 'profiling_entity_id' in self.args:
+            profiling_entity_id = str(self.args['profiling_entity_id'])
+            if self.get_entity(profiling_entity_id).state == 'on':
+                self.start_profiling()
+            self.listen_state(self.profiling_cb, profiling_entity_id)
+
+        # Do the calculation (mainly for development purposes), from the stored reading, if any.
+        self.estimate(self.charger_energy_entity_id, None, self.last_energy_reading, self.charger_energy_entity.state,
+                      None)
+
+
+    def profiling_cb(self, entity, attribute, old, new, kwargs):
+        """Callback for the profiling switch."""
+        if new == 'on':
+            self.start_profiling()
+            self.log(f"Profiling {self.profiler.sample_rate:.0%} of the estimates for {self.profiler.window:.0f} seconds.")
+            return
+        self.stop_profiling()
+
+    def profiling_window_cb(self, kwargs):
+        """Timer callback for the end of the profiling window, if profiling was not stopped or restarted since."""
+        if self.profiler.active and self.profiler.until == kwargs['until']:
+            self.stop_profiling()
+
+    def start_profiling(self):
+        """Start profiling, until the window has passed, even if no more estimates are sampled."""
+        self.profiler.start()
+        self.run_in(self.profiling_window_cb, self.profiler.window, until=self.profiler.until)
 
+    def stop_profiling(self):
+        self.profiler.stop()
+        self.log(f"Profiling stopped. Profile of {self.profiler.samples} estimates: {self.profiler.path}")
 
     def estimate(self, entity, attribute, old, new, kwargs):
+        self.profiler.call(self.estimate_state_of_charge_now, entity, old, new)
+
+    def estimate_state_of_charge_now(self, entity, old, new):
         # TODO: What if the car has been disconnected since last known state?
         # Should we reset the last known state?
         # Should we adjust estimation depending on how much time has passed since the car was disconnected?
         # Should we clear the state (if that's even possible)?
+        last_updated = parser.parse(self.last_known_state_of_charge_entity.last_changed)
+        # Assumes no other vehicle has used the charger since *last_updated*.
+        charged_kwh = self.charged_energy_since(last_updated, entity, old, new)
+        self.log(f"Charged since {last_updated}: {charged_kwh:.2f} kWh")
         estimated_soc = self.estimate_state_of_charge(float(self.last_known_state_of_charge_entity.state),
-                                                 parser.parse(self.last_known_state_of_charge_entity.last_changed),
-                                                 float(self.battery_size_kWh),
-                                                 self.charger_energy_entity)
+                                                      float(self.battery_size_kWh),
+                                                      charged_kwh)
         self.estimated_state_of_charge_entity.set_state(state=round(estimated_soc))
 
-    def estimate_state_of_charge(self, known_state_of_charge: float, last_updated: datetime,
-                                 battery_size_kwh: float, charger_energy_entity: Entity) -> float:
-        """Estimate the state of charge right now, based on last known state of charge and the charger energy
-         consumption.
+    def estimate_state_of_charge(self, known_state_of_charge: float, battery_size_kwh: float,
+                                 charged_kwh: float) -> float:
+        """Estimate the state of charge right now, based on last known state of charge and the energy charged
+         since.
          """
         state_of_charge_kwh = known_state_of_charge / 100 * battery_size_kwh
-
-        # Add charger energy consumption since last known state of charge.
-        charged_kwh = self.charger_used_energy_since(charger_energy_entity, last_updated) # Assumes no other vehicle has used the charger since *last_time*.
-        self.log(f"Charged since {last_updated}: {charged_kwh:.2f} kWh")
         new_state_of_charge_kwh = state_of_charge_kwh + charged_kwh
         new_state_of_charge = new_state_of_charge_kwh / battery_size_kwh * 100
 
         return new_state_of_charge
 
+    def charged_energy_since(self, time: datetime, entity: str | None, old: str | None, new: str | None) -> float:
+        """Returns the energy charged since the given time.
+
+        The charger energy history is only queried when the time changes (a new last known state of charge), after a
+        restart, or after a gap in the readings (a missed or unavailable reading, or a counter reset). Otherwise, the
+        change of the charger energy reading is added to the previous result.
+        """
+        if (entity == self.charger_energy_entity_id and time == self.charged_since and
+                old is not None and old == self.last_energy_reading):
+            try:
+                delta = float(new) - float(old)
+            except ValueError:
+                delta = -1.0  # Unavailable.
+            if delta >= 0:
+                self.charged_kwh += delta
+                self.last_energy_reading = new
+                self.history_queries_avoided += 1
+                self.log(f"History queries: {self.history_queries}, avoided: {self.history_queries_avoided}",
+                         level="DEBUG")
+                self.save_state()
+                return self.charged_kwh
+
+        self.charged_kwh = self.charger_used_energy_since(self.charger_energy_entity, time)
+        self.charged_since = time
+        self.last_energy_reading = self.charger_energy_entity.state
+        self.history_queries += 1
+        self.save_state()
+        return self.charged_kwh
+
+    def save_state(self):
+        """Store the energy charged, if a state file is configured."""
+        if self.state_store is not None:
+            self.state_store.set('charged_energy', {'kwh': self.charged_kwh,
+                                                    'since': self.charged_since.isoformat(),
+                                                    'reading': self.last_energy_reading})
+
     def charger_used_energy_since(self, charger_energy_entity: Entity, time: datetime) -> float:
         """Returns the energy consumed by the charger since the given time."""
         local_time = time.astimezone(tz.gettz('Europe/Stockholm')).replace(tzinfo=None)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from typing import Any, Callable
+
+
+class StateStore:
+    """Small persistent store for app state, kept in a JSON file, so that an app can resume after a restart.
+
+    The whole file is rewritten, atomically, on every change, so it is meant for a few kilobytes of state. Values must
+    be JSON serializable; datetimes are stored as ISO strings by the apps.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writes = 0
+        try:
+            with open(path) as file:
+                self._data = json.load(file)
+        except FileNotFoundError:
+            self._data = {}
+        except (OSError, ValueError):
+            self._data = {}  # Unreadable. Start over, rather than fail to start.
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def set(self, key: str, value: Any):
+        """Stores *value*, if it has changed."""
+        self.update({key: value})
+
+    def update(self, values: dict[str, Any]):
+        """Stores the changed *values*, in one write."""
+        changed = {key: value for key, value in values.items() if self._data.get(key) != value}
+        if not changed:
+            return
+        self._data.update(changed)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(self._data, file)
+        os.replace(temporary_path, self.path)
+        self.writes += 1
+
+
+class StateWriter:
+    """Writes to a StateStore in an executor thread, so that an app in AppDaemon's event loop never waits for the disk.
+
+    Writes never overlap: values set while a write is in progress are written after it, only the latest of each.
+    """
+
+    def __init__(self, store: StateStore, on_error: Callable[[Exception], None]):
+        self.store = store
+        self.on_error = on_error
+        self.writing: asyncio.Future | None = None  # The write in progress, if any.
+        self._unsaved: dict[str, Any] = {}
+
+    def update(self, values: dict[str, Any]):
+        """Stores the changed *values*. Must be called from within the event loop."""
+        for key, value in values.items():
+            if key in self._unsaved or self.store.get(key) != value:
+                self._unsaved[key] = value
+        if self.writing is None:
+            self._write()
+
+    def _write(self):
+        if not self._unsaved:
+            return
+        values, self._unsaved = self._unsaved, {}
+        self.writing = asyncio.get_running_loop().run_in_executor(None, self.store.update, values)
+        self.writing.add_done_callback(self._written)
+
+    def _written(self, future: asyncio.Future):
+        self.writing = None
+        if not future.cancelled() and future.exception() is not None:
+            self.on_error(future.exception())
+        self._write()
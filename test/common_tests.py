@@ -0,0 +1,58 @@
+import unittest
+
+from common import Currents, Phase
+
+
+class CurrentsTests(unittest.TestCase):
+    def test__min_and_max_phase(self):
+        # Arrange
+        currents = Currents(5, 2, 8)
+
+        # Act & Assert
+        self.assertEqual(2, currents.min())
+        self.assertEqual(8, currents.max())
+        self.assertEqual(Phase.P2, currents.min_phase())
+        self.assertEqual(Phase.P3, currents.max_phase())
+
+    def test__min_and_max_phase__same_currents(self):
+        # Arrange
+        currents = Currents(3, 3, 3)
+
+        # Act & Assert
+        self.assertEqual(Phase.P1, currents.min_phase(), 'Should be the first phase')
+        self.assertEqual(Phase.P1, currents.max_phase(), 'Should be the first phase')
+
+    def test__replace(self):
+        # Arrange
+        currents = Currents(1, 2, 3)
+
+        # Act
+        replaced = currents.replace(Phase.P2, 10)
+
+        # Assert
+        self.assertEqual(Currents(1, 10, 3), replaced)
+        self.assertEqual(Currents(1, 2, 3), currents, 'The original should be unchanged')
+
+    def test__arithmetic(self):
+        # Arrange
+        load = Currents(10, 20, 30)
+        charger = Currents(0, 16, 0)
+
+        # Act & Assert
+        self.assertEqual(Currents(10, 4, 30), load - charger)
+        self.assertEqual(Currents(10, 36, 30), load + charger)
+
+    def test__items(self):
+        # Arrange
+        currents = Currents(1, 2, 3)
+
+        # Act
+        currents[Phase.P3] -= 1
+
+        # Assert
+        self.assertEqual(2, currents[Phase.P3])
+        self.assertRaises(KeyError, currents.__getitem__, Phase.Unknown)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+
+from dispatching import CoalescingDispatcher
+from simulation import VirtualTimeLoop
+
+
+class CoalescingDispatcherTests(unittest.TestCase):
+    """The dispatcher on a virtual clock, so that the timings are exact, and the tests do not wait for real."""
+
+    def setUp(self):
+        self.loop = VirtualTimeLoop()
+        self.addCleanup(self.loop.close)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test__burst_is_coalesced(self):
+        # Arrange
+        runs = []
+
+        async def func():
+            runs.append(self.loop.time())
+
+        async def burst():
+            dispatcher = CoalescingDispatcher(func, debounce_seconds=2)
+            for _ in range(5):
+                dispatcher.request()
+                await asyncio.sleep(1)
+            await asyncio.sleep(10)
+            return dispatcher
+
+        # Act
+        dispatcher = self.run_async(burst())
+
+        # Assert
+        self.assertEqual([6], runs, 'The burst should result in one run, when it has been quiet for the debounce time')
+        self.assertEqual(5, dispatcher.requests, 'Requests')
+
+    def test__steady_requests__run_after_max_wait(self):
+        # Arrange
+        runs = []
+
+        async def func():
+            runs.append(self.loop.time())
+
+        async def requests():
+            dispatcher = CoalescingDispatcher(func, debounce_seconds=2, max_wait_seconds=10)
+            for _ in range(25):
+                dispatcher.request()
+                await asyncio.sleep(1)
+            await asyncio.sleep(5)
+
+        # Act
+        self.run_async(requests())
+
+        # Assert
+        self.assertEqual([10, 20, 26], runs, 'Requests faster than the debounce window should not hold the runs off')
+
+    def test__request_during_run(self):
+        # Arrange
+        in_flight = 0
+        max_in_flight = 0
+        runs = []
+
+        async def func():
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(5)
+            runs.append(self.loop.time())
+            in_flight -= 1
+
+        async def requests():
+            dispatcher = CoalescingDispatcher(func, debounce_seconds=1)
+            dispatcher.request()
+            await asyncio.sleep(3)  # The first run is now in flight.
+            dispatcher.request()
+            dispatcher.request()
+            await asyncio.sleep(20)
+
+        # Act
+        self.run_async(requests())
+
+        # Assert
+        self.assertEqual([6, 11], runs, 'Requests during a run should result in one more run, right after it')
+        self.assertEqual(1, max_in_flight, 'At most one run should be in flight')
+
+    def test__error(self):
+        # Arrange
+        errors = []
+
+        async def func():
+            raise ValueError("Failed")
+
+        async def requests():
+            dispatcher = CoalescingDispatcher(func, debounce_seconds=0, on_error=errors.append)
+            dispatcher.request()
+            await asyncio.sleep(1)
+            dispatcher.request()
+            await asyncio.sleep(1)
+
+        # Act
+        self.run_async(requests())
+
+        # Assert
+        self.assertEqual(2, len(errors), 'Errors should be reported, and not stop later runs')
+
+
+if __name__ == '__main__':
+    unittest.main()
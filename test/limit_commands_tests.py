@@ -0,0 +1,90 @@
+import unittest
+
+from common import Currents
+from limit_commands import LimitCommandQueue
+
+
+class LimitCommandQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.queue = LimitCommandQueue(self.sent.append, min_interval_seconds=10, timeout_seconds=120)
+
+    def test__latest_wins(self):
+        # Arrange
+        self.queue.submit(Currents(10, 0, 0), actual=Currents(8, 0, 0), now=0)
+
+        # Act
+        self.queue.submit(Currents(12, 0, 0), actual=Currents(8, 0, 0), now=1)
+        self.queue.submit(Currents(14, 0, 0), actual=Currents(8, 0, 0), now=2)
+        self.queue.confirm(Currents(10, 0, 0), now=5)
+        self.queue.poll(now=11)
+
+        # Assert
+        self.assertSequenceEqual([Currents(10, 0, 0), Currents(14, 0, 0)], self.sent,
+                                 'Only the latest raise should be sent, after confirmation')
+        self.assertEqual(5, self.queue.confirmation_latency, 'Confirmation latency')
+        self.assertEqual(1, self.queue.depth, 'The latest command is being set')
+
+    def test__lower_limit_preempts(self):
+        # Arrange
+        self.queue.submit(Currents(16, 0, 0), actual=Currents(10, 0, 0), now=0)
+
+        # Act
+        self.queue.submit(Currents(20, 0, 0), actual=Currents(10, 0, 0), now=1)
+        wait = self.queue.submit(Currents(6, 0, 0), actual=Currents(10, 0, 0), now=2)
+
+        # Assert
+        self.assertIsNone(wait, 'A lower limit should not have to wait')
+        self.assertSequenceEqual([Currents(16, 0, 0), Currents(6, 0, 0)], self.sent,
+                                 'The lower limit should replace the pending raise, and be sent immediately')
+
+    def test__rate_limit(self):
+        # Arrange
+        self.queue.submit(Currents(10, 0, 0), actual=Currents(8, 0, 0), now=0)
+        self.queue.confirm(Currents(10, 0, 0), now=1)
+
+        # Act
+        wait = self.queue.submit(Currents(12, 0, 0), actual=Currents(10, 0, 0), now=2)
+
+        # Assert
+        self.assertEqual(8, wait, 'Should wait for the minimum interval')
+        self.assertEqual(1, len(self.sent), 'The raise should not be sent yet')
+
+    def test__already_set(self):
+        # Act
+        wait = self.queue.submit(Currents(10, 0, 0), actual=Currents(10, 0, 0), now=0)
+
+        # Assert
+        self.assertIsNone(wait)
+        self.assertSequenceEqual([], self.sent, 'Nothing should be sent')
+
+    def test__timeout(self):
+        # Arrange
+        self.queue.submit(Currents(10, 0, 0), actual=Currents(8, 0, 0), now=0)
+        self.queue.submit(Currents(12, 0, 0), actual=Currents(8, 0, 0), now=1)
+
+        # Act
+        self.queue.poll(now=120)
+
+        # Assert
+        self.assertSequenceEqual([Currents(10, 0, 0), Currents(12, 0, 0)], self.sent,
+                                 'The pending command should be sent when the previous has timed out')
+        self.assertEqual(1, self.queue.timeouts)
+
+    def test__load__unconfirmed_command_not_sent_again(self):
+        # Arrange
+        self.queue.submit(Currents(10, 0, 0), actual=Currents(8, 0, 0), now=0)
+        restarted = LimitCommandQueue(self.sent.append, min_interval_seconds=10, timeout_seconds=120)
+
+        # Act
+        restarted.load(self.queue.dump(), now=1000)
+        wait = restarted.submit(Currents(10, 0, 0), actual=Currents(8, 0, 0), now=1001)
+
+        # Assert
+        self.assertIsNone(wait)
+        self.assertSequenceEqual([Currents(10, 0, 0)], self.sent, 'The command should only be sent before restart')
+        self.assertEqual(1, restarted.depth, 'The command should still await confirmation')
+
+
+if __name__ == '__main__':
+    unittest.main()
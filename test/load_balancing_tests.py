@@ -0,0 +1,391 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from charger import Charger
+from common import Currents
+from load_balancing import AsyncLoadBalancer, LoadBalancer
+from simulation import Event, Simulation
+from state_store import StateStore
+
+
+ARGS = {
+    'load_balancing_entity_id': 'input_boolean.car_load_balance',
+    'smart_charging_entity_id': 'input_boolean.car_smart_charging',
+    'one_phase_charging_entity_id': 'input_boolean.car_one_phase_charging',
+    'charge_now_entity_id': 'input_boolean.car_charge_now',
+    'current_l1_entity_id': 'sensor.current_l1',
+    'current_l2_entity_id': 'sensor.current_l2',
+    'current_l3_entity_id': 'sensor.current_l3',
+    'charger_status_entity_id': 'sensor.charger_status',
+    'charger_current_entity_id': 'sensor.charger_current',
+    'circuit_dynamic_limit_entity_id': 'sensor.charger_dynamic_circuit_limit'}
+
+
+class LoadBalancerTests(unittest.TestCase):
+    """LoadBalancer in the simulation, with a charger that charges with the limit it is given (2 seconds after the
+    command), and meters that measure the other load plus the charger."""
+
+    def setUp(self):
+        self.simulation = Simulation(start=datetime(2025, 1, 1))
+        self.addCleanup(self.simulation.close)
+        self.other_load = Currents(5, 5, 5)
+        for entity_id, state in (('input_boolean.car_load_balance', 'on'),
+                                 ('input_boolean.car_smart_charging', 'on'),
+                                 ('input_boolean.car_one_phase_charging', 'on'),
+                                 ('input_boolean.car_charge_now', 'on')):
+            self.simulation.set_state(entity_id, state)
+        self.simulation.set_state('sensor.charger_status', 'charging',
+                                  {'circuit_ratedCurrent': 16, 'site_ratedCurrent': 25, 'circuit_id': 'C1'})
+        self.charge_with(Currents(16, 0, 0))
+        self.simulation.register_service('easee/set_circuit_dynamic_limit', self.set_circuit_dynamic_limit)
+
+    def start(self, **args) -> LoadBalancer:
+        return self.simulation.add_app(LoadBalancer, 'load_balancing', {**ARGS, **args})
+
+    def set_circuit_dynamic_limit(self, circuit_id, currentP1, currentP2, currentP3):
+        self.simulation.loop.call_later(2, self.charge_with, Currents(currentP1, currentP2, currentP3))
+
+    def charge_with(self, limit: Currents):
+        """Set the limit, and charge with as much as it allows."""
+        self.simulation.set_state('sensor.charger_dynamic_circuit_limit', limit.p1,
+                                  {'state_dynamicCircuitCurrentP1': limit.p1,
+                                   'state_dynamicCircuitCurrentP2': limit.p2,
+                                   'state_dynamicCircuitCurrentP3': limit.p3})
+        charging = Currents(*(min(current, 16) if current >= 6 else 0 for current in (limit.p1, limit.p2, limit.p3)))
+        self.simulation.set_state('sensor.charger_current', charging.max())
+        self.set_other_load(self.other_load, charging)
+
+    def set_other_load(self, other_load: Currents, charging: Currents | None = None):
+        """Set the meter readings, from the other load and what the charger is charging with."""
+        self.other_load = other_load
+        if charging is None:
+            charging = self.limit()
+        for entity_id, current in (('sensor.current_l1', other_load.p1 + charging.p1),
+                                   ('sensor.current_l2', other_load.p2 + charging.p2),
+                                   ('sensor.current_l3', other_load.p3 + charging.p3)):
+            self.simulation.set_state(entity_id, current)
+
+    def limit(self) -> Currents:
+        attributes = self.simulation.states['sensor.charger_dynamic_circuit_limit']['attributes']
+        return Currents(attributes['state_dynamicCircuitCurrentP1'], attributes['state_dynamicCircuitCurrentP2'],
+                        attributes['state_dynamicCircuitCurrentP3'])
+
+    def sent_limits(self) -> list[tuple[float, float, float]]:
+        return [(data['currentP1'], data['currentP2'], data['currentP3'])
+                for _, _, data in self.simulation.service_calls]
+
+    def test__profiling__window_passed__profile_written(self):
+        # Arrange
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.simulation.set_state('input_boolean.charging_profiling', 'on')
+        balancer = self.start(profiling_entity_id='input_boolean.charging_profiling', profiling_directory=directory.name,
+                              profiling_sample_rate=1, profiling_window_seconds=60)
+        samples = balancer.profiler.samples
+
+        # Act
+        self.simulation.run_for(60)
+
+        # Assert
+        self.assertFalse(balancer.profiler.active, 'Profiling should stop when the window has passed, without a pass')
+        self.assertGreater(samples, 0, 'The passes at startup should be profiled')
+        self.assertTrue(os.path.exists(balancer.profiler.path), 'The profile should be written')
+
+    def test__charger_current_unavailable(self):
+        # Arrange
+        balancer = self.start()
+        self.simulation.set_state('sensor.charger_current', 'unavailable')
+
+        # Act
+        self.simulation.set_state('sensor.current_l1', 12)
+        self.simulation.run_for(1)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual([(10, 0, 0)], self.sent_limits(),
+                         'All of L1 should be counted as other load when the charger current is unknown')
+        self.assertGreater(balancer.balance_passes, 1)
+
+    def test__charger_entities_read_once_per_pass(self):
+        # Arrange
+        balancer = self.start()
+        status, current, limit = (CountingEntity(balancer.get_entity(entity_id))
+                                  for entity_id in ('sensor.charger_status', 'sensor.charger_current',
+                                                    'sensor.charger_dynamic_circuit_limit'))
+        balancer.charger = Charger(status, current, limit)
+
+        # Act
+        balancer.balance()
+
+        # Assert
+        self.assertEqual({'state': 1, 'attributes': 1}, status.reads, 'Status and attributes should be read once')
+        self.assertEqual({'state': 1}, current.reads, 'The charger current should be read once')
+        self.assertEqual({'attributes': 1}, limit.reads, 'The circuit dynamic limit should be read once')
+
+    def test__three_phase__overloaded_while_one_phase_limit(self):
+        # Arrange
+        self.simulation.set_state('input_boolean.car_one_phase_charging', 'off')
+        self.set_other_load(Currents(24, 5, 5))  # 40 A on L1, with the charger.
+
+        # Act
+        self.start()
+        self.simulation.run_for(5)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual([(0, 0, 0)], self.sent_limits(), 'Charging should be stopped when L1 is overloaded')
+
+    def test__three_phase__switched_from_one_phase(self):
+        # Arrange
+        self.simulation.set_state('input_boolean.car_one_phase_charging', 'off')
+
+        # Act
+        self.start()
+        self.simulation.run_for(60)
+
+        # Assert
+        self.assertEqual([(16, 16, 16)], self.sent_limits(), 'Should switch to three phases, once')
+        self.assertEqual(Currents(16, 16, 16), self.limit())
+
+    def test__three_phase__lowered_for_the_most_loaded_phase(self):
+        # Arrange
+        self.simulation.set_state('input_boolean.car_one_phase_charging', 'off')
+        self.start()
+        self.simulation.run_for(60)
+
+        # Act
+        self.set_other_load(Currents(5, 12, 5))
+        self.simulation.run_for(60)
+
+        # Assert
+        self.assertEqual([(16, 16, 16), (10, 10, 10)], self.sent_limits())
+
+    def test__three_phase__not_enough_current(self):
+        # Arrange
+        self.simulation.set_state('input_boolean.car_one_phase_charging', 'off')
+        self.start()
+        self.simulation.run_for(60)
+
+        # Act
+        self.set_other_load(Currents(5, 18, 5))
+        self.simulation.run_for(60)
+
+        # Assert
+        self.assertEqual([(16, 16, 16), (0, 0, 0)], self.sent_limits(),
+                         'Charging should stop when less than the minimum charging current is available')
+
+    def test__switched_to_one_phase(self):
+        # Arrange
+        self.simulation.set_state('input_boolean.car_one_phase_charging', 'off')
+        self.start()
+        self.simulation.run_for(60)
+
+        # Act
+        self.simulation.set_state('input_boolean.car_one_phase_charging', 'on')
+        self.simulation.run_for(60)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual([(16, 16, 16), (16, 0, 0)], self.sent_limits(),
+                         'Should switch back to one phase without stopping charging')
+
+    def test__load_forecast__limit_settles(self):
+        # Arrange
+        self.set_other_load(Currents(9, 9, 9))
+        self.start(load_forecast_window_seconds=60)
+
+        # Act
+        for _ in range(10):
+            self.simulation.run_for(10)
+            # A new meter reading, with the same other load.
+            self.set_other_load(Currents(9.1, 9, 9))
+            self.simulation.run_for(10)
+            self.set_other_load(Currents(9, 9, 9))
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual([(13, 0, 0)], self.sent_limits(), 'The limit should settle at what the other load leaves')
+        self.assertEqual(Currents(13, 0, 0), self.limit())
+
+    def test__control_loop__samples_balanced_on_tick(self):
+        # Arrange
+        balancer = self.start(balance_interval_seconds=1)
+        self.simulation.run_for(10)
+        passes = balancer.balance_passes
+
+        # Act
+        # One meter update, changing all three phases.
+        self.set_other_load(Currents(12, 6, 6))
+        self.simulation.run_for(10)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual(2, balancer.balance_passes - passes,
+                         'One pass for the meter update, and one for the charger following the new limit')
+        self.assertEqual([(10, 0, 0)], self.sent_limits())
+        self.assertLessEqual(balancer.balance_latency / balancer.balanced_samples, 1,
+                             'Samples should be balanced within one interval')
+
+    def test__control_loop__bad_sample_ignored(self):
+        # Arrange
+        balancer = self.start(balance_interval_seconds=1)
+        self.simulation.run_for(10)
+        passes = balancer.balance_passes
+
+        # Act
+        self.simulation.set_state('sensor.current_l1', 'unavailable')
+        self.simulation.run_for(10)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual(passes, balancer.balance_passes, 'Nothing new to balance')
+        self.assertEqual(Currents(21, 5, 5), balancer.latest_load, 'The last valid sample should be kept')
+
+    def test__control_loop__sensor_unavailable_at_startup(self):
+        # Arrange
+        self.simulation.set_state('sensor.current_l2', 'unavailable')
+
+        # Act
+        balancer = self.start(balance_interval_seconds=1)
+        self.simulation.run_for(10)
+        self.simulation.set_state('sensor.current_l2', 20)
+        self.simulation.run_for(10)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual(Currents(21, 20, 5), balancer.latest_load, 'Sampling should start when all are available')
+        self.assertEqual(1, balancer.balanced_samples)
+
+
+class CountingEntity:
+    """Counts the reads of the state and attributes of an entity."""
+
+    def __init__(self, entity):
+        self.entity = entity
+        self.reads = {}
+
+    @property
+    def entity_id(self):
+        return self.entity.entity_id
+
+    @property
+    def state(self):
+        self.reads['state'] = self.reads.get('state', 0) + 1
+        return self.entity.state
+
+    @property
+    def attributes(self):
+        self.reads['attributes'] = self.reads.get('attributes', 0) + 1
+        return self.entity.attributes
+
+
+class AsyncLoadBalancerTests(unittest.TestCase):
+    def setUp(self):
+        self.simulation = Simulation(start=datetime(2025, 1, 1))
+        self.addCleanup(self.simulation.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, 'load_balancing.json')
+        for entity_id, state in (('input_boolean.car_load_balance', 'on'),
+                                 ('input_boolean.car_smart_charging', 'on'),
+                                 ('input_boolean.car_one_phase_charging', 'on'),
+                                 ('input_boolean.car_charge_now', 'on'),
+                                 ('sensor.current_l1', 10), ('sensor.current_l2', 5), ('sensor.current_l3', 5),
+                                 ('sensor.charger_current', 10)):
+            self.simulation.set_state(entity_id, state)
+        self.simulation.set_state('sensor.charger_status', 'charging',
+                                  {'circuit_ratedCurrent': 16, 'site_ratedCurrent': 20, 'circuit_id': 'C1'})
+        self.set_limit(16, 0, 0)
+        self.passes_during_commands = []
+        self.simulation.register_service('easee/set_circuit_dynamic_limit', self.set_circuit_dynamic_limit)
+        self.balancer = self.simulation.add_app(AsyncLoadBalancer, 'load_balancing', {
+            'load_balancing_entity_id': 'input_boolean.car_load_balance',
+            'smart_charging_entity_id': 'input_boolean.car_smart_charging',
+            'one_phase_charging_entity_id': 'input_boolean.car_one_phase_charging',
+            'charge_now_entity_id': 'input_boolean.car_charge_now',
+            'current_l1_entity_id': 'sensor.current_l1',
+            'current_l2_entity_id': 'sensor.current_l2',
+            'current_l3_entity_id': 'sensor.current_l3',
+            'charger_status_entity_id': 'sensor.charger_status',
+            'charger_current_entity_id': 'sensor.charger_current',
+            'circuit_dynamic_limit_entity_id': 'sensor.charger_dynamic_circuit_limit',
+            'metrics_entity_id': 'sensor.load_balancing_metrics',
+            'metrics_interval_seconds': 10,
+            'state_file': self.state_file})
+
+    def set_limit(self, p1: float, p2: float, p3: float):
+        self.simulation.set_state('sensor.charger_dynamic_circuit_limit', p1, {'state_dynamicCircuitCurrentP1': p1,
+                                                                               'state_dynamicCircuitCurrentP2': p2,
+                                                                               'state_dynamicCircuitCurrentP3': p3})
+
+    async def set_circuit_dynamic_limit(self, circuit_id, currentP1, currentP2, currentP3):
+        """A service call taking 5 seconds."""
+        passes = self.balancer.balance_passes
+        await asyncio.sleep(5)
+        self.passes_during_commands.append(self.balancer.balance_passes - passes)
+        self.set_limit(currentP1, currentP2, currentP3)
+
+    def test__balance_passes_do_not_wait_for_commands(self):
+        # Arrange
+        start = self.simulation.start
+        events = [Event(start + timedelta(seconds=60), 'sensor.current_l1', '20'),
+                  Event(start + timedelta(seconds=61), 'sensor.current_l1', '21'),
+                  Event(start + timedelta(seconds=62), 'sensor.current_l1', '20')]
+
+        # Act
+        self.simulation.replay(events, until=start + timedelta(seconds=120))
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        limit = self.simulation.get_state('sensor.charger_dynamic_circuit_limit', 'state_dynamicCircuitCurrentP1')
+        self.assertEqual(7, limit, 'The limit should be lowered to what is available at the highest load')
+        self.assertEqual(2, self.passes_during_commands[0], 'Samples should be balanced while the command is in flight')
+        self.assertEqual(5, self.balancer.command_latency / self.balancer.commands_completed, 'Command latency')
+        self.assertEqual(0, len(self.balancer.command_tasks), 'No commands in flight')
+
+    def test__metrics_published(self):
+        # Arrange
+        start = self.simulation.start
+        events = [Event(start + timedelta(seconds=60), 'sensor.current_l1', '20')]
+
+        # Act
+        self.simulation.replay(events, until=start + timedelta(seconds=95))
+
+        # Assert
+        metrics = self.simulation.states['sensor.load_balancing_metrics']
+        self.assertEqual(str(self.balancer.balance_passes), metrics['state'], 'The state should be the balance passes')
+        self.assertEqual(1, metrics['attributes']['call_service_seconds_count'], 'One command')
+        self.assertEqual(5000, metrics['attributes']['call_service_seconds_mean_ms'], 'Command round trip')
+        self.assertEqual(self.balancer.balance_passes, metrics['attributes']['balance_pass_seconds_count'])
+
+    def test__state_written_off_the_event_loop(self):
+        # Arrange
+        start = self.simulation.start
+        events = [Event(start + timedelta(seconds=60), 'sensor.current_l1', '20')]
+        writing_threads = []
+        store_update = self.balancer.state_store.update
+
+        def update(values):
+            writing_threads.append(threading.current_thread())
+            store_update(values)
+        self.balancer.state_store.update = update
+
+        # Act
+        self.simulation.replay(events, until=start + timedelta(seconds=120))
+        while self.balancer.state_writer.writing is not None:
+            self.simulation.loop.run_until_complete(self.balancer.state_writer.writing)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertNotEqual([], writing_threads, 'The state should be written')
+        self.assertNotIn(threading.current_thread(), writing_threads, 'The event loop should not wait for the disk')
+        self.assertEqual(self.balancer.limit_queue.dump(), StateStore(self.state_file).get('limit_queue'),
+                         'The latest state should be stored')
+
+
+if __name__ == '__main__':
+    unittest.main()
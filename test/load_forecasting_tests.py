@@ -0,0 +1,40 @@
+import unittest
+
+from common import Currents
+from load_forecasting import LoadForecaster
+
+
+class LoadForecasterTests(unittest.TestCase):
+    def test__forecast__follows_rising_load(self):
+        # Arrange
+        forecaster = LoadForecaster(window_seconds=60)
+        for t in range(10):
+            forecaster.add(t, Currents(5, 5, 5))
+
+        # Act
+        forecaster.add(10, Currents(20, 5, 5))
+
+        # Assert
+        self.assertEqual(Currents(20, 5, 5), forecaster.forecast(), 'Should never be below the latest sample')
+
+    def test__forecast__holds_after_falling_load(self):
+        # Arrange
+        forecaster = LoadForecaster(window_seconds=60, percentile=90)
+        for t in range(20):
+            forecaster.add(t, Currents(20, 5, 5))
+
+        # Act
+        for t in range(20, 40):
+            forecaster.add(t, Currents(5, 5, 5))
+        held = forecaster.forecast()
+        for t in range(40, 90):
+            forecaster.add(t, Currents(5, 5, 5))
+        released = forecaster.forecast()
+
+        # Assert
+        self.assertEqual(Currents(20, 5, 5), held, 'Should hold the recent high load')
+        self.assertEqual(Currents(5, 5, 5), released, 'Should follow the load once the high samples are old')
+
+
+if __name__ == '__main__':
+    unittest.main()
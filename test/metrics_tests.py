@@ -0,0 +1,81 @@
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from metrics import Histogram, Metrics, prometheus_text, serve_metrics
+
+
+class HistogramTests(unittest.TestCase):
+    def test__quantile(self):
+        # Arrange
+        histogram = Histogram()
+
+        # Act
+        for value in [0.002] * 90 + [0.3] * 10:
+            histogram.observe(value)
+
+        # Assert
+        self.assertEqual(0.0025, histogram.quantile(0.5), 'Upper bound of the bucket of the median')
+        self.assertEqual(0.3, histogram.quantile(0.95), 'Not above the max')
+        self.assertEqual(100, histogram.count)
+        self.assertAlmostEqual(3.18, histogram.sum)
+
+
+class MetricsTests(unittest.TestCase):
+    def test__sensor_attributes(self):
+        # Arrange
+        metrics = Metrics('test_sensor_attributes')
+
+        # Act
+        metrics.increment('balance_passes')
+        metrics.increment('entity_reads', 3)
+        metrics.observe('balance_pass_seconds', 0.004)
+        metrics.observe('balance_pass_seconds', 0.002)
+
+        # Assert
+        attributes = metrics.sensor_attributes()
+        self.assertEqual(1, attributes['balance_passes'])
+        self.assertEqual(3, attributes['entity_reads'])
+        self.assertEqual(2, attributes['balance_pass_seconds_count'])
+        self.assertEqual(3, attributes['balance_pass_seconds_mean_ms'])
+        self.assertEqual(4, attributes['balance_pass_seconds_max_ms'])
+
+    def test__prometheus_text(self):
+        # Arrange
+        metrics = Metrics('charger_1')
+        metrics.increment('reschedules', 2)
+        metrics.observe('reschedule_seconds', 0.02)
+
+        # Act
+        text = prometheus_text({'charger_1': metrics})
+
+        # Assert
+        lines = text.splitlines()
+        self.assertIn('# TYPE charging_reschedules_total counter', lines)
+        self.assertIn('charging_reschedules_total{app="charger_1"} 2', lines)
+        self.assertIn('# TYPE charging_reschedule_seconds histogram', lines)
+        self.assertIn('charging_reschedule_seconds_bucket{app="charger_1",le="0.01"} 0', lines)
+        self.assertIn('charging_reschedule_seconds_bucket{app="charger_1",le="0.025"} 1', lines)
+        self.assertIn('charging_reschedule_seconds_bucket{app="charger_1",le="+Inf"} 1', lines)
+        self.assertIn('charging_reschedule_seconds_count{app="charger_1"} 1', lines)
+
+    def test__serve_metrics(self):
+        # Arrange
+        Metrics('test_serve_metrics').increment('balance_passes')
+        server = serve_metrics(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        # Act
+        with urlopen(f"{url}/metrics") as response:
+            body = response.read().decode()
+
+        # Assert
+        self.assertIn('charging_balance_passes_total{app="test_serve_metrics"} 1', body)
+        with self.assertRaises(HTTPError, msg='Only /metrics should be served'):
+            urlopen(f"{url}/")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from price_forecasting import PriceForecaster
+from price_series import PriceSeries
+
+
+MONDAY = datetime(2025, 1, 6, tzinfo=timezone(timedelta(hours=1)))
+
+
+class PriceForecasterTests(unittest.TestCase):
+    def test__extrapolate__weekday_profile(self):
+        # Arrange
+        # Two weeks where Mondays are expensive, then the weekend of the third week.
+        forecaster = PriceForecaster()
+        history = _build_series(MONDAY, [10 if day % 7 == 0 else 1 for day in range(14)])
+        forecaster.update(history)
+        weekend = _build_series(MONDAY + timedelta(days=19), [1, 1])
+
+        # Act
+        forecast = forecaster.extrapolate(weekend, weekend.ends[-1] + timedelta(days=2))
+
+        # Assert
+        self.assertEqual([1] * 48, weekend.extrapolate(forecast.ends[-1]).values[48:],
+                         'Repeating the day before would not see the Monday coming')
+        self.assertEqual([10] * 24, forecast.values[48:72], 'Monday should be forecast from the Mondays')
+        self.assertEqual([1] * 24, forecast.values[72:], 'Tuesday should be forecast from the Tuesdays')
+        self.assertSequenceEqual(weekend.extrapolate(forecast.ends[-1]).starts, forecast.starts,
+                                 'The same periods as when repeating the day before')
+
+    def test__extrapolate__shifted_to_latest_level(self):
+        # Arrange
+        forecaster = PriceForecaster()
+        forecaster.update(_build_series(MONDAY, [1] * 7))
+        known = _build_series(MONDAY + timedelta(days=7), [3])
+
+        # Act
+        # Like the Scheduler: the known prices are learnt before they are extrapolated.
+        forecaster.update(known)
+        forecast = forecaster.extrapolate(known, known.ends[-1] + timedelta(days=1))
+
+        # Assert
+        self.assertEqual([3] * 24, forecast.values[24:], 'The profile should be shifted to the last known day')
+
+    def test__extrapolate__no_profile__repeats_day_before(self):
+        # Arrange
+        forecaster = PriceForecaster()
+        known = _build_series(MONDAY, [1, 2])
+        end = known.ends[-1] + timedelta(hours=30)
+
+        # Act
+        forecast = forecaster.extrapolate(known, end)
+
+        # Assert
+        self.assertEqual(known.extrapolate(end).values, forecast.values)
+
+    def test__update__only_new_periods(self):
+        # Arrange
+        forecaster = PriceForecaster()
+        today = _build_series(MONDAY, [1])
+        today_and_tomorrow = _build_series(MONDAY, [1, 2])
+
+        # Act
+        learnt = [forecaster.update(today), forecaster.update(today), forecaster.update(today_and_tomorrow)]
+
+        # Assert
+        self.assertEqual([24, 0, 24], learnt, 'Periods should only be learnt once')
+        self.assertEqual(today_and_tomorrow.ends[-1], forecaster.learnt_until)
+
+    def test__dump_and_load(self):
+        # Arrange
+        forecaster = PriceForecaster()
+        forecaster.update(_build_series(MONDAY, [1, 2, 3]))
+
+        # Act
+        restored = PriceForecaster()
+        restored.load(forecaster.dump())
+
+        # Assert
+        self.assertEqual(forecaster.profile, restored.profile)
+        self.assertEqual(forecaster.previous, restored.previous)
+        self.assertEqual(forecaster.learnt_until, restored.learnt_until)
+
+
+def _build_series(start: datetime, daily_values: list[float]) -> PriceSeries:
+    """Hourly periods, with the same price all day."""
+    period = timedelta(hours=1)
+    hours = 24 * len(daily_values)
+    return PriceSeries([start + i * period for i in range(hours)],
+                       [start + (i + 1) * period for i in range(hours)],
+                       [daily_values[i // 24] for i in range(hours)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import unittest
+
+from price_series import PriceSeries
+
+
+class PriceSeriesTests(unittest.TestCase):
+    def test__window(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(hours=1)
+        series = _build_series(start, [1, 2, 3, 4])
+
+        # Act
+        window = series.window(start + 0.5 * period, start + 2.5 * period)
+
+        # Assert
+        self.assertSequenceEqual([start + 0.5 * period, start + period, start + 2 * period], window.starts)
+        self.assertSequenceEqual([start + period, start + 2 * period, start + 2.5 * period], window.ends)
+        self.assertSequenceEqual([1, 2, 3], window.values)
+        self.assertEqual(start, series.starts[0], 'The original series should be unchanged')
+
+    def test__window__inside_one_period(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        series = _build_series(start, [1, 2])
+
+        # Act
+        window = series.window(start + timedelta(minutes=10), start + timedelta(minutes=20))
+
+        # Assert
+        self.assertSequenceEqual([start + timedelta(minutes=10)], window.starts)
+        self.assertSequenceEqual([start + timedelta(minutes=20)], window.ends)
+
+    def test__extrapolate__nothing_to_fill(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        series = _build_series(start, [1, 2])
+
+        # Act
+        extrapolated = series.extrapolate(start + timedelta(hours=2))
+
+        # Assert
+        self.assertIs(series, extrapolated, 'Nothing should be copied when there is nothing to fill')
+
+    def test__order_by_value_and_contiguous_slots(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(hours=1)
+        series = _build_series(start, [1, 3, 1, 1, 2])
+
+        # Act
+        cheapest = series.order_by_value()[:3]
+        slots = series.contiguous_slots(cheapest)
+
+        # Assert
+        self.assertSequenceEqual([0, 2, 3], cheapest, 'Should be ordered by value, then by time')
+        self.assertSequenceEqual([
+            {'start': start, 'end': start + period},
+            {'start': start + 2 * period, 'end': start + 4 * period},
+        ], slots)
+
+
+def _build_series(start: datetime, values: list[float], period: timedelta = timedelta(hours=1)) -> PriceSeries:
+    return PriceSeries([start + i * period for i in range(len(values))],
+                       [start + (i + 1) * period for i in range(len(values))],
+                       values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from profiling import Profiler
+
+
+def busy(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+class ProfilerTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.now = 0.0
+
+    def clock(self) -> float:
+        return self.now
+
+    def test__not_started__not_profiled(self):
+        # Arrange
+        profiler = Profiler('test', self.directory, sample_rate=1, clock=self.clock)
+
+        # Act
+        result = profiler.call(busy, 10)
+
+        # Assert
+        self.assertEqual(285, result)
+        self.assertEqual(0, profiler.samples)
+        self.assertIsNone(profiler.stop(), 'Nothing should be written')
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test__stop__profile_written(self):
+        # Arrange
+        profiler = Profiler('test', self.directory, sample_rate=1, clock=self.clock)
+        profiler.start()
+
+        # Act
+        for _ in range(3):
+            profiler.call(busy, 1000)
+        path = profiler.stop()
+
+        # Assert
+        self.assertEqual(3, profiler.samples)
+        self.assertEqual(self.directory, os.path.dirname(path))
+        stats = pstats.Stats(path)
+        calls = {function: stat[1] for (_, _, function), stat in stats.stats.items()}
+        self.assertEqual(3, calls['busy'], 'The calls should be aggregated in one profile')
+
+    def test__window_passed__stopped(self):
+        # Arrange
+        profiler = Profiler('test', self.directory, sample_rate=1, window=60, clock=self.clock)
+        profiler.start()
+        profiler.call(busy, 10)
+
+        # Act
+        self.now = 60
+        profiler.call(busy, 10)
+
+        # Assert
+        self.assertFalse(profiler.active, 'Profiling should stop after the window')
+        self.assertEqual(1, profiler.samples, 'Calls after the window should not be profiled')
+        self.assertTrue(os.path.exists(profiler.path), 'The profile should be written when the window has passed')
+
+    def test__sample_rate(self):
+        # Arrange
+        profiler = Profiler('test', self.directory, sample_rate=0, clock=self.clock)
+        profiler.start()
+
+        # Act
+        profiler.call(busy, 10)
+
+        # Assert
+        self.assertEqual(0, profiler.samples, 'No calls should be sampled')
+
+
+if __name__ == '__main__':
+    unittest.main()
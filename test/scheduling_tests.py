@@ -1,10 +1,16 @@
 from datetime import datetime, timedelta, timezone
 import math
+import os
 import random
+import tempfile
 import unittest
 import yaml
 
-from scheduling import extrapolate_prices, create_schedule, NotEnoughTimeException, calculate_eta, get_prices
+from price_series import PriceSeries
+from scheduling import extrapolate_prices, create_schedule, NotEnoughTimeException, calculate_eta, get_prices, \
+    Scheduler, PriceTable, create_schedules, create_site_schedules, create_energy_schedule, \
+    trim_schedule, estimate_cost, charge_time
+from simulation import Simulation
 
 
 class SchedulerTests(unittest.TestCase):
@@ -42,6 +48,37 @@ class SchedulerTests(unittest.TestCase):
         self.assertEqual(start + period, available_prices[1]['start'], 'Second period start')
         self.assertEqual(start + 2 * period, available_prices[1]['end'], 'Second period end')
 
+    def test__get_prices__does_not_modify_known_prices(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(seconds=1)
+        prices = list(_build_prices(start, start + 2 * period, period))
+
+        # Act
+        get_prices(prices, start + 0.5 * period, start + 1.5 * period)
+
+        # Assert
+        self.assertEqual(start, prices[0]['start'], 'First period start should be unchanged')
+        self.assertEqual(start + 2 * period, prices[-1]['end'], 'Last period end should be unchanged')
+
+    def test__price_table__only_parses_new_rows(self):
+        # Arrange
+        today = [{'start': '2025-01-01T00:00:00+01:00', 'end': '2025-01-01T01:00:00+01:00', 'value': 1.5}]
+        tomorrow = [{'start': '2025-01-02T00:00:00+01:00', 'end': '2025-01-02T01:00:00+01:00', 'value': 2.5}]
+        price_table = PriceTable()
+        first = price_table.update(today)
+
+        # Act
+        second = price_table.update(today + tomorrow)
+        third = price_table.update(tomorrow)
+
+        # Assert
+        self.assertIs(first[0], second[0], 'Already parsed rows should be reused')
+        self.assertIs(second[1], third[0], 'Already parsed rows should be reused')
+        self.assertEqual({'start': datetime(2025, 1, 2, 0, tzinfo=timezone(timedelta(hours=1))),
+                          'end': datetime(2025, 1, 2, 1, tzinfo=timezone(timedelta(hours=1))),
+                          'value': 2.5}, third[0], 'Rows should be parsed')
+
     def test__extrapolate_prices__one_missing_day(self):
         self._test__extrapolate_prices(
             start=datetime(2023, 1, 1, 0, 0, 0),
@@ -120,6 +157,40 @@ class SchedulerTests(unittest.TestCase):
         # Assert
         self.assertEqual(end, filled[-1]['end'], 'Expected the last period to end at the end of the last period.')
 
+    def test__extrapolate_prices__dst_day(self):
+        # Arrange
+        # The day DST starts in Sweden only has 23 hours (92 quarter-hour periods).
+        start = datetime(2025, 3, 30, 0, 0, 0, tzinfo=timezone(timedelta(hours=1)))
+        period = timedelta(minutes=15)
+        dst_start = datetime(2025, 3, 30, 1, 0, 0, tzinfo=timezone.utc)
+        prices = [{**p, 'start': p['start'].astimezone(timezone(timedelta(hours=2))) if p['start'] >= dst_start else p['start'],
+                        'end': p['end'].astimezone(timezone(timedelta(hours=2))) if p['end'] >= dst_start else p['end']}
+                  for p in _build_prices(start, start + timedelta(hours=23), period)]
+        extension_end = prices[-1]['end'] + timedelta(days=1)
+
+        # Act
+        filled = extrapolate_prices(prices, extension_end)
+
+        # Assert
+        self.assertEqual(92, len(prices), 'Expected the DST day to have 92 periods.')
+        self.assertEqual(92 + 96, len(filled), 'Expected 96 periods to be added.')
+        self.assertEqual(extension_end, filled[-1]['end'], f'Expected the last period to end at {extension_end}.')
+        self.assertTrue(all(filled[i]['end'] == filled[i + 1]['start'] for i in range(len(filled) - 1)),
+                        'Expected the periods to be contiguous.')
+
+    def test__extrapolate_prices__does_not_modify_prices(self):
+        # Arrange
+        start = datetime(2023, 1, 1, 0, 0, 0)
+        period = timedelta(minutes=15)
+        end = start + timedelta(days=1)
+        prices = list(_build_prices(start, end, period))
+
+        # Act
+        extrapolate_prices(prices, end - timedelta(minutes=5))
+
+        # Assert
+        self.assertEqual(end, prices[-1]['end'], 'Expected the given periods to be unchanged.')
+
     def test_create_schedule(self):
         # Arrange
         start = datetime(2025, 1, 1)
@@ -207,6 +278,187 @@ class SchedulerTests(unittest.TestCase):
         self.assertEqual(start + period * 3, schedule[1]['start'], 'Second period start')
         self.assertEqual(start + period * 3.1, schedule[1]['end'], 'Second period end')
 
+    def test__create_energy_schedule__partial_period(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(hours=1)
+        available_periods = [
+            {'start': start,              'end': start + period,     'value': 3},
+            {'start': start + period,     'end': start + period * 2, 'value': 2},
+            {'start': start + period * 2, 'end': start + period * 3, 'value': 1},
+            {'start': start + period * 3, 'end': start + period * 4, 'value': 4},
+        ]
+
+        # Act
+        schedule, estimated_cost = create_energy_schedule(available_periods, energy_kwh=25, max_power_kw=10)
+
+        # Assert
+        self.assertSequenceEqual([{'start': start + period * 0.5, 'end': start + period * 3}], schedule,
+                                 'The partial period should be placed next to the other scheduled periods')
+        self.assertAlmostEqual(10 * 1 + 10 * 2 + 5 * 3, estimated_cost, msg='Estimated cost')
+
+    def test__create_energy_schedule__power_per_period(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(hours=1)
+        available_periods = [
+            {'start': start,          'end': start + period,     'value': 1},
+            {'start': start + period, 'end': start + period * 2, 'value': 2},
+        ]
+
+        # Act
+        schedule, estimated_cost = create_energy_schedule(available_periods, energy_kwh=8, max_power_kw=[4, 8])
+
+        # Assert
+        self.assertSequenceEqual([{'start': start, 'end': start + period * 1.5}], schedule, 'Schedule')
+        self.assertAlmostEqual(4 * 1 + 4 * 2, estimated_cost, msg='Estimated cost')
+
+    def test__create_energy_schedule__not_enough_time(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        available_periods = [{'start': start, 'end': start + timedelta(hours=1), 'value': 1}]
+
+        # Act & Assert
+        self.assertRaises(NotEnoughTimeException, create_energy_schedule, available_periods, 20, 10)
+
+    def test__trim_schedule(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        schedule = [
+            {'start': start, 'end': start + timedelta(hours=1)},
+            {'start': start + timedelta(hours=2), 'end': start + timedelta(hours=4)},
+            {'start': start + timedelta(hours=5), 'end': start + timedelta(hours=6)},
+        ]
+        now = start + timedelta(minutes=30)
+
+        # Act
+        trimmed = trim_schedule(schedule, now, timedelta(hours=1.5))
+        too_short = trim_schedule(schedule, now, timedelta(hours=4))
+
+        # Assert
+        self.assertSequenceEqual([
+            {'start': now, 'end': start + timedelta(hours=1)},
+            {'start': start + timedelta(hours=2), 'end': start + timedelta(hours=3)},
+        ], trimmed, 'Should keep the remaining slots needed, from now')
+        self.assertIsNone(too_short, 'Should not extend the schedule')
+
+    def test__estimate_cost(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(hours=1)
+        available_periods = [
+            {'start': start,          'end': start + period,     'value': 1},
+            {'start': start + period, 'end': start + period * 2, 'value': 2},
+        ]
+        schedule, expected_cost = create_energy_schedule(available_periods, energy_kwh=15, max_power_kw=10)
+
+        # Act
+        cost = estimate_cost(PriceSeries.from_periods(available_periods), schedule, power_kw=10)
+
+        # Assert
+        self.assertAlmostEqual(expected_cost, cost, msg='Should be the same as when scheduling')
+
+    def test__create_schedules(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(minutes=15)
+        available_periods = list(_build_prices(start, start + timedelta(days=1), period))
+        requests = [
+            (start, start + timedelta(hours=8), timedelta(hours=2)),
+            (start + timedelta(minutes=5), start + timedelta(hours=23, minutes=50), timedelta(hours=5.1)),
+            (start + timedelta(hours=20), start + timedelta(hours=21), timedelta(hours=2)),
+        ]
+
+        # Act
+        schedules = create_schedules(available_periods, requests)
+
+        # Assert
+        for (window_start, departure, needed_time), (schedule, eta) in zip(requests[:2], schedules):
+            expected_schedule = create_schedule(get_prices(available_periods, window_start, departure), needed_time)
+            self.assertSequenceEqual(expected_schedule, schedule, 'Should be the same as scheduling one at a time')
+            self.assertEqual(calculate_eta(window_start, needed_time, expected_schedule), eta, 'ETA')
+        self.assertEqual((None, requests[2][0] + requests[2][2]), schedules[2],
+                         'Should charge immediately when there is not enough time')
+
+    def test__create_site_schedules__capacity(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(hours=1)
+        available_periods = [
+            {'start': start,              'end': start + period,     'value': 1},
+            {'start': start + period,     'end': start + period * 2, 'value': 2},
+            {'start': start + period * 2, 'end': start + period * 3, 'value': 3},
+            {'start': start + period * 3, 'end': start + period * 4, 'value': 4},
+        ]
+        requests = [
+            (start, start + period * 4, period * 2, 16),
+            (start, start + period * 3, period, 10),
+            (start, start + period * 2, period, 10),
+        ]
+
+        # Act
+        schedules = create_site_schedules(available_periods, requests, site_capacity=25)
+
+        # Assert
+        self.assertSequenceEqual([{'start': start, 'end': start + period}], schedules[2][0],
+                                 'The first departing charger should get the cheapest period')
+        self.assertSequenceEqual([{'start': start, 'end': start + period}], schedules[1][0],
+                                 'The second charger should also fit in the cheapest period')
+        self.assertSequenceEqual([{'start': start + period, 'end': start + period * 3}], schedules[0][0],
+                                 'The last charger should get the cheapest periods with room left')
+
+    def test__create_site_schedules__moves_planned_charger_to_make_room(self):
+        # Arrange
+        start = datetime(2025, 1, 1)
+        period = timedelta(hours=1)
+        available_periods = [{'start': start + period * i, 'end': start + period * (i + 1), 'value': value}
+                             for i, value in enumerate((2, 1, 3, 5))]
+        requests = [
+            (start, start + period * 2, period, 16),
+            (start + period, start + period * 3, period * 2, 16),
+        ]
+
+        # Act
+        schedules = create_site_schedules(available_periods, requests, site_capacity=16)
+
+        # Assert
+        self.assertSequenceEqual([{'start': start, 'end': start + period}], schedules[0][0],
+                                 'The first charger should move to the earlier period, to make room')
+        self.assertSequenceEqual([{'start': start + period, 'end': start + period * 3}], schedules[1][0],
+                                 'The second charger should fit after it')
+
+    def test__create_site_schedules__capacity_never_exceeded(self):
+        # Arrange
+        random.seed(1)
+        start = datetime(2025, 1, 1)
+        period = timedelta(minutes=15)
+        available_periods = PriceSeries([start + period * i for i in range(192)],
+                                        [start + period * (i + 1) for i in range(192)],
+                                        [random.uniform(0, 1) for _ in range(192)])
+        requests = []
+        for _ in range(20):
+            arrival = start + timedelta(minutes=random.randrange(0, 24 * 60))
+            departure = arrival + timedelta(minutes=random.randrange(4 * 60, 24 * 60))
+            requests.append((arrival, departure, timedelta(minutes=random.randrange(15, 8 * 60)),
+                             random.choice((10, 16))))
+        site_capacity = [random.choice((16, 32, 48)) for _ in range(192)]
+
+        # Act
+        schedules = create_site_schedules(available_periods, requests, site_capacity)
+
+        # Assert
+        load = [0] * 192
+        for (arrival, departure, needed_time, current), (schedule, eta) in zip(requests, schedules):
+            if schedule is None:
+                continue
+            self.assertLessEqual(eta, departure, 'A planned charger should be done before departure')
+            for slot in schedule:
+                first, last = available_periods.index_range(slot['start'], slot['end'])
+                for i in range(first, last):
+                    load[i] += current
+        self.assertTrue(all(l <= c for l, c in zip(load, site_capacity)), 'No period should be above the capacity')
+        self.assertGreater(sum(schedule is not None for schedule, _ in schedules), 10, 'Most chargers should fit')
+
     def test__calculate_eta__no_schedule(self):
         # Arrange
         # schedule = [dict(start=datetime(2025, 1, 1, 0, 0), end=datetime(2025, 1, 1, 0, 15))]
@@ -285,6 +537,16 @@ class SchedulerTests(unittest.TestCase):
         # Assert
         self.assertEqual(expected_eta, eta, f"ETA is not the expected")
 
+    def test__charge_time__phases(self):
+        # Act
+        one_phase = charge_time(energy_kwh=23, current_a=10)
+        three_phases = charge_time(energy_kwh=23, current_a=10, phases=3)
+
+        # Assert
+        self.assertEqual(timedelta(hours=10), one_phase, 'One phase: 2.3 kW')
+        self.assertEqual(timedelta(hours=10) / 3, three_phases, 'Three phases: 6.9 kW')
+
+
 def _build_prices(start: datetime, end: datetime, period: timedelta):
     while start < end:
         yield {'start': start, 'end': start + period, 'value': random.uniform(0, 1)}
@@ -298,5 +560,138 @@ def _parse_prices(periods):
         'value': period['value']
     } for period in periods]
 
+
+class ChargeNowSwitchTests(unittest.TestCase):
+    def setUp(self):
+        self.simulation = Simulation(start=datetime(2025, 1, 1, 18))
+        self.addCleanup(self.simulation.close)
+
+    def test__unchanged__not_written(self):
+        # Arrange
+        scheduler = _start_scheduler(self.simulation)
+        writes = len(self.simulation.history['input_boolean.car_charge_now'])
+
+        # Act
+        # A new state of charge reading, that doesn't change the plan.
+        self.simulation.set_state('input_number.estimated_state_of_charge', '80.0')
+        self.simulation.run_for(10)
+
+        # Assert
+        self.assertEqual(2, scheduler.reschedule_dispatcher.runs, 'Should be rescheduled')
+        self.assertEqual(writes, len(self.simulation.history['input_boolean.car_charge_now']),
+                         'The same state and attributes should not be written again')
+        self.assertEqual(1, scheduler.suppressed_charge_now_writes)
+
+    def test__eta_rounded_up(self):
+        # Arrange
+        granularity = timedelta(minutes=15)
+
+        # Act
+        scheduler = _start_scheduler(self.simulation, eta_granularity_seconds=granularity.total_seconds())
+
+        # Assert
+        eta = datetime.fromisoformat(self.simulation.get_state('input_boolean.car_charge_now', 'eta'))
+        end = scheduler.schedule[-1]['end']
+        self.assertEqual((0, 0), (eta.minute % 15, eta.second), 'Should be rounded to the granularity')
+        self.assertLessEqual(end, eta, 'Should be rounded up')
+        self.assertLess(eta - end, granularity)
+
+
+class SlotTimerTests(unittest.TestCase):
+    def setUp(self):
+        self.simulation = Simulation(start=datetime(2025, 1, 1, 18))
+        self.addCleanup(self.simulation.close)
+        self.scheduler = _start_scheduler(self.simulation)
+
+    def test__idle_until_slot_start(self):
+        # Arrange
+        start = self.scheduler.schedule[0]['start']
+        callbacks = self.simulation.callbacks
+
+        # Act
+        self.simulation.run_until(start - timedelta(seconds=1))
+        idle_callbacks = self.simulation.callbacks - callbacks
+        self.simulation.run_until(start + timedelta(seconds=5))
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual(0, idle_callbacks, 'Nothing should run before the slot starts')
+        self.assertEqual('on', self.simulation.get_state('input_boolean.car_charge_now'),
+                         'Charging should start within seconds of the slot start')
+        changed = datetime.fromisoformat(self.simulation.states['input_boolean.car_charge_now']['last_changed'])
+        self.assertLessEqual(changed - start, timedelta(seconds=self.scheduler.reschedule_debounce))
+
+    def test__state_of_charge_changed__end_timer_moved(self):
+        # Arrange
+        self.simulation.run_until(self.scheduler.schedule[0]['start'] + timedelta(minutes=30))
+        end = self.scheduler.schedule[-1]['end']
+
+        # Act
+        self.simulation.set_state('input_number.estimated_state_of_charge', 90)
+        self.simulation.run_for(10)
+
+        # Assert
+        new_end = self.scheduler.schedule[-1]['end']
+        self.assertLess(new_end, end, 'Less time should be needed')
+        self.assertIn(new_end, self.scheduler.slot_timers, 'A timer should be armed at the new end')
+        self.assertNotIn(end, self.scheduler.slot_timers, 'The timer at the old end should be cancelled')
+        self.assertEqual(self.simulation.pending_timers, len(self.scheduler.slot_timers), 'No other timers')
+
+
+class ProfilingTests(unittest.TestCase):
+    def setUp(self):
+        self.simulation = Simulation(start=datetime(2025, 1, 1, 18))
+        self.addCleanup(self.simulation.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test__window_passed__profile_written(self):
+        # Arrange
+        self.simulation.set_state('input_boolean.charging_profiling', 'on')
+        scheduler = _start_scheduler(self.simulation, profiling_entity_id='input_boolean.charging_profiling',
+                                     profiling_directory=self.directory, profiling_sample_rate=1,
+                                     profiling_window_seconds=60)
+
+        # Act
+        self.simulation.run_for(60)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertFalse(scheduler.profiler.active, 'Profiling should stop when the window has passed')
+        self.assertEqual(1, scheduler.full_replans)
+        self.assertEqual(1, scheduler.profiler.samples, 'The full replan should be profiled')
+        self.assertTrue(os.path.exists(scheduler.profiler.path), 'The profile should be written')
+
+
+def _start_scheduler(simulation: Simulation, **args) -> Scheduler:
+    """Starts a Scheduler at 18:00, with 80 % state of charge and departure at 07:00."""
+    midnight = datetime(2025, 1, 1, tzinfo=simulation.time_zone)
+    quarter = timedelta(minutes=15)
+    # Cheap from 21:00 to 02:00, in 15-minute periods.
+    raw = [{'start': (midnight + i * quarter).isoformat(),
+            'end': (midnight + (i + 1) * quarter).isoformat(),
+            'value': 1 + i % 3 if 84 <= i < 104 else 10 + i % 5} for i in range(192)]
+    simulation.set_state('sensor.nordpool', 1, {'raw_today': raw[:96], 'raw_tomorrow': raw[96:], 'currency': 'SEK'})
+    for entity_id, state in (('input_boolean.car_smart_charging', 'on'),
+                             ('input_boolean.car_charge_now', 'off'),
+                             ('input_number.estimated_state_of_charge', 80),
+                             ('sensor.wican_soc_d', 80),
+                             ('input_datetime.anticipated_departure_time', '2025-01-02 07:00:00')):
+        simulation.set_state(entity_id, state)
+    simulation.set_state('sensor.charger_status', 'awaiting_start', {'circuit_ratedCurrent': 16})
+    scheduler = simulation.add_app(Scheduler, 'scheduling', {
+        'charger_status_entity_id': 'sensor.charger_status',
+        'smart_charging_entity_id': 'input_boolean.car_smart_charging',
+        'departure_time_entity_id': 'input_datetime.anticipated_departure_time',
+        'charge_now_entity_id': 'input_boolean.car_charge_now',
+        'state_of_charge_entity_id': 'input_number.estimated_state_of_charge',
+        'last_known_state_of_charge_entity_id': 'sensor.wican_soc_d',
+        'price_entity_id': 'sensor.nordpool',
+        **args})
+    simulation.run_for(10)
+    return scheduler
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,200 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from common import Currents
+from load_balancing import LoadBalancer
+from simulation import Event, Simulation
+from site_balancing import SiteLoadBalancer
+
+
+class SimulationTests(unittest.TestCase):
+    def setUp(self):
+        self.simulation = Simulation(start=datetime(2025, 1, 1))
+        self.addCleanup(self.simulation.close)
+
+    def test__timers_run_on_virtual_time(self):
+        # Arrange
+        app = self.simulation.add_app(TimerApp, 'timers', {})
+
+        # Act
+        started = time.perf_counter()
+        self.simulation.run_for(24 * 3600)
+        duration = time.perf_counter() - started
+
+        # Assert
+        self.assertEqual(24 * 60 + 1, len(app.ticks), 'Every minute, starting now')
+        self.assertEqual([self.simulation.start + timedelta(hours=2)], app.delayed, 'run_in after 2 hours')
+        self.assertLess(duration, 5, 'A simulated day should not take real time')
+
+    def test__listen_state__only_on_change(self):
+        # Arrange
+        self.simulation.set_state('sensor.temperature', 20)
+        app = self.simulation.add_app(ListenerApp, 'listener', {})
+        events = [Event(self.simulation.start + timedelta(minutes=minute), 'sensor.temperature', state)
+                  for minute, state in ((1, '21'), (2, '21'), (3, '20'))]
+
+        # Act
+        self.simulation.replay(events)
+
+        # Assert
+        self.assertSequenceEqual([('20', '21', 'P1'), ('21', '20', 'P1')], app.changes,
+                                 'Callbacks should get old and new state, and the extra kwargs')
+
+    def test__get_history__starts_with_state_at_start_time(self):
+        # Arrange
+        self.simulation.set_state('sensor.energy', 1)
+        for energy in (2, 3, 4):
+            self.simulation.run_for(3600)
+            self.simulation.set_state('sensor.energy', energy)
+
+        # Act
+        history = self.simulation.get_history('sensor.energy', datetime(2025, 1, 1, 1, 30))[0]
+
+        # Assert
+        self.assertSequenceEqual(['2', '3', '4'], [entry['state'] for entry in history], 'States since 01:30')
+
+    def test__load_balancer__replays_a_day(self):
+        # Arrange
+        simulation = self.simulation
+        for entity_id, state in (('input_boolean.car_load_balance', 'on'),
+                                 ('input_boolean.car_smart_charging', 'on'),
+                                 ('input_boolean.car_one_phase_charging', 'on'),
+                                 ('input_boolean.car_charge_now', 'on'),
+                                 ('sensor.current_l1', 5), ('sensor.current_l2', 5), ('sensor.current_l3', 5),
+                                 ('sensor.charger_current', 10)):
+            simulation.set_state(entity_id, state)
+        simulation.set_state('sensor.charger_status', 'charging',
+                             {'circuit_ratedCurrent': 16, 'site_ratedCurrent': 20, 'circuit_id': 'C1'})
+        set_limit(simulation, 16, 0, 0)
+        simulation.register_service('easee/set_circuit_dynamic_limit',
+                                    lambda circuit_id, currentP1, currentP2, currentP3: simulation.loop.call_later(
+                                        5, set_limit, simulation, currentP1, currentP2, currentP3))
+        app = simulation.add_app(LoadBalancer, 'load_balancing', {
+            'load_balancing_entity_id': 'input_boolean.car_load_balance',
+            'smart_charging_entity_id': 'input_boolean.car_smart_charging',
+            'one_phase_charging_entity_id': 'input_boolean.car_one_phase_charging',
+            'charge_now_entity_id': 'input_boolean.car_charge_now',
+            'current_l1_entity_id': 'sensor.current_l1',
+            'current_l2_entity_id': 'sensor.current_l2',
+            'current_l3_entity_id': 'sensor.current_l3',
+            'charger_status_entity_id': 'sensor.charger_status',
+            'charger_current_entity_id': 'sensor.charger_current',
+            'circuit_dynamic_limit_entity_id': 'sensor.charger_dynamic_circuit_limit'})
+        # A 10 A load on L1 for an hour, in the middle of the day, next to 10 A of charging.
+        events = [Event(simulation.start + timedelta(minutes=minute), 'sensor.current_l1',
+                        '20' if 12 * 60 <= minute < 13 * 60 else '10')
+                  for minute in range(24 * 60)]
+
+        # Act
+        simulation.replay(events)
+
+        # Assert
+        self.assertEqual([], simulation.errors, 'No errors')
+        self.assertSequenceEqual([(datetime(2025, 1, 1, 12, tzinfo=simulation.time_zone), 8),
+                                  (datetime(2025, 1, 1, 13, tzinfo=simulation.time_zone), 16)],
+                                 [(call[0], call[2]['currentP1']) for call in simulation.service_calls],
+                                 'The limit should be lowered during the load, and raised after it')
+        self.assertLess(app.balance_passes, 10, 'Only changes should be balanced')
+
+    def test__site_load_balancer__replays_a_day(self):
+        # Arrange
+        simulation = self.simulation
+        for entity_id, state in (('sensor.other_load_l1', 5), ('sensor.other_load_l2', 5),
+                                 ('sensor.other_load_l3', 5)):
+            simulation.set_state(entity_id, state)
+        chargers = []
+        for number, limit in ((1, Currents(16, 0, 0)), (2, Currents(0, 16, 0))):
+            simulation.set_state(f'input_boolean.charger_{number}_charge_now', 'on')
+            simulation.set_state(f'sensor.charger_{number}_status', 'charging',
+                                 {'circuit_ratedCurrent': 16, 'site_ratedCurrent': 25, 'circuit_id': f'C{number}'})
+            charge_with(simulation, number, limit)
+            chargers.append({'charger_status_entity_id': f'sensor.charger_{number}_status',
+                             'charger_current_entity_id': f'sensor.charger_{number}_current',
+                             'circuit_dynamic_limit_entity_id': f'sensor.charger_{number}_dynamic_circuit_limit',
+                             'charge_now_entity_id': f'input_boolean.charger_{number}_charge_now'})
+        simulation.register_service('easee/set_circuit_dynamic_limit',
+                                    lambda circuit_id, currentP1, currentP2, currentP3: simulation.loop.call_later(
+                                        5, charge_with, simulation, int(circuit_id[1:]),
+                                        Currents(currentP1, currentP2, currentP3)))
+        simulation.add_app(MeterApp, 'meter', {'chargers': 2})
+        app = simulation.add_app(SiteLoadBalancer, 'site_load_balancing', {
+            'current_l1_entity_id': 'sensor.current_l1',
+            'current_l2_entity_id': 'sensor.current_l2',
+            'current_l3_entity_id': 'sensor.current_l3',
+            'chargers': chargers})
+        # A 10 A load on L1 for an hour, in the middle of the day, next to charger 1.
+        events = [Event(simulation.start + timedelta(minutes=minute), 'sensor.other_load_l1',
+                        '15' if 12 * 60 <= minute < 13 * 60 else '5')
+                  for minute in range(24 * 60)]
+
+        # Act
+        simulation.replay(events)
+
+        # Assert
+        self.assertEqual([], simulation.errors, 'No errors')
+        self.assertSequenceEqual([(datetime(2025, 1, 1, 12, tzinfo=simulation.time_zone), 'C1', 7),
+                                  (datetime(2025, 1, 1, 13, tzinfo=simulation.time_zone), 'C1', 16)],
+                                 [(call[0], call[2]['circuit_id'], call[2]['currentP1'])
+                                  for call in simulation.service_calls],
+                                 'Only charger 1 should be lowered during the load, and raised after it')
+        self.assertEqual('16', simulation.get_state('sensor.charger_2_current'), 'Charger 2 should not be affected')
+        self.assertLess(app.balance_passes, 20, 'Only changes should be balanced')
+
+
+def set_limit(simulation: Simulation, p1: float, p2: float, p3: float):
+    simulation.set_state('sensor.charger_dynamic_circuit_limit', p1, {'state_dynamicCircuitCurrentP1': p1,
+                                                                      'state_dynamicCircuitCurrentP2': p2,
+                                                                      'state_dynamicCircuitCurrentP3': p3})
+
+
+def charge_with(simulation: Simulation, number: int, limit: Currents):
+    """Set the limit of a charger, and charge with as much as it allows."""
+    simulation.set_state(f'sensor.charger_{number}_dynamic_circuit_limit', limit.p1,
+                         {'state_dynamicCircuitCurrentP1': limit.p1,
+                          'state_dynamicCircuitCurrentP2': limit.p2,
+                          'state_dynamicCircuitCurrentP3': limit.p3})
+    simulation.set_state(f'sensor.charger_{number}_current', min(limit.max(), 16) if limit.max() >= 6 else 0)
+
+
+class MeterApp:
+    """Meters measuring the other load, plus what each charger charges with on the phases its limit allows."""
+
+    def initialize(self):
+        self.chargers = range(1, self.args['chargers'] + 1)
+        for phase in (1, 2, 3):
+            self.listen_state(self.measure, f'sensor.other_load_l{phase}')
+        for number in self.chargers:
+            self.listen_state(self.measure, f'sensor.charger_{number}_current')
+        self.measure()
+
+    def measure(self, *args):
+        for phase in (1, 2, 3):
+            current = float(self.get_state(f'sensor.other_load_l{phase}'))
+            for number in self.chargers:
+                limit = self.get_state(f'sensor.charger_{number}_dynamic_circuit_limit',
+                                       f'state_dynamicCircuitCurrentP{phase}')
+                if limit >= 6:
+                    current += float(self.get_state(f'sensor.charger_{number}_current'))
+            self.set_state(f'sensor.current_l{phase}', current)
+
+
+class TimerApp:
+    def initialize(self):
+        self.ticks = []
+        self.delayed = []
+        self.run_every(lambda kwargs: self.ticks.append(self.get_now()), 'now', 60)
+        self.run_in(lambda kwargs: self.delayed.append(self.get_now()), 2 * 3600)
+
+
+class ListenerApp:
+    def initialize(self):
+        self.changes = []
+        self.listen_state(self.changed, 'sensor.temperature', phase='P1')
+
+    def changed(self, entity, attribute, old, new, kwargs):
+        self.changes.append((old, new, kwargs['phase']))
+
+
+if __name__ == '__main__':
+    unittest.main()
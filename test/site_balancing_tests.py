@@ -0,0 +1,165 @@
+import unittest
+from datetime import datetime
+
+from common import Currents, Phase
+from simulation import Simulation
+from site_balancing import CircuitDemand, SiteLoadBalancer, allocate_currents
+
+
+class AllocateCurrentsTests(unittest.TestCase):
+    def test__fair_share(self):
+        # Arrange
+        demands = [CircuitDemand('a', phases=3, max_current=16, min_current=6),
+                   CircuitDemand('b', phases=3, max_current=16, min_current=6)]
+
+        # Act
+        limits = allocate_currents(Currents(20, 25, 30), demands)
+
+        # Assert
+        self.assertSequenceEqual([Currents(10, 10, 10), Currents(10, 10, 10)], limits,
+                                 'The most loaded phase should be shared equally')
+
+    def test__fair_share__capped_at_max_current(self):
+        # Arrange
+        demands = [CircuitDemand('a', phases=3, max_current=8, min_current=6),
+                   CircuitDemand('b', phases=3, max_current=32, min_current=6)]
+
+        # Act
+        limits = allocate_currents(Currents(30, 30, 30), demands)
+
+        # Assert
+        self.assertSequenceEqual([Currents(8, 8, 8), Currents(22, 22, 22)], limits,
+                                 'What one circuit cannot use should go to the other')
+
+    def test__priority_by_departure(self):
+        # Arrange
+        demands = [CircuitDemand('late', phases=3, max_current=16, min_current=6, departure=datetime(2025, 1, 2, 8)),
+                   CircuitDemand('none', phases=3, max_current=16, min_current=6),
+                   CircuitDemand('early', phases=3, max_current=16, min_current=6, departure=datetime(2025, 1, 2, 6))]
+
+        # Act
+        limits = allocate_currents(Currents(25, 25, 25), demands, policy='priority')
+
+        # Assert
+        self.assertSequenceEqual([Currents(6, 6, 6), Currents(6, 6, 6), Currents(13, 13, 13)], limits,
+                                 'Each circuit should get its minimum, and the earliest departure the rest')
+
+    def test__priority_admission_by_departure(self):
+        # Arrange
+        demands = [CircuitDemand('none', phases=3, max_current=16, min_current=6),
+                   CircuitDemand('early', phases=3, max_current=16, min_current=6, departure=datetime(2025, 1, 2, 6))]
+
+        # Act
+        limits = allocate_currents(Currents(10, 10, 10), demands, policy='priority')
+
+        # Assert
+        self.assertSequenceEqual([Currents(0, 0, 0), Currents(10, 10, 10)], limits,
+                                 'Only the earliest departure should fit')
+
+    def test__phase_rotation(self):
+        # Arrange
+        demands = [CircuitDemand(str(i), phases=1, max_current=16, min_current=6) for i in range(3)]
+
+        # Act
+        limits = allocate_currents(Currents(16, 16, 16), demands)
+
+        # Assert
+        self.assertEqual({Phase.P1, Phase.P2, Phase.P3}, {limit.max_phase() for limit in limits},
+                         'One-phase circuits should be spread over the phases')
+        self.assertTrue(all(limit.max() == 16 for limit in limits), 'Each should get its own phase')
+
+    def test__one_phase_keeps_charging_phase(self):
+        # Arrange
+        demands = [CircuitDemand('a', phases=1, max_current=16, min_current=6, phase=Phase.P3),
+                   CircuitDemand('b', phases=1, max_current=16, min_current=6)]
+
+        # Act
+        limits = allocate_currents(Currents(20, 20, 20), demands)
+
+        # Assert
+        self.assertEqual(Currents(0, 0, 16), limits[0], 'A charging circuit should stay on its phase')
+        self.assertEqual(16, limits[1].max(), 'The other circuit should use another phase')
+        self.assertNotEqual(Phase.P3, limits[1].max_phase(), 'The other circuit should use another phase')
+
+    def test__not_enough_for_minimum(self):
+        # Arrange
+        demands = [CircuitDemand('a', phases=3, max_current=16, min_current=6)]
+
+        # Act
+        limits = allocate_currents(Currents(10, 5, 10), demands)
+
+        # Assert
+        self.assertSequenceEqual([Currents(0, 0, 0)], limits, 'No charging below the minimum current')
+
+
+class SiteLoadBalancerTests(unittest.TestCase):
+    """SiteLoadBalancer in the simulation, with two one-phase chargers, on L1 and L2, behind a 25 A main fuse."""
+
+    def setUp(self):
+        self.simulation = Simulation(start=datetime(2025, 1, 1))
+        self.addCleanup(self.simulation.close)
+        self.chargers = []
+        for number, limit in ((1, Currents(16, 0, 0)), (2, Currents(0, 16, 0))):
+            self.simulation.set_state(f'input_boolean.charger_{number}_charge_now', 'on')
+            self.simulation.set_state(f'input_datetime.charger_{number}_departure', '2025-01-01 07:00:00')
+            self.simulation.set_state(f'sensor.charger_{number}_status', 'charging',
+                                      {'circuit_ratedCurrent': 16, 'site_ratedCurrent': 25, 'circuit_id': f'C{number}'})
+            self.simulation.set_state(f'sensor.charger_{number}_dynamic_circuit_limit', limit.p1,
+                                      {'state_dynamicCircuitCurrentP1': limit.p1,
+                                       'state_dynamicCircuitCurrentP2': limit.p2,
+                                       'state_dynamicCircuitCurrentP3': limit.p3})
+            self.simulation.set_state(f'sensor.charger_{number}_current', 16)
+            self.chargers.append({'charger_status_entity_id': f'sensor.charger_{number}_status',
+                                  'charger_current_entity_id': f'sensor.charger_{number}_current',
+                                  'circuit_dynamic_limit_entity_id': f'sensor.charger_{number}_dynamic_circuit_limit',
+                                  'charge_now_entity_id': f'input_boolean.charger_{number}_charge_now',
+                                  'departure_time_entity_id': f'input_datetime.charger_{number}_departure'})
+        for entity_id, state in (('sensor.current_l1', 21), ('sensor.current_l2', 21), ('sensor.current_l3', 5)):
+            self.simulation.set_state(entity_id, state)
+
+    def start(self) -> SiteLoadBalancer:
+        return self.simulation.add_app(SiteLoadBalancer, 'site_load_balancing', {
+            'current_l1_entity_id': 'sensor.current_l1',
+            'current_l2_entity_id': 'sensor.current_l2',
+            'current_l3_entity_id': 'sensor.current_l3',
+            'chargers': self.chargers})
+
+    def sent_limits(self) -> list[tuple[str, float, float, float]]:
+        return [(data['circuit_id'], data['currentP1'], data['currentP2'], data['currentP3'])
+                for _, _, data in self.simulation.service_calls]
+
+    def test__current_sensor_unavailable(self):
+        # Arrange
+        self.simulation.set_state('sensor.current_l1', 'unavailable')
+
+        # Act
+        balancer = self.start()
+        self.simulation.run_for(10)
+        passes = balancer.balance_passes
+        self.simulation.set_state('sensor.current_l1', 31)
+        self.simulation.run_for(10)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'Should start, and balance, without errors')
+        self.assertEqual(1, passes, 'The pass at startup should be counted, even if it balanced nothing')
+        self.assertEqual([('C1', 7, 0, 0)], self.sent_limits(),
+                         'Should balance when the sensor is available again')
+
+    def test__departure_time_unavailable(self):
+        # Arrange
+        self.simulation.set_state('input_datetime.charger_1_departure', 'unavailable')
+        self.simulation.set_state('input_datetime.charger_2_departure', '')
+        balancer = self.start()
+
+        # Act
+        self.simulation.set_state('sensor.current_l1', 31)
+        self.simulation.run_for(10)
+
+        # Assert
+        self.assertEqual([], self.simulation.errors, 'No errors')
+        self.assertEqual(2, balancer.balance_passes)
+        self.assertEqual([('C1', 7, 0, 0)], self.sent_limits(), 'The chargers should still be balanced')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from simulation import Simulation
+from state_of_charge import StateOfChargeCalculator
+
+
+class StateOfChargeCalculatorTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, 'state_of_charge.json')
+        self.simulation = Simulation(start=datetime(2025, 1, 1, 18))
+        self.addCleanup(self.simulation.close)
+        self.simulation.set_state('sensor.charger_energy', 100)
+        self.simulation.set_state('input_number.last_known_state_of_charge', 50)
+        self.simulation.set_state('input_number.estimated_state_of_charge', 50)
+        self.simulation.set_state('sensor.car_soc_d', 50)
+        self.calculator = self.start_calculator()
+
+    def start_calculator(self) -> StateOfChargeCalculator:
+        return self.simulation.add_app(StateOfChargeCalculator, 'state_of_charge', {
+            'battery_size_kWh': 50,
+            'charger_energy_entity_id': 'sensor.charger_energy',
+            'last_known_state_of_charge_entity_id': 'input_number.last_known_state_of_charge',
+            'estimated_state_of_charge_entity_id': 'input_number.estimated_state_of_charge',
+            'car_soc_d_entity_id': 'sensor.car_soc_d',
+            'state_file': self.state_file})
+
+    def charge(self, *energy_readings):
+        for energy in energy_readings:
+            self.simulation.run_for(600)
+            self.simulation.set_state('sensor.charger_energy', energy)
+        self.simulation.run_for(1)
+
+    def test__energy_changes__history_queried_once(self):
+        # Act
+        self.charge(101, 102.5, 105)
+
+        # Assert
+        self.assertEqual('60', self.simulation.get_state('input_number.estimated_state_of_charge'),
+                         '5 kWh of 50 kWh is 10 %')
+        self.assertEqual(1, self.calculator.history_queries, 'History should only be queried at start')
+        self.assertEqual(3, self.calculator.history_queries_avoided, 'History queries avoided')
+
+    def test__last_known_state_of_charge_changes__history_queried(self):
+        # Arrange
+        self.charge(101)
+
+        # Act
+        self.simulation.set_state('sensor.car_soc_d', 70)
+        self.charge(103.5)
+
+        # Assert
+        self.assertEqual('75', self.simulation.get_state('input_number.estimated_state_of_charge'),
+                         '2.5 kWh of 50 kWh since the last known state of charge is 5 %')
+        self.assertEqual(2, self.calculator.history_queries, 'History should be queried for the new baseline')
+
+    def test__unavailable_reading__falls_back_to_history(self):
+        # Act
+        self.charge(101)
+        self.simulation.set_state('sensor.charger_energy', 'unavailable')
+        self.simulation.set_state('sensor.charger_energy', 102)
+        self.simulation.run_for(1)
+        self.charge(103)
+
+        # Assert
+        self.assertEqual('56', self.simulation.get_state('input_number.estimated_state_of_charge'),
+                         '3 kWh of 50 kWh is 6 %')
+        self.assertEqual(3, self.calculator.history_queries, 'History should be queried for both readings at the gap')
+        self.assertEqual(2, self.calculator.history_queries_avoided, 'Readings without a gap should be added')
+
+    def test__restart__resumes_without_history(self):
+        # Arrange
+        self.charge(101, 102)
+
+        # Act
+        self.simulation.set_state('sensor.charger_energy', 104)  # While restarting.
+        restarted = self.start_calculator()
+
+        # Assert
+        self.assertEqual('58', self.simulation.get_state('input_number.estimated_state_of_charge'),
+                         '4 kWh of 50 kWh is 8 %')
+        self.assertEqual(0, restarted.history_queries, 'History should not be queried after the restart')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from scheduling import Scheduler
+from simulation import Simulation
+from state_store import StateStore
+
+
+class StateStoreTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'state.json')
+
+    def test__set__persisted(self):
+        # Arrange
+        store = StateStore(self.path)
+
+        # Act
+        store.set('plan', {'schedule': [1, 2]})
+        store.set('plan', {'schedule': [1, 2]})
+
+        # Assert
+        self.assertEqual({'schedule': [1, 2]}, StateStore(self.path).get('plan'), 'Should be read back')
+        self.assertEqual(1, store.writes, 'Unchanged values should not be written')
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"), 'No temporary file should be left')
+
+    def test__unreadable_file__starts_empty(self):
+        # Arrange
+        with open(self.path, 'w') as file:
+            file.write('{"plan": ')
+
+        # Act
+        store = StateStore(self.path)
+
+        # Assert
+        self.assertIsNone(store.get('plan'))
+
+
+class SchedulerRestartTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, 'scheduling.json')
+
+    def start_scheduler(self) -> Scheduler:
+        simulation = Simulation(start=datetime(2025, 1, 1, 18))
+        self.addCleanup(simulation.close)
+        midnight = datetime(2025, 1, 1, tzinfo=simulation.time_zone)
+        raw = [{'start': (midnight + timedelta(hours=h)).isoformat(),
+                'end': (midnight + timedelta(hours=h + 1)).isoformat(),
+                'value': (h * 7) % 11} for h in range(48)]
+        simulation.set_state('sensor.nordpool', 1, {'raw_today': raw[:24], 'raw_tomorrow': raw[24:],
+                                                    'currency': 'SEK'})
+        for entity_id, state in (('input_boolean.car_smart_charging', 'on'),
+                                 ('input_boolean.car_charge_now', 'off'),
+                                 ('input_number.estimated_state_of_charge', 80),
+                                 ('sensor.wican_soc_d', 80),
+                                 ('input_datetime.anticipated_departure_time', '2025-01-02 07:00:00')):
+            simulation.set_state(entity_id, state)
+        simulation.set_state('sensor.charger_status', 'awaiting_start', {'circuit_ratedCurrent': 16})
+        scheduler = simulation.add_app(Scheduler, 'scheduling', {
+            'charger_status_entity_id': 'sensor.charger_status',
+            'smart_charging_entity_id': 'input_boolean.car_smart_charging',
+            'departure_time_entity_id': 'input_datetime.anticipated_departure_time',
+            'charge_now_entity_id': 'input_boolean.car_charge_now',
+            'state_of_charge_entity_id': 'input_number.estimated_state_of_charge',
+            'last_known_state_of_charge_entity_id': 'sensor.wican_soc_d',
+            'price_entity_id': 'sensor.nordpool',
+            'state_file': self.state_file})
+        simulation.run_for(10)
+        return scheduler
+
+    def test__restart__plan_resumed(self):
+        # Arrange
+        before = self.start_scheduler()
+
+        # Act
+        after = self.start_scheduler()
+
+        # Assert
+        self.assertEqual(1, before.full_replans, 'The plan should be made before the restart')
+        self.assertEqual(0, after.full_replans, 'The plan should not be made again after the restart')
+        self.assertEqual(1, after.incremental_replans, 'The plan should be resumed')
+        self.assertSequenceEqual([slot['start'] for slot in before.schedule],
+                                 [slot['start'] for slot in after.schedule], 'The same plan')
+
+    def test__state_of_charge_changed__plan_stored_off_the_event_loop(self):
+        # Arrange
+        scheduler = self.start_scheduler()
+        price_table_dumps = []
+        writing_threads = []
+        price_table_dump = scheduler.price_table.dump
+        store_update = scheduler.state_store.update
+
+        def dump():
+            price_table_dumps.append(1)
+            return price_table_dump()
+
+        def update(values):
+            writing_threads.append(threading.current_thread())
+            store_update(values)
+        scheduler.price_table.dump = dump
+        scheduler.state_store.update = update
+
+        # Act
+        scheduler.simulation.set_state('input_number.estimated_state_of_charge', 90)
+        scheduler.simulation.run_for(10)
+
+        # Assert
+        self.assertEqual([], scheduler.simulation.errors, 'No errors')
+        self.assertEqual(1, scheduler.incremental_replans, 'The plan should be trimmed')
+        self.assertEqual([], price_table_dumps, 'The prices have not changed, and should not be dumped')
+        self.assertNotEqual([], writing_threads, 'The trimmed plan should be stored')
+        self.assertNotIn(threading.current_thread(), writing_threads, 'The event loop should not wait for the disk')
+        self.assertEqual(scheduler.schedule[-1]['end'].isoformat(),
+                         StateStore(self.state_file).get('plan')['schedule'][-1]['end'], 'The trimmed plan')
+
+
+if __name__ == '__main__':
+    unittest.main()